@@ -0,0 +1,80 @@
+"""
+Measure the local command index with many stored prompts.
+
+    python benchmarks/index_lookup.py [--entries 100000] [--queries 200]
+
+Reports the time to build the index from scratch, to load it again from its
+snapshot, and the latency percentiles of a lookup.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shell_ai.command_index import CommandIndex  # noqa: E402
+
+VERBS = ["list", "show", "find", "delete", "count", "compress", "extract", "copy", "move", "search", "watch", "sort"]
+OBJECTS = ["files", "directories", "processes", "log lines", "docker containers", "git branches", "open ports",
+           "python files", "large files", "hidden files", "environment variables", "disk usage", "symlinks"]
+QUALIFIERS = ["in this directory", "recursively", "older than a week", "by size", "modified today", "owned by root",
+              "matching error", "in the home folder", "on the remote host", "as json", "without the header", ""]
+
+
+def random_prompt(rng):
+    return " ".join(filter(None, [rng.choice(VERBS), rng.choice(OBJECTS), rng.choice(QUALIFIERS), f"#{rng.randrange(10 ** 6)}"]))
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.sqlite3")
+        index = CommandIndex(path=path)
+        # Fill the table directly, one transaction is much faster than `add` per entry
+        connection = index._connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO accepted (prompt, command, uses, last_used) VALUES (?, ?, 1, 0)",
+                ((random_prompt(rng), f"command {i}") for i in range(args.entries)),
+            )
+
+        start = time.perf_counter()
+        index.search("warm up")
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = CommandIndex(path=path)
+        index.search("warm up")
+        load = time.perf_counter() - start
+
+        queries = [random_prompt(rng) for _ in range(args.queries)]
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query)
+            latencies.append(time.perf_counter() - start)
+
+    print(f"entries:           {args.entries}")
+    print(f"build from scratch: {build * 1000:8.1f} ms")
+    print(f"load from snapshot: {load * 1000:8.1f} ms")
+    print(f"lookup mean:        {statistics.mean(latencies) * 1000:8.2f} ms")
+    for fraction in (0.5, 0.95, 0.99):
+        print(f"lookup p{int(fraction * 100):<2}:         {percentile(latencies, fraction) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
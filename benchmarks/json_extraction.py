@@ -0,0 +1,73 @@
+"""
+Compare command extraction from model responses with and without the Markdown render.
+
+    python benchmarks/json_extraction.py [--corpus benchmarks/data/responses.jsonl] [--repeat 2000]
+
+The corpus holds one `{"provider": ..., "content": ...}` response per line,
+in the shapes the providers return: fenced and bare JSON, prose around the
+JSON, trailing commas, single quotes and raw newlines. For every response the
+time of `parse_commands` is compared to rendering it with mistune and
+`json.loads`, which is how commands were extracted before.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shell_ai.code_parser import _commands_from, code_parser, parse_commands  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "responses.jsonl")
+
+
+def render_and_load(content):
+    try:
+        return _commands_from(json.loads(code_parser(content)))
+    except json.JSONDecodeError:
+        return []
+
+
+def time_per_call(function, content, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(content)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(args.corpus) as corpus:
+        responses = [json.loads(line) for line in corpus if line.strip()]
+
+    print(f"{'provider':<9} {'mistune':>10} {'scanner':>10} {'speedup':>8}  commands (mistune / scanner)")
+    mistune_times, scanner_times = [], []
+    mistune_parsed = scanner_parsed = 0
+    for response in responses:
+        content = response["content"]
+        mistune_time = time_per_call(render_and_load, content, args.repeat)
+        scanner_time = time_per_call(parse_commands, content, args.repeat)
+        mistune_times.append(mistune_time)
+        scanner_times.append(scanner_time)
+        mistune_commands = render_and_load(content)
+        scanner_commands = parse_commands(content)
+        mistune_parsed += bool(mistune_commands)
+        scanner_parsed += bool(scanner_commands)
+        print(
+            f"{response['provider']:<9} {mistune_time * 1e6:8.1f}us {scanner_time * 1e6:8.1f}us "
+            f"{mistune_time / scanner_time:7.1f}x  {len(mistune_commands)} / {len(scanner_commands)}"
+        )
+
+    print()
+    print(f"mean per response: mistune {statistics.mean(mistune_times) * 1e6:.1f}us, scanner {statistics.mean(scanner_times) * 1e6:.1f}us")
+    print(f"responses with commands: mistune {mistune_parsed}/{len(responses)}, scanner {scanner_parsed}/{len(responses)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+An OpenAI-compatible chat completions server answering with canned shell commands.
+
+    python benchmarks/mock_server.py [--port 8765] [--latency lognormal:0.25,0.5]
+        [--token-delay 0.005] [--malformed-rate 0.1] [--error-rate 0.05]
+        [--explain-rate 0.5] [--rpm 60] [--tpm 20000] [--burst-seconds 10] [--seed 0]
+
+Point shai at it with `OPENAI_API_BASE=http://127.0.0.1:8765/v1` (or
+`OLLAMA_API_BASE`) to run it without network access or API costs.
+
+Latency to the first token is drawn per request from `fixed:SECONDS`,
+`uniform:LOW,HIGH` or `lognormal:MEDIAN,SIGMA`, after which every token
+(four characters) takes `--token-delay` seconds to generate. Streamed
+responses (`"stream": true`) send each token as it is generated. With `--malformed-rate` a share
+of the answers contain no usable JSON, with `--error-rate` a share of the
+requests fail with HTTP 500, and with `--explain-rate` a share of the answers
+go on to explain the command after the JSON, as chatty models do.
+
+`--rpm` and `--tpm` enforce requests and tokens per minute over bursts of
+`--burst-seconds`, answering with HTTP 429 and a Retry-After when exceeded.
+Every response carries `x-ratelimit-*` headers like OpenAI's and Groq's.
+`GET /stats` returns how many requests were answered and rate limited.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMMANDS = [
+    "ls -la",
+    "ls -lah --group-directories-first",
+    "find . -maxdepth 1 -type f",
+    "du -sh * | sort -rh | head -n 10",
+    "df -h",
+    "git status --short",
+    "ps aux --sort=-%cpu | head",
+    "grep -rn TODO .",
+]
+
+MALFORMED_RESPONSES = [
+    "I'm sorry, I can't help with that request.",
+    '```json\n{"command": "ls -la',
+    "You could use the `ls` command with the `-la` flags to list the files.",
+]
+
+EXPLANATION = (
+    "\n\nThis command does what you asked for. Every flag is explained in its manual page, "
+    "run `man` followed by the name of the command to read it. Be careful when running commands "
+    "that modify or delete files, and check the paths before you press enter."
+)
+
+BATCH_SIZE_PATTERN = re.compile(r"Generate (\d+) different")
+
+
+def parse_latency(spec):
+    """
+    Turn `fixed:S`, `uniform:LOW,HIGH` or `lognormal:MEDIAN,SIGMA` into a function drawing a delay in seconds.
+    """
+    kind, _, values = spec.partition(":")
+    numbers = [float(value) for value in values.split(",") if value]
+    if kind == "fixed" and len(numbers) == 1:
+        return lambda rng: numbers[0]
+    if kind == "uniform" and len(numbers) == 2:
+        return lambda rng: rng.uniform(*numbers)
+    if kind == "lognormal" and len(numbers) == 2:
+        median, sigma = numbers
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Invalid latency distribution {spec!r}")
+
+
+class RateLimit:
+    """
+    A budget of `per_minute` units, refilled continuously, of which at most `burst_seconds` worth can be spent at once.
+    """
+
+    def __init__(self, per_minute, burst_seconds):
+        self.per_minute = per_minute
+        self.capacity = max(1.0, per_minute * burst_seconds / 60)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait(self, amount):
+        """
+        Return the seconds until `amount` is available, 0 when it is.
+        """
+        self._refill()
+        return max(0.0, min(amount, self.capacity) - self.level) * 60 / self.per_minute
+
+    def spend(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def headers(self, name):
+        return {
+            f"x-ratelimit-limit-{name}": str(int(self.per_minute)),
+            f"x-ratelimit-remaining-{name}": str(int(self.level)),
+            f"x-ratelimit-reset-{name}": f"{(self.capacity - self.level) * 60 / self.per_minute:.3f}s",
+        }
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency="fixed:0.1", token_delay=0.0, malformed_rate=0.0, error_rate=0.0, explain_rate=0.0,
+                 rpm=None, tpm=None, burst_seconds=10, seed=None):
+        super().__init__(address, _Handler)
+        self.draw_latency = parse_latency(latency)
+        self.token_delay = token_delay
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.explain_rate = explain_rate
+        self.rng = random.Random(seed)
+        # The handlers run on one thread per connection
+        self.rng_lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.limits = {}
+        if rpm:
+            self.limits["requests"] = RateLimit(rpm, burst_seconds)
+        if tpm:
+            self.limits["tokens"] = RateLimit(tpm, burst_seconds)
+
+    def admit(self, tokens):
+        """
+        Return the rate limit headers and the seconds to retry after, None when the request is admitted.
+        """
+        amounts = {"requests": 1, "tokens": tokens}
+        with self.rng_lock:
+            retry_after = max((limit.wait(amounts[name]) for name, limit in self.limits.items()), default=0.0)
+            if retry_after:
+                # Like at the providers, a rejected request spends nothing
+                self.rate_limited += 1
+            else:
+                for name, limit in self.limits.items():
+                    limit.spend(amounts[name])
+            headers = {}
+            for name, limit in self.limits.items():
+                headers.update(limit.headers(name))
+            return headers, retry_after or None
+
+    def draw(self, batch_size):
+        """
+        Return the latency, whether to fail and the content of the next answer.
+        """
+        with self.rng_lock:
+            self.requests += 1
+            latency = self.draw_latency(self.rng)
+            if self.rng.random() < self.error_rate:
+                return latency, True, None
+            if self.rng.random() < self.malformed_rate:
+                return latency, False, self.rng.choice(MALFORMED_RESPONSES)
+            if batch_size:
+                answer = {"commands": self.rng.sample(COMMANDS, min(batch_size, len(COMMANDS)))}
+            else:
+                answer = {"command": self.rng.choice(COMMANDS)}
+            explanation = EXPLANATION if self.rng.random() < self.explain_rate else ""
+            return latency, False, "```json\n" + json.dumps(answer) + "\n```" + explanation
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        # Connection pre-warming only needs the connection to be accepted
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, {"requests": self.server.requests, "rate_limited": self.server.rate_limited})
+            return
+        self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        system = " ".join(str(message.get("content", "")) for message in request.get("messages", []) if message.get("role") == "system")
+        # The batch prompts ask for a "commands" list of as many entries as the request names
+        batch_size = 0
+        if '"commands"' in system:
+            user = " ".join(str(message.get("content", "")) for message in request.get("messages", []) if message.get("role") == "user")
+            match = BATCH_SIZE_PATTERN.search(user)
+            batch_size = int(match.group(1)) if match else 3
+        choices = max(1, int(request.get("n") or 1))
+
+        text = " ".join(str(message.get("content", "")) for message in request.get("messages", []))
+        headers, retry_after = self.server.admit(len(text) // 4 + int(request.get("max_tokens") or 64 * choices))
+        if retry_after is not None:
+            headers["retry-after"] = f"{retry_after:.3f}"
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "tokens", "code": "rate_limit_exceeded"}}, headers)
+            return
+
+        drawn = [self.server.draw(batch_size) for _ in range(choices)]
+        time.sleep(max(latency for latency, _, _ in drawn))
+        if any(failed for _, failed, _ in drawn):
+            self._send_json(500, {"error": {"message": "Injected failure", "type": "server_error"}}, headers)
+            return
+        contents = [content for _, _, content in drawn]
+        if request.get("stream"):
+            self._stream(request, contents[0], headers, prompt_tokens=len(system.split()))
+            return
+        # The whole answer has to be generated before it is sent
+        time.sleep(self.server.token_delay * max(len(content) for content in contents) / 4)
+        completion_tokens = sum(len(content.split()) for content in contents)
+        self._send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [
+                {"index": index, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                for index, content in enumerate(contents)
+            ],
+            "usage": {"prompt_tokens": len(system.split()), "completion_tokens": completion_tokens,
+                      "total_tokens": len(system.split()) + completion_tokens},
+        }, headers)
+
+    def _stream(self, request, content, headers, prompt_tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            })
+
+        try:
+            send_event(chunk({"role": "assistant", "content": ""}))
+            # Roughly one token per chunk
+            for start in range(0, len(content), 4):
+                if self.server.token_delay:
+                    time.sleep(self.server.token_delay)
+                send_event(chunk({"content": content[start:start + 4]}))
+            send_event(chunk({}, finish_reason="stop"))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                completion_tokens = (len(content) + 3) // 4
+                send_event(json.dumps({
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                }))
+            send_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:0.25,0.5")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--explain-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=None)
+    parser.add_argument("--tpm", type=float, default=None)
+    parser.add_argument("--burst-seconds", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockServer(
+        (args.host, args.port),
+        latency=args.latency,
+        token_delay=args.token_delay,
+        malformed_rate=args.malformed_rate,
+        error_rate=args.error_rate,
+        explain_rate=args.explain_rate,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        burst_seconds=args.burst_seconds,
+        seed=args.seed,
+    )
+    print(f"Mock LLM server listening on http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
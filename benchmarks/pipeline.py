@@ -0,0 +1,198 @@
+"""
+Time the suggestion pipeline end to end against the mock LLM server.
+
+    python benchmarks/pipeline.py [--counts 1,3,5,8] [--rounds 20] [--provider openai]
+        [--engines asyncio,threads] [--strategies parallel,batch]
+        [--latency lognormal:0.25,0.5] [--malformed-rate 0.1] [--error-rate 0.0]
+        [--explain-rate 0.5] [--no-stream] [--json results.json]
+
+`benchmarks/mock_server.py` is started in a subprocess, so its CPU time is not
+counted, and the provider is pointed at it through `OPENAI_API_BASE` or
+`OLLAMA_API_BASE`. For every engine, strategy and suggestion count a
+`SuggestionService` answers `--rounds` prompts through the real request
+fan-out and response parsing, with the cache and the command index turned off.
+
+Reported per configuration are the time to the first suggestion and to the
+last one, the CPU time the process spent per round and per suggestion, and
+how many suggestions a round produced on average. A cold run in a fresh
+interpreter measures the startup cost: imports, building the client and the
+first round.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from shell_ai.suggestions import SuggestionService  # noqa: E402
+
+MOCK_SERVER = os.path.join(ROOT, "benchmarks", "mock_server.py")
+
+PROMPTS = [
+    "list all files including hidden ones",
+    "show the largest directories here",
+    "how much disk space is left",
+    "which processes use the most cpu",
+    "show uncommitted changes",
+]
+
+BASE_URL_SETTINGS = {"openai": "OPENAI_API_BASE", "ollama": "OLLAMA_API_BASE"}
+
+COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+from shell_ai.suggestions import SuggestionService
+imported = time.perf_counter()
+service = SuggestionService(provider=sys.argv[1], config={}, temperature=0.15, suggestion_count=int(sys.argv[2]), prewarm=False)
+service.get_chat()
+built = time.perf_counter()
+first = None
+for _ in service.iter_suggestions("list all files including hidden ones", use_cache=False):
+    first = first or time.perf_counter()
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "client": built - imported, "first": (first or done) - built, "round": done - built}))
+"""
+
+
+def start_mock_server(args):
+    server = subprocess.Popen(
+        [
+            sys.executable, MOCK_SERVER, "--port", "0",
+            "--latency", args.latency,
+            "--token-delay", str(args.token_delay),
+            "--malformed-rate", str(args.malformed_rate),
+            "--error-rate", str(args.error_rate),
+            "--explain-rate", str(args.explain_rate),
+            "--seed", "0",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    # The server announces the port it got on its first line
+    base_url = server.stdout.readline().strip().rsplit(" ", 1)[-1]
+    return server, base_url
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_rounds(service, rounds):
+    first_times, total_times, cpu_times, counts = [], [], [], []
+    for number in range(rounds):
+        prompt = PROMPTS[number % len(PROMPTS)]
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        first = None
+        count = 0
+        for _ in service.iter_suggestions(prompt, use_cache=False):
+            if first is None:
+                first = time.perf_counter() - start
+            count += 1
+        total_times.append(time.perf_counter() - start)
+        cpu_times.append(time.process_time() - cpu_start)
+        first_times.append(first if first is not None else total_times[-1])
+        counts.append(count)
+    return {
+        "first_p50": percentile(first_times, 0.5),
+        "first_p95": percentile(first_times, 0.95),
+        "total_p50": percentile(total_times, 0.5),
+        "total_p95": percentile(total_times, 0.95),
+        "cpu_per_round": statistics.mean(cpu_times),
+        "cpu_per_suggestion": sum(cpu_times) / max(sum(counts), 1),
+        "suggestions": statistics.mean(counts),
+    }
+
+
+def cold_start(provider, count, env):
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", COLD_START, provider, str(count)],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", default="1,3,5,8")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--provider", choices=sorted(BASE_URL_SETTINGS), default="openai")
+    parser.add_argument("--engines", default="asyncio,threads")
+    parser.add_argument("--strategies", default="parallel,batch")
+    parser.add_argument("--latency", default="lognormal:0.25,0.5")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--malformed-rate", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--explain-rate", type=float, default=0.5)
+    parser.add_argument("--no-stream", action="store_true", help="Wait for whole responses instead of streaming them.")
+    parser.add_argument("--json", help="Also write the results to this file, to compare releases.")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args)
+    os.environ[BASE_URL_SETTINGS[args.provider]] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ.setdefault("OPENAI_MODEL", "mock")
+    os.environ.setdefault("OLLAMA_MODEL", "mock")
+    try:
+        counts = [int(count) for count in args.counts.split(",")]
+        results = []
+        print(
+            f"mock server {base_url}, latency {args.latency}, malformed {args.malformed_rate:.0%}, "
+            f"errors {args.error_rate:.0%}, explained {args.explain_rate:.0%}, streaming {not args.no_stream}"
+        )
+        print(
+            f"{'engine':<8} {'strategy':<9} {'count':>5} {'first p50':>10} {'first p95':>10} "
+            f"{'total p50':>10} {'total p95':>10} {'cpu/round':>10} {'cpu/sugg':>9} {'suggs':>6}"
+        )
+        for engine in args.engines.split(","):
+            for strategy in args.strategies.split(","):
+                for count in counts:
+                    service = SuggestionService(
+                        provider=args.provider,
+                        config={},
+                        temperature=0.15,
+                        suggestion_count=count,
+                        strategy=strategy,
+                        engine=engine,
+                        prewarm=False,
+                        stream=not args.no_stream,
+                    )
+                    # Build the client and open the connections outside of the measured rounds
+                    run_rounds(service, 1)
+                    result = run_rounds(service, args.rounds)
+                    result.update(engine=engine, strategy=strategy, count=count)
+                    results.append(result)
+                    print(
+                        f"{engine:<8} {strategy:<9} {count:>5} "
+                        f"{result['first_p50'] * 1000:>8.1f}ms {result['first_p95'] * 1000:>8.1f}ms "
+                        f"{result['total_p50'] * 1000:>8.1f}ms {result['total_p95'] * 1000:>8.1f}ms "
+                        f"{result['cpu_per_round'] * 1000:>8.1f}ms {result['cpu_per_suggestion'] * 1000:>7.1f}ms "
+                        f"{result['suggestions']:>6.1f}"
+                    )
+
+        cold = cold_start(args.provider, counts[-1], dict(os.environ, PYTHONPATH=ROOT))
+        print()
+        print(
+            f"cold start ({counts[-1]} suggestions): process {cold['process'] * 1000:.0f}ms, "
+            f"imports {cold['import'] * 1000:.0f}ms, client {cold['client'] * 1000:.0f}ms, "
+            f"first suggestion {cold['first'] * 1000:.0f}ms, round {cold['round'] * 1000:.0f}ms"
+        )
+        if args.json:
+            with open(args.json, "w") as output:
+                json.dump({"settings": vars(args), "rounds": results, "cold_start": cold}, output, indent=2)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
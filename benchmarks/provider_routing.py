@@ -0,0 +1,85 @@
+"""
+Route requests between fake providers that inject delays and errors.
+
+    python benchmarks/provider_routing.py [--requests 200] [--race 1]
+
+Every fake provider answers after a random delay and fails with a fixed
+probability, one of them goes down half way through. The script prints which
+provider answered, the latency of every request as the caller saw it, and
+the statistics the router collected.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shell_ai.router import ProviderRouter  # noqa: E402
+
+
+class FakeProvider:
+    def __init__(self, name, median, spread, error_rate):
+        self.name = name
+        self.median = median
+        self.spread = spread
+        self.error_rate = error_rate
+        self.down = False
+
+    async def answer(self, rng):
+        await asyncio.sleep(max(0.001, rng.gauss(self.median, self.spread)))
+        if self.down or rng.random() < self.error_rate:
+            raise ConnectionError(f"{self.name} failed")
+        return [f"echo answered by {self.name}"]
+
+
+async def run(providers, requests, race, rng):
+    router = ProviderRouter([provider.name for provider in providers], race=race, failure_threshold=3, cooldown=1)
+    by_name = {provider.name: provider for provider in providers}
+    latencies = []
+    winners = {}
+    failures = 0
+    for number in range(requests):
+        if number == requests // 2:
+            # The fastest provider goes down, traffic has to move elsewhere
+            providers[0].down = True
+        start = time.perf_counter()
+        try:
+            result = await router.arun(lambda name: by_name[name].answer(rng))
+        except ConnectionError:
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        winner = result[0].rsplit(" ", 1)[-1]
+        winners[winner] = winners.get(winner, 0) + 1
+    return router, latencies, winners, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--race", type=int, default=1)
+    args = parser.parse_args()
+
+    providers = [
+        FakeProvider("fast-flaky", median=0.03, spread=0.01, error_rate=0.1),
+        FakeProvider("steady", median=0.06, spread=0.01, error_rate=0.01),
+        FakeProvider("slow", median=0.15, spread=0.05, error_rate=0.0),
+    ]
+    router, latencies, winners, failures = asyncio.run(run(providers, args.requests, args.race, random.Random(0)))
+
+    latencies.sort()
+    print(f"requests: {args.requests}, race: {args.race}, failed: {failures}")
+    print(f"caller latency p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms")
+    print(f"answered by: {winners}")
+    for name, summary in router.summary().items():
+        p50 = f"{summary['p50'] * 1000:.1f} ms" if summary["p50"] is not None else "-"
+        p95 = f"{summary['p95'] * 1000:.1f} ms" if summary["p95"] is not None else "-"
+        print(f"  {name:<11} p50 {p50:>9}  p95 {p95:>9}  errors {summary['error_rate']:.0%}  open {summary['open']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Run a burst of prompts against a mock server that enforces rate limits, with and without the scheduler.
+
+    python benchmarks/rate_limits.py [--prompts 40] [--workers 8] [--count 3]
+        [--rpm 120] [--tpm 40000] [--burst-seconds 5]
+
+Each mode gets a fresh `benchmarks/mock_server.py` with the same limits. The
+prompts are sent through `run_batch` like `shai --batch` does, with the
+parallel strategy. Without the scheduler every request goes out at once and
+only the OpenAI client's own retries handle 429s, with it requests are paced
+by a `RequestScheduler`. For both the script prints how many prompts were
+answered, the mean number of suggestions per prompt, how many requests the
+server answered and rejected, and how long the burst took.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from shell_ai.batch import run_batch  # noqa: E402
+from shell_ai.scheduler import RequestScheduler  # noqa: E402
+from shell_ai.suggestions import SuggestionService  # noqa: E402
+
+MOCK_SERVER = os.path.join(ROOT, "benchmarks", "mock_server.py")
+
+
+def run_mode(args, scheduled):
+    server = subprocess.Popen(
+        [
+            sys.executable, MOCK_SERVER, "--port", "0", "--latency", "fixed:0.1", "--token-delay", "0",
+            "--rpm", str(args.rpm), "--tpm", str(args.tpm), "--burst-seconds", str(args.burst_seconds),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    base_url = server.stdout.readline().strip().rsplit(" ", 1)[-1]
+    os.environ["OPENAI_API_BASE"] = base_url
+    try:
+        scheduler = RequestScheduler(max_concurrency=args.workers * args.count) if scheduled else None
+        service = SuggestionService(
+            provider="openai",
+            config={},
+            temperature=0.15,
+            suggestion_count=args.count,
+            max_concurrency=args.workers * args.count,
+            prewarm=False,
+            scheduler=scheduler,
+        )
+        service.get_chat()
+        output = io.StringIO()
+        prompts = [f"show the {number} largest files in this directory" for number in range(args.prompts)]
+        start = time.perf_counter()
+        run_batch(service, prompts, output, workers=args.workers, use_cache=False)
+        elapsed = time.perf_counter() - start
+        with urllib.request.urlopen(base_url.rsplit("/v1", 1)[0] + "/stats") as response:
+            stats = json.load(response)
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    failed = sum(1 for result in results if "error" in result)
+    # Fewer suggestions than requested also come from duplicate answers
+    suggestions = sum(len(result.get("candidates") or []) for result in results) / len(results)
+    print(
+        f"{'scheduler' if scheduled else 'unscheduled':<12} {len(results) - failed:>9} {failed:>7} {suggestions:>12.2f} "
+        f"{stats['requests']:>9} {stats['rate_limited']:>8} {elapsed:>8.1f}s"
+    )
+    if scheduler is not None:
+        for provider, summary in scheduler.summary().items():
+            print(f"  {provider}: concurrency {summary['concurrency']:.1f}, rate limited {summary['rate_limited']}, token budget {summary['tokens']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--count", type=int, default=3)
+    parser.add_argument("--rpm", type=float, default=120)
+    parser.add_argument("--tpm", type=float, default=40000)
+    parser.add_argument("--burst-seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ.setdefault("OPENAI_MODEL", "mock")
+    print(f"{args.prompts} prompts x {args.count} suggestions, {args.workers} workers, limits {args.rpm:g} rpm / {args.tpm:g} tpm")
+    print(f"{'mode':<12} {'answered':>9} {'failed':>7} {'suggestions':>12} {'requests':>9} {'429s':>8} {'time':>9}")
+    run_mode(args, scheduled=False)
+    run_mode(args, scheduled=True)
+
+
+if __name__ == "__main__":
+    main()
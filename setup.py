@@ -17,7 +17,9 @@ setup(
     packages=find_packages(),
     install_requires=requirements,
     extras_require={
-        'dev': ['setuptools', 'wheel', 'twine']
+        'dev': ['setuptools', 'wheel', 'twine'],
+        'http2': ['httpx[http2]'],
+        'index': ['numpy'],
     },
     entry_points={
         'console_scripts': [
@@ -0,0 +1,148 @@
+import asyncio
+import queue
+import threading
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+from shell_ai.config import debug_print
+
+# How often a running round checks whether its caller cancelled it, in seconds.
+CANCEL_POLL_INTERVAL = 0.05
+
+
+class AsyncSuggestionEngine:
+    """
+    Run suggestion requests as coroutines on one shared event loop.
+
+    The loop lives on a background thread for the lifetime of the process, so
+    async HTTP clients keep their connections between rounds. Concurrency is
+    bounded by a semaphore instead of a thread pool, every request can be given
+    a timeout, and a request that is still outstanding after `hedge_after`
+    seconds is re-issued, using whichever answer arrives first.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        request_timeout: Optional[float] = None,
+        hedge_after: Optional[float] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.hedge_after = hedge_after
+        self._semaphore = None
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+    def stream(
+        self,
+        coroutine_func: Callable[[], Awaitable[Any]],
+        count: int,
+        cancel_event: Optional[threading.Event] = None,
+        side: Optional[Callable[[], Any]] = None,
+    ) -> Iterator[Any]:
+        """
+        Run `coroutine_func` `count` times and yield each result as soon as it completes.
+
+        Setting `cancel_event`, or closing the iterator, cancels every request
+        still in flight. Requests that time out yield None. A failed request is
+        logged and skipped, the error is only raised once every request has
+        finished without one succeeding. `side`, a plain function, runs on its
+        own thread alongside the requests and its result is yielded as soon as
+        it returns, it is not one of the `count` requests.
+        """
+        results: "queue.Queue" = queue.Queue()
+        round_future = asyncio.run_coroutine_threadsafe(
+            self._run_round(coroutine_func, count, results, cancel_event), self._loop
+        )
+
+        def side_worker():
+            try:
+                results.put((side(), None, True))
+            except Exception as e:
+                results.put((None, e, True))
+
+        if side is not None:
+            threading.Thread(target=side_worker, daemon=True).start()
+        errors = []
+        succeeded = 0
+        try:
+            for _ in range(count + (side is not None)):
+                result, error, from_side = results.get()
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                if from_side:
+                    if error is not None:
+                        debug_print(f"Side task failed: {error!r}")
+                    else:
+                        yield result
+                    continue
+                if error is not None:
+                    debug_print(f"Suggestion request failed: {error!r}")
+                    errors.append(error)
+                    continue
+                succeeded += 1
+                yield result
+            if errors and not succeeded:
+                raise errors[-1]
+        finally:
+            round_future.cancel()
+
+    def submit(self, coroutine):
+        """
+        Schedule `coroutine` on the engine's event loop without waiting for it.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    async def _run_round(self, coroutine_func, count, results, cancel_event):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        def report(task):
+            if task.cancelled():
+                results.put((None, None, False))
+            else:
+                results.put((task.result() if task.exception() is None else None, task.exception(), False))
+
+        tasks = [asyncio.ensure_future(self._run_one(coroutine_func)) for _ in range(count)]
+        for task in tasks:
+            task.add_done_callback(report)
+        try:
+            pending = set(tasks)
+            while pending:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                _, pending = await asyncio.wait(pending, timeout=CANCEL_POLL_INTERVAL)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _run_one(self, coroutine_func):
+        try:
+            return await asyncio.wait_for(self._run_hedged(coroutine_func), self.request_timeout)
+        except asyncio.TimeoutError:
+            debug_print(f"Request timed out after {self.request_timeout}s")
+            return None
+
+    async def _attempt(self, coroutine_func):
+        async with self._semaphore:
+            return await coroutine_func()
+
+    async def _run_hedged(self, coroutine_func):
+        attempts = {asyncio.ensure_future(self._attempt(coroutine_func))}
+        try:
+            if self.hedge_after:
+                done, _ = await asyncio.wait(attempts, timeout=self.hedge_after)
+                if not done:
+                    debug_print(f"No response after {self.hedge_after}s, issuing a hedged request")
+                    attempts.add(asyncio.ensure_future(self._attempt(coroutine_func)))
+            error = None
+            while attempts:
+                done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
@@ -0,0 +1,117 @@
+import json
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shell_ai.suggestion_source import MODEL, source_of
+
+
+def read_prompts(lines):
+    """
+    Yield `(id, prompt)` for every non-empty line, either plain text or a JSON
+    object with a `prompt` and an optional `id`.
+
+    Lines without an id are numbered from 1. Invalid JSON lines yield a None
+    prompt, so they are reported instead of silently skipped.
+    """
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("{"):
+            yield number, line
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield number, None
+            continue
+        if not isinstance(item, dict):
+            yield number, None
+            continue
+        prompt = item.get("prompt")
+        yield item.get("id", number), prompt if isinstance(prompt, str) and prompt.strip() else None
+
+
+def run_batch(service, lines, output, workers=4, execute=False, use_cache=True):
+    """
+    Generate suggestions for every prompt in `lines` and write one JSON line per prompt to `output`.
+
+    Up to `workers` prompts are in flight at once and results are written in
+    completion order, each with its id, the top `command`, every candidate
+    and the latency. The service's `RequestScheduler` keeps the requests of
+    all workers within the provider's rate limits. With `execute` the top
+    command of every prompt is run, one at a time, and its exit code and
+    output are included.
+    Returns the number of prompts that failed. Once writing to `output`
+    fails, e.g. with a BrokenPipeError when its reader went away, no further
+    prompts are started, the ones in flight are cancelled and that error is
+    raised.
+    """
+    write_lock = threading.Lock()
+    execute_lock = threading.Lock()
+    # Bounds how much of the input is read ahead of the workers
+    slots = threading.Semaphore(workers * 2)
+    # Set once writing failed, nothing more can be written
+    stopped = threading.Event()
+    write_errors = []
+    failures = 0
+
+    def write(result):
+        nonlocal failures
+        with write_lock:
+            if stopped.is_set():
+                return
+            failures += "error" in result
+            try:
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+            except OSError as e:
+                write_errors.append(e)
+                stopped.set()
+
+    def process(item_id, prompt):
+        result = {"id": item_id, "prompt": prompt}
+        if prompt is None:
+            result["error"] = "Invalid input line, expected text or a JSON object with a prompt"
+            return result
+        start = time.perf_counter()
+        candidates = []
+        try:
+            for command in service.iter_suggestions(prompt, use_cache=use_cache, cancel_event=stopped):
+                if not candidates:
+                    result["first_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                candidates.append(command)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            return result
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        # The model's suggestions come first, commands accepted for similar prompts after them
+        candidates.sort(key=lambda command: source_of(command) != MODEL)
+        result["command"] = candidates[0] if candidates else None
+        result["candidates"] = candidates
+        if not candidates:
+            result["error"] = "No command could be generated"
+        elif execute:
+            with execute_lock:
+                completed = subprocess.run(result["command"], shell=True, capture_output=True, text=True)
+            result.update(exit_code=completed.returncode, stdout=completed.stdout, stderr=completed.stderr)
+        return result
+
+    def run(item_id, prompt):
+        try:
+            if not stopped.is_set():
+                write(process(item_id, prompt))
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item_id, prompt in read_prompts(lines):
+            slots.acquire()
+            if stopped.is_set():
+                break
+            executor.submit(run, item_id, prompt)
+    if write_errors:
+        raise write_errors[0]
+    return failures
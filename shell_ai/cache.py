@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from shell_ai.config import debug_print, get_config_dir
+
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60
+DEFAULT_CACHE_MAX_ENTRIES = 500
+
+
+def normalize_prompt(prompt):
+    """
+    Collapse whitespace so trivially different spellings of a prompt share an entry.
+    """
+    return " ".join(prompt.split())
+
+
+def make_cache_key(prompt, platform_string, provider, model, temperature):
+    """
+    Build the cache key for a prompt on this platform with this provider, model and temperature.
+    """
+    parts = [normalize_prompt(prompt), platform_string, provider, str(model), f"{float(temperature):g}"]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class SuggestionCache:
+    """
+    Persistent store of generated and accepted commands, backed by SQLite.
+
+    Entries expire `ttl` seconds after they were generated, and once more than
+    `max_entries` are stored the least recently used ones are evicted.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_MAX_ENTRIES):
+        self.path = path or os.path.join(get_config_dir(), "cache.sqlite3")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._connection = None
+        # The connection is shared by threads, e.g. the daemon's request handlers
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=1, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS suggestions ("
+                "key TEXT PRIMARY KEY, commands TEXT NOT NULL, accepted TEXT, "
+                "created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS suggestions_last_used ON suggestions (last_used)"
+            )
+        return self._connection
+
+    def get(self, key):
+        """
+        Return the cached commands for `key`, accepted command first, or None on a miss.
+        """
+        with self._lock:
+            try:
+                connection = self._connect()
+                row = connection.execute(
+                    "SELECT commands, accepted, created FROM suggestions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                commands, accepted, created = row
+                now = time.time()
+                if now - created > self.ttl:
+                    with connection:
+                        connection.execute("DELETE FROM suggestions WHERE key = ?", (key,))
+                    return None
+                with connection:
+                    connection.execute("UPDATE suggestions SET last_used = ? WHERE key = ?", (now, key))
+                commands = json.loads(commands)
+                if accepted:
+                    commands = [accepted] + [command for command in commands if command != accepted]
+                return commands
+            except (sqlite3.Error, ValueError) as e:
+                debug_print(f"Suggestion cache lookup failed: {e}")
+                return None
+
+    def put(self, key, commands):
+        """
+        Store freshly generated `commands` for `key`, replacing the previous ones.
+
+        A command accepted for `key` before is kept and still offered first.
+        """
+        if not commands:
+            return
+        with self._lock:
+            try:
+                connection = self._connect()
+                now = time.time()
+                with connection:
+                    connection.execute(
+                        "INSERT INTO suggestions (key, commands, accepted, created, last_used) "
+                        "VALUES (?, ?, NULL, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                        "commands = excluded.commands, created = excluded.created, last_used = excluded.last_used",
+                        (key, json.dumps(commands), now, now),
+                    )
+                    self._evict(connection, now)
+            except sqlite3.Error as e:
+                debug_print(f"Suggestion cache write failed: {e}")
+
+    def record_accepted(self, key, command):
+        """
+        Remember that `command` was picked for `key` so it is offered first next time.
+        """
+        with self._lock:
+            try:
+                connection = self._connect()
+                now = time.time()
+                with connection:
+                    updated = connection.execute(
+                        "UPDATE suggestions SET accepted = ?, last_used = ? WHERE key = ?",
+                        (command, now, key),
+                    ).rowcount
+                    if not updated:
+                        connection.execute(
+                            "INSERT INTO suggestions (key, commands, accepted, created, last_used) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (key, json.dumps([command]), command, now, now),
+                        )
+                        self._evict(connection, now)
+            except sqlite3.Error as e:
+                debug_print(f"Suggestion cache write failed: {e}")
+
+    def _evict(self, connection, now):
+        connection.execute("DELETE FROM suggestions WHERE created < ?", (now - self.ttl,))
+        connection.execute(
+            "DELETE FROM suggestions WHERE key NOT IN "
+            "(SELECT key FROM suggestions ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+
+class TokenBudget:
+    """
+    Allow `limit` units every `window` seconds across every shai process.
+
+    The budget refills continuously and is kept in SQLite, by default next to
+    the suggestion cache, so it holds over many short-lived processes rather
+    than restarting with each of them.
+    """
+
+    def __init__(self, name, limit, window, path=None):
+        self.name = name
+        self.limit = float(limit)
+        self.window = window
+        self.path = path or os.path.join(get_config_dir(), "cache.sqlite3")
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=1, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS budgets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        return self._connection
+
+    def take(self, amount):
+        """
+        Spend `amount` units and return True, or return False when fewer are left.
+
+        An amount larger than the whole budget is spent once the budget is full.
+        """
+        if self.limit <= 0:
+            return False
+        amount = min(amount, self.limit)
+        with self._lock:
+            try:
+                connection = self._connect()
+                with connection:
+                    # Locks the database for writing up front, so processes
+                    # spending at the same time never both see the same level
+                    connection.execute("BEGIN IMMEDIATE")
+                    row = connection.execute("SELECT level, updated FROM budgets WHERE name = ?", (self.name,)).fetchone()
+                    now = time.time()
+                    level = self.limit
+                    if row is not None:
+                        level = min(self.limit, row[0] + max(0.0, now - row[1]) * self.limit / self.window)
+                    if level < amount:
+                        return False
+                    connection.execute(
+                        "INSERT INTO budgets (name, level, updated) VALUES (?, ?, ?) "
+                        "ON CONFLICT (name) DO UPDATE SET level = excluded.level, updated = excluded.updated",
+                        (self.name, level - amount, now),
+                    )
+                return True
+            except sqlite3.Error as e:
+                debug_print(f"Budget update failed: {e}")
+                return False
@@ -1,53 +1,5 @@
-import mistune
-from collections import deque
-
-MAX_CONTEXT_TOKENS = 1500
-
-class PythonCodeBlockParser(mistune.HTMLRenderer):
-    def __init__(self, *args, **kwargs):
-        super(PythonCodeBlockParser, self).__init__(*args, **kwargs)
-        self.code_blocks = []
-        self.codespans = []
-
-    def codespan(self, code):
-        self.codespans.append(code)
-        return super().codespan(code)
-
-    def block_code(self, code, info=None):
-        #lang = info.split(None, 1)[0] if info else None
-        self.code_blocks.append(code)
-        return super().block_code(code)
-
-class _ContextManager:
-    """
-    Store console outputs in context mode.
-    """
-    _instance = None
-    
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance.max_tokens = MAX_CONTEXT_TOKENS
-            cls._instance.token_buffer = deque(maxlen=MAX_CONTEXT_TOKENS)
-        return cls._instance
-
-    def add_token(self, token):
-        self.token_buffer.append(token)
-    
-    def flush(self):
-        self.token_buffer.clear()
-    
-    def add_chunk(self, chunk):
-        self.flush()
-        for c in chunk:
-            self.add_token(c)
-
-    def get_ctx(self):
-        if len(self.token_buffer) == 0:
-            return ''
-        return ''.join(list(self.token_buffer))
-
-ContextManager = _ContextManager()
+import json
+import re
 
 def code_parser(markdown):
     """
@@ -56,6 +8,24 @@ def code_parser(markdown):
     joined codespans, if those are also empty we return
     the full markdown output as if it's code.
     """
+    # Only needed when a response holds no JSON, so not imported up front
+    import mistune
+
+    class PythonCodeBlockParser(mistune.HTMLRenderer):
+        def __init__(self, *args, **kwargs):
+            super(PythonCodeBlockParser, self).__init__(*args, **kwargs)
+            self.code_blocks = []
+            self.codespans = []
+
+        def codespan(self, code):
+            self.codespans.append(code)
+            return super().codespan(code)
+
+        def block_code(self, code, info=None):
+            #lang = info.split(None, 1)[0] if info else None
+            self.code_blocks.append(code)
+            return super().block_code(code)
+
     renderer = PythonCodeBlockParser()
     parser = mistune.create_markdown(renderer=renderer)
     parser(markdown)
@@ -64,4 +34,234 @@ def code_parser(markdown):
         return "".join(renderer.code_blocks)
     if renderer.codespans:
         return "\n".join(renderer.codespans)
-    return markdown 
\ No newline at end of file
+    return markdown
+
+
+# Characters that open, close or quote something while scanning for JSON
+_STRUCTURE_PATTERN = re.compile(r"""[{}\[\]"']""")
+_STRING_PATTERNS = {
+    '"': re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL),
+    "'": re.compile(r"'(?:[^'\\]|\\.)*'", re.DOTALL),
+}
+_CLOSERS = {"{": "}", "[": "]"}
+_TRAILING_COMMA_PATTERN = re.compile(r",\s*[}\]]")
+# Characters JSON allows after a backslash in a string
+_JSON_ESCAPES = set('"\\/bfnrtu')
+
+
+def _find_json_end(text, start):
+    """
+    Return the index after the object or array opened at `start`, or None when it is not balanced.
+    """
+    expected = []
+    position = start
+    while True:
+        match = _STRUCTURE_PATTERN.search(text, position)
+        if match is None:
+            return None
+        char = match.group()
+        position = match.end()
+        if char in _CLOSERS:
+            expected.append(_CLOSERS[char])
+        elif char in "}]":
+            if expected.pop() != char:
+                return None
+            if not expected:
+                return position
+        else:
+            if char == "'":
+                # Only a quote where a value may start opens a string, not an apostrophe
+                previous = match.start() - 1
+                while text[previous].isspace():
+                    previous -= 1
+                if text[previous] not in "{[,:":
+                    continue
+            string = _STRING_PATTERNS[char].match(text, match.start())
+            if string is None:
+                return None
+            position = string.end()
+
+
+def _repair_json(candidate):
+    """
+    Fix the mistakes models commonly make in JSON: single quoted strings,
+    unescaped newlines or tabs in strings, backslashes before characters JSON
+    doesn't escape, e.g. a regex's `\\d`, and trailing commas.
+    """
+    repaired = []
+    quote = None
+    position = 0
+    length = len(candidate)
+    while position < length:
+        char = candidate[position]
+        if quote:
+            if char == "\\":
+                escaped = candidate[position + 1:position + 2]
+                if quote == "'" and escaped == "'":
+                    # \' is not a valid escape in JSON, and not needed in double quotes
+                    repaired.append(escaped)
+                elif escaped in _JSON_ESCAPES:
+                    repaired.append(char + escaped)
+                else:
+                    # Meant as a literal backslash, as in `grep -P '\d+'`
+                    repaired.append("\\\\" + escaped)
+                position += 2
+                continue
+            if char == quote:
+                repaired.append('"')
+                quote = None
+            elif char == '"':
+                repaired.append('\\"')
+            elif char == "\n":
+                repaired.append("\\n")
+            elif char == "\t":
+                repaired.append("\\t")
+            elif char != "\r":
+                repaired.append(char)
+        elif char in "\"'":
+            quote = char
+            repaired.append('"')
+        elif char == "," and _TRAILING_COMMA_PATTERN.match(candidate, position):
+            pass
+        else:
+            repaired.append(char)
+        position += 1
+    return "".join(repaired)
+
+
+def iter_json_values(text):
+    """
+    Yield every JSON object or array embedded in `text`, in order of appearance.
+
+    A single pass finds balanced `{...}` and `[...]` spans, whether they are in
+    a fenced code block, inline code or surrounded by prose. Spans that are not
+    valid JSON are parsed again after `_repair_json`.
+    """
+    position = 0
+    while True:
+        start = min((index for index in (text.find("{", position), text.find("[", position)) if index != -1), default=-1)
+        if start == -1:
+            return
+        end = _find_json_end(text, start)
+        if end is None:
+            position = start + 1
+            continue
+        candidate = text[start:end]
+        try:
+            yield json.loads(candidate)
+        except json.JSONDecodeError:
+            try:
+                yield json.loads(_repair_json(candidate))
+            except json.JSONDecodeError:
+                # Nested values may still be valid on their own
+                position = start + 1
+                continue
+        position = end
+
+
+def _commands_from(parsed):
+    if isinstance(parsed, dict):
+        parsed = parsed.get("commands", [parsed.get("command")])
+    if not isinstance(parsed, list):
+        return []
+    commands = []
+    for item in parsed:
+        if isinstance(item, dict):
+            item = item.get("command")
+        if isinstance(item, str) and item:
+            commands.append(item)
+    return commands
+
+
+def parse_commands(markdown):
+    """
+    Extract the suggested commands from a model response.
+
+    Accepts a single `{"command": ...}` object, a `{"commands": [...]}` object
+    or a bare JSON array, whose entries may be strings or command objects.
+    JSON is found with `iter_json_values`, the full Markdown render of
+    `code_parser` is only used when that finds no commands. Returns an empty
+    list when no command could be parsed.
+    """
+    for parsed in iter_json_values(markdown):
+        commands = _commands_from(parsed)
+        if commands:
+            return commands
+    try:
+        return _commands_from(json.loads(code_parser(markdown)))
+    except json.JSONDecodeError:
+        return []
+
+
+# A complete string value of a "command" key, possibly before the object around it is closed
+_COMMAND_VALUE_PATTERN = re.compile(r'"command"\s*:\s*("(?:[^"\\]|\\.)*")', re.DOTALL)
+
+
+class CommandStreamParser:
+    """
+    Find the suggested commands in a response while it is still being streamed.
+
+    `feed` takes the next chunk of the response and returns the commands as
+    soon as they are complete, so the caller can stop reading the stream. With
+    `single` the first complete `"command"` string is enough, otherwise the
+    first JSON object or array holding commands has to be closed. The text is
+    only scanned again when a chunk closes a string or a bracket.
+    """
+
+    def __init__(self, single=False):
+        self.single = single
+        self.commands = None
+        self._chunks = []
+        # Where to look for the next JSON value, values before it held no commands
+        self._position = 0
+
+    def text(self):
+        return "".join(self._chunks)
+
+    def feed(self, chunk):
+        """
+        Add `chunk` and return the commands once they are complete, else None.
+        """
+        if self.commands:
+            return self.commands
+        self._chunks.append(chunk)
+        if self.single and '"' in chunk:
+            match = _COMMAND_VALUE_PATTERN.search(self.text(), self._position)
+            if match:
+                try:
+                    command = json.loads(match.group(1))
+                except json.JSONDecodeError:
+                    try:
+                        command = json.loads(_repair_json(match.group(1)))
+                    except json.JSONDecodeError:
+                        # Left to the closing bracket check below, or to `close`
+                        command = None
+                if command:
+                    self.commands = [command]
+                    return self.commands
+        if "}" in chunk or "]" in chunk:
+            self.commands = self._complete_commands(self.text()) or None
+        return self.commands
+
+    def _complete_commands(self, text):
+        while True:
+            start = min((index for index in (text.find("{", self._position), text.find("[", self._position)) if index != -1), default=-1)
+            if start == -1:
+                return []
+            end = _find_json_end(text, start)
+            if end is None:
+                # Still being streamed, unless it never closes, which `close` handles
+                return []
+            for parsed in iter_json_values(text[start:end]):
+                commands = _commands_from(parsed)
+                if commands:
+                    return commands
+            self._position = end
+
+    def close(self):
+        """
+        Return the commands of the whole response, once the stream has ended.
+        """
+        if not self.commands:
+            self.commands = parse_commands(self.text())
+        return self.commands
@@ -0,0 +1,296 @@
+import importlib.util
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from shell_ai.cache import normalize_prompt
+from shell_ai.config import debug_print, get_config_dir
+
+DEFAULT_INDEX_THRESHOLD = 0.7
+# Number of hashed feature buckets, collisions are rare for short prompts
+FEATURE_BUCKETS = 2 ** 20
+
+_WORD_PATTERN = re.compile(r"\w+")
+# Negations, and words whose opposite asks for the opposite command. Prompts
+# only match when they have the same of these, and the same numbers, as
+# "older than 7 days" is worded much like "newer than 7 days" or "older than 70 days".
+NEGATIONS = frozenset("not no never nor without except excluding non t".split())
+ANTONYMS = (
+    ("older", "newer"), ("oldest", "newest"), ("old", "new"), ("before", "after"), ("since", "until"),
+    ("larger", "smaller"), ("bigger", "smaller"), ("largest", "smallest"), ("biggest", "smallest"),
+    ("more", "less"), ("more", "fewer"), ("most", "least"), ("greater", "less"), ("min", "max"),
+    ("minimum", "maximum"), ("first", "last"), ("top", "bottom"), ("head", "tail"), ("above", "below"),
+    ("over", "under"), ("ascending", "descending"), ("asc", "desc"), ("add", "remove"), ("create", "delete"),
+    ("enable", "disable"), ("start", "stop"), ("increase", "decrease"), ("up", "down"), ("on", "off"),
+    ("open", "close"), ("lock", "unlock"), ("mount", "unmount"), ("install", "uninstall"),
+    ("include", "exclude"), ("hidden", "visible"), ("empty", "nonempty"), ("encrypt", "decrypt"),
+    ("compress", "decompress"), ("zip", "unzip"), ("upload", "download"), ("push", "pull"),
+    ("import", "export"), ("allow", "deny"), ("block", "unblock"), ("read", "write"),
+)
+GUARDED_WORDS = NEGATIONS | frozenset(word for pair in ANTONYMS for word in pair)
+
+
+def is_available():
+    """
+    Return whether NumPy, which the index needs, is installed.
+    """
+    return importlib.util.find_spec("numpy") is not None
+
+
+def guarded_words(prompt):
+    """
+    Return the numbers, negations and antonyms in `prompt`, which another prompt needs the same of to match it.
+    """
+    return frozenset(
+        word for word in _WORD_PATTERN.findall(prompt.lower()) if word in GUARDED_WORDS or any(char.isdigit() for char in word)
+    )
+
+
+def prompt_features(prompt):
+    """
+    Return the hashed word, word pair and character trigram counts of `prompt`.
+    """
+    words = _WORD_PATTERN.findall(prompt.lower())
+    grams = [f"w:{word}" for word in words]
+    grams.extend(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+    for word in words:
+        padded = f" {word} "
+        grams.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    counts = {}
+    for gram in grams:
+        # crc32 rather than hash(), which differs between runs
+        bucket = zlib.crc32(gram.encode("utf-8")) % FEATURE_BUCKETS
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
+
+
+class CommandIndex:
+    """
+    Find previously accepted commands for prompts similar to a new one.
+
+    Accepted (prompt, command) pairs are stored in SQLite. In memory, the
+    hashed n-gram counts of every stored prompt are kept as an inverted index,
+    flat NumPy arrays sorted by feature, so a lookup only touches the postings
+    of the query's features and scores every stored prompt by TF-IDF cosine
+    similarity at once. Similar is not the same, "older than" and "newer than"
+    score alike, so a match also needs the same numbers, negations and
+    antonyms, see `guarded_words`.
+    A snapshot of the arrays is kept next to the database and only prompts
+    added since it was written are featurized on startup.
+    """
+
+    def __init__(self, path=None, threshold=DEFAULT_INDEX_THRESHOLD):
+        self.path = path or os.path.join(get_config_dir(), "index.sqlite3")
+        self.snapshot_path = os.path.splitext(self.path)[0] + ".npz"
+        self.threshold = threshold
+        self._connection = None
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._last_rowid = 0
+        self._commands = []
+        self._guards = []
+        # Postings sorted by feature, then by row, and the TF-IDF weights derived from them
+        self._features = None
+        self._rows = None
+        self._counts = None
+        self._weights = None
+        self._idf = None
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=1, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS accepted ("
+                "prompt TEXT NOT NULL, command TEXT NOT NULL, uses INTEGER NOT NULL, "
+                "last_used REAL NOT NULL, PRIMARY KEY (prompt, command))"
+            )
+        return self._connection
+
+    def add(self, prompt, command):
+        """
+        Store that `command` was accepted for `prompt`.
+
+        The in-memory index picks the new entry up on the next search.
+        """
+        prompt = normalize_prompt(prompt)
+        if not command or not prompt_features(prompt):
+            return
+        with self._lock:
+            try:
+                connection = self._connect()
+                with connection:
+                    connection.execute(
+                        "INSERT INTO accepted (prompt, command, uses, last_used) VALUES (?, ?, 1, ?) "
+                        "ON CONFLICT (prompt, command) DO UPDATE SET uses = uses + 1, last_used = excluded.last_used",
+                        (prompt, command, time.time()),
+                    )
+            except sqlite3.Error as e:
+                debug_print(f"Command index write failed: {e}")
+
+    def _is_empty(self):
+        if not os.path.exists(self.path):
+            return True
+        return self._connect().execute("SELECT 1 FROM accepted LIMIT 1").fetchone() is None
+
+    def search(self, prompt, limit=3):
+        """
+        Return up to `limit` commands whose prompts score at least the
+        threshold and have the same guarded words, best first.
+        """
+        prompt = normalize_prompt(prompt)
+        features = prompt_features(prompt)
+        if not features:
+            return []
+        with self._lock:
+            try:
+                # Nothing accepted yet, don't pay for importing NumPy
+                if not self._loaded and self._is_empty():
+                    return []
+                self._load()
+                self._load_new_rows()
+            except sqlite3.Error as e:
+                debug_print(f"Command index read failed: {e}")
+                return []
+            if not self._commands:
+                return []
+            stored_features, rows, weights, idf = self._features, self._rows, self._weights, self._idf
+            commands, stored_guards = self._commands, self._guards
+
+        import numpy as np
+
+        guards = guarded_words(prompt)
+        buckets = np.fromiter(features.keys(), dtype=np.int32, count=len(features))
+        query = np.fromiter(features.values(), dtype=np.float32, count=len(features)) * idf[buckets]
+        query /= np.linalg.norm(query)
+        starts = np.searchsorted(stored_features, buckets, side="left")
+        ends = np.searchsorted(stored_features, buckets, side="right")
+        postings = [np.arange(start, end) for start, end in zip(starts, ends) if end > start]
+        if not postings:
+            return []
+        lengths = (ends - starts)[ends > starts]
+        postings = np.concatenate(postings)
+        contributions = weights[postings] * np.repeat(query[ends > starts], lengths)
+        scores = np.bincount(rows[postings], weights=contributions, minlength=len(commands))
+
+        candidates = np.flatnonzero(scores >= self.threshold)
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        matches = []
+        for row in candidates:
+            command = commands[row]
+            if stored_guards[row] == guards and command not in matches:
+                matches.append(command)
+                if len(matches) == limit:
+                    break
+        debug_print(f"Command index matches for {prompt!r}: {matches}")
+        return matches
+
+    def _load(self):
+        if self._loaded:
+            return
+        import numpy as np
+
+        try:
+            with np.load(self.snapshot_path) as snapshot:
+                self._last_rowid = int(snapshot["last_rowid"])
+                row_count = int(snapshot["row_count"])
+                self._features = snapshot["features"]
+                self._rows = snapshot["rows"]
+                self._counts = snapshot["counts"]
+                self._weights = snapshot["weights"]
+                self._idf = snapshot["idf"]
+        except (OSError, KeyError, ValueError) as e:
+            debug_print(f"No usable command index snapshot: {e}")
+            self._reset()
+            row_count = 0
+
+        rows = self._connect().execute(
+            "SELECT prompt, command FROM accepted WHERE rowid <= ? ORDER BY rowid", (self._last_rowid,)
+        ).fetchall()
+        if len(rows) != row_count:
+            # Rows were removed or the snapshot belongs to another database
+            debug_print("Command index snapshot is out of date, rebuilding")
+            self._reset()
+            rows = []
+        self._commands = [command for _, command in rows]
+        self._guards = [guarded_words(prompt) for prompt, _ in rows]
+        self._loaded = True
+        if self._load_new_rows():
+            self._save_snapshot()
+
+    def _reset(self):
+        import numpy as np
+
+        self._last_rowid = 0
+        self._features = np.zeros(0, dtype=np.int32)
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._counts = np.zeros(0, dtype=np.uint8)
+        self._weights = None
+
+    def _load_new_rows(self):
+        """
+        Merge entries added to the database since the index was loaded, returning whether there were any.
+        """
+        import numpy as np
+
+        rows = self._connect().execute(
+            "SELECT rowid, prompt, command FROM accepted WHERE rowid > ? ORDER BY rowid", (self._last_rowid,)
+        ).fetchall()
+        if not rows:
+            if self._weights is None:
+                self._derive_weights()
+            return False
+        features, row_numbers, counts = [], [], []
+        for _, prompt, command in rows:
+            # `add` only stores prompts that have features
+            prompt_counts = prompt_features(prompt)
+            features.extend(prompt_counts.keys())
+            counts.extend(prompt_counts.values())
+            row_numbers.extend([len(self._commands)] * len(prompt_counts))
+            self._commands.append(command)
+            self._guards.append(guarded_words(prompt))
+        features = np.asarray(features, dtype=np.int32)
+        order = np.argsort(features, kind="stable")
+        features = features[order]
+        counts = np.minimum(np.asarray(counts), 255).astype(np.uint8)
+        # New rows come after every stored one, so inserting after equal
+        # features keeps the postings of each feature sorted by row
+        positions = np.searchsorted(self._features, features, side="right")
+        self._features = np.insert(self._features, positions, features)
+        self._rows = np.insert(self._rows, positions, np.asarray(row_numbers, dtype=np.int32)[order])
+        self._counts = np.insert(self._counts, positions, counts[order])
+        self._last_rowid = rows[-1][0]
+        self._derive_weights()
+        return True
+
+    def _derive_weights(self):
+        import numpy as np
+
+        row_count = len(self._commands)
+        document_frequency = np.bincount(self._features, minlength=FEATURE_BUCKETS)
+        self._idf = (np.log((row_count + 1) / (document_frequency + 1)) + 1).astype(np.float32)
+        weights = self._counts * self._idf[self._features]
+        norms = np.sqrt(np.bincount(self._rows, weights=weights * weights, minlength=row_count))
+        self._weights = (weights / norms[self._rows]).astype(np.float32)
+
+    def _save_snapshot(self):
+        import numpy as np
+
+        temporary_path = self.snapshot_path + ".tmp.npz"
+        try:
+            np.savez(
+                temporary_path,
+                last_rowid=np.int64(self._last_rowid),
+                row_count=np.int64(len(self._commands)),
+                features=self._features,
+                rows=self._rows,
+                counts=self._counts,
+                weights=self._weights,
+                idf=self._idf,
+            )
+            os.replace(temporary_path, self.snapshot_path)
+        except OSError as e:
+            debug_print(f"Saving the command index snapshot failed: {e}")
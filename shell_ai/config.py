@@ -5,11 +5,32 @@ def debug_print(*args, **kwargs):
     if os.environ.get("DEBUG", "").lower() == "true":
         print(*args, **kwargs)
 
-def load_config():
+# Settings whose names contain one of these hold credentials.
+SECRET_MARKERS = ("KEY", "TOKEN", "SECRET", "PASSWORD")
+
+def redact(key, value):
+    """
+    Hide the value of a setting that holds credentials, for debug output.
+    """
+    if value and any(marker in key.upper() for marker in SECRET_MARKERS):
+        return "***"
+    return value
+
+def get_config_dir():
+    """
+    Return the platform specific directory holding shell-ai's config and state.
+    """
     # Determine the platform
     platform = os.name  # posix, nt, java, etc.
     config_app_name = "shell-ai"
-    
+    if platform == 'posix':
+        return os.path.expanduser(f'~/.config/{config_app_name}')
+    elif platform == 'nt':
+        return os.path.join(os.environ['APPDATA'], config_app_name)
+    else:
+        raise Exception('Unsupported platform')
+
+def load_config():
     # Default configuration values
     default_config = {
         "OPENAI_MODEL": "gpt-3.5-turbo",
@@ -21,12 +42,7 @@ def load_config():
     
     try:
         # Determine the path to the configuration file based on the platform
-        if platform == 'posix':
-            config_path = os.path.expanduser(f'~/.config/{config_app_name}/config.json')
-        elif platform == 'nt':
-            config_path = os.path.join(os.environ['APPDATA'], config_app_name, 'config.json')
-        else:
-            raise Exception('Unsupported platform')
+        config_path = os.path.join(get_config_dir(), 'config.json')
 
         debug_print(f"Looking for config file at: {config_path}")
         
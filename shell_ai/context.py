@@ -0,0 +1,238 @@
+import re
+from collections import deque
+
+from shell_ai.config import debug_print
+
+MAX_CONTEXT_TOKENS = 1500
+MAX_CONTEXT_COMMANDS = 3
+# Longer lines (minified JSON, progress bars) are cut, they rarely help the model
+MAX_LINE_CHARS = 400
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_NUMBER_PATTERN = re.compile(r"\d+")
+
+
+class ApproximateTokenizer:
+    """
+    Count words and punctuation marks, a close and dependency free
+    approximation of what BPE tokenizers produce for shell output.
+    """
+
+    def count(self, text):
+        return len(_TOKEN_PATTERN.findall(text))
+
+
+class CharacterTokenizer:
+    """
+    Count every character as a token.
+    """
+
+    def count(self, text):
+        return len(text)
+
+
+class TiktokenTokenizer:
+    """
+    Count tokens exactly with tiktoken, which has to be installed separately.
+    """
+
+    def __init__(self, encoding="cl100k_base"):
+        import tiktoken
+
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text):
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+TOKENIZERS = {
+    "approximate": ApproximateTokenizer,
+    "chars": CharacterTokenizer,
+    "tiktoken": TiktokenTokenizer,
+}
+
+
+def get_tokenizer(name):
+    """
+    Return the tokenizer registered as `name`, falling back to the approximate one.
+    """
+    try:
+        return TOKENIZERS[name]()
+    # tiktoken may also fail to download its encoding
+    except Exception as e:
+        debug_print(f"Tokenizer {name} is not available ({e}), using approximate token counts")
+        return ApproximateTokenizer()
+
+
+class _Line:
+    __slots__ = ("text", "tokens")
+
+    def __init__(self, text, tokens):
+        self.text = text
+        self.tokens = tokens
+
+
+class _CommandContext:
+    """
+    A command and the compressed lines of its output that still fit the budget.
+    """
+
+    def __init__(self, header, header_tokens):
+        self.header = header
+        self.header_tokens = header_tokens
+        self.lines = deque()
+        # Run of consecutive lines that only differ in their numbers
+        self.run_shape = None
+        self.run_count = 0
+        self.run_first = None
+        self.run_marker = None
+
+
+class _ContextManager:
+    """
+    Store the most recent commands and their output in context mode.
+
+    Output is appended in chunks and split into lines. Repeated lines, and runs
+    of lines that only differ in numbers such as timestamps or counters, are
+    collapsed into a single summary line. Whenever the stored context exceeds
+    `max_tokens`, the oldest lines of the oldest command are evicted first, so
+    every append costs time proportional to the chunk, not to the buffer.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.configure()
+        return cls._instance
+
+    def configure(self, max_tokens=MAX_CONTEXT_TOKENS, max_commands=MAX_CONTEXT_COMMANDS, tokenizer=None):
+        """
+        Set the token budget, the number of commands kept and the tokenizer, clearing the context.
+        """
+        self.max_tokens = max_tokens
+        self.max_commands = max_commands
+        self.tokenizer = tokenizer or ApproximateTokenizer()
+        self.flush()
+
+    def flush(self):
+        self.commands = deque()
+        self.total_tokens = 0
+        self._partial_line = ""
+        self._rendered = ""
+
+    def start_command(self, command):
+        """
+        Start collecting output for `command`, dropping the oldest command if needed.
+        """
+        self.finish_command()
+        if len(self.commands) == self.max_commands:
+            self._drop_oldest_command()
+        header = f"$ {command}"
+        entry = _CommandContext(header, self.tokenizer.count(header))
+        self.commands.append(entry)
+        self.total_tokens += entry.header_tokens
+        self._enforce_budget()
+
+    def add_output(self, chunk):
+        """
+        Append a chunk of the current command's output.
+        """
+        if not self.commands:
+            self.start_command("")
+        lines = (self._partial_line + chunk).split("\n")
+        self._partial_line = lines.pop()
+        for line in lines:
+            self._add_line(line)
+        self._enforce_budget()
+
+    def finish_command(self, exit_code=None):
+        """
+        Flush the last partial line of output and record the exit status.
+        """
+        self._flush_partial_line()
+        if exit_code and self.commands:
+            self._add_line(f"(exited with status {exit_code})")
+        self._enforce_budget()
+
+    def add_command(self, command, output, exit_code=None, stderr=""):
+        """
+        Store a finished command together with all of its output.
+        """
+        self.start_command(command)
+        self.add_output(output)
+        if stderr:
+            self._flush_partial_line()
+            self._add_line("(stderr)")
+            self.add_output(stderr)
+        self.finish_command(exit_code)
+
+    def get_ctx(self):
+        if self._rendered is None:
+            parts = []
+            for entry in self.commands:
+                parts.append(entry.header)
+                parts.extend(line.text for line in entry.lines)
+            self._rendered = "\n".join(parts)
+        return self._rendered
+
+    def _flush_partial_line(self):
+        if self._partial_line:
+            self._add_line(self._partial_line)
+            self._partial_line = ""
+
+    def _add_line(self, text):
+        entry = self.commands[-1]
+        text = text.rstrip("\r")
+        if len(text) > MAX_LINE_CHARS:
+            text = text[:MAX_LINE_CHARS] + "..."
+        shape = _NUMBER_PATTERN.sub("#", text)
+        if entry.run_shape == shape and entry.run_first is not None:
+            entry.run_count += 1
+            if entry.run_first.text == text:
+                summary = f"(previous line repeated {entry.run_count} more times)"
+            else:
+                summary = f"({entry.run_count} more similar lines, last: {text})"
+            if entry.run_marker is None:
+                entry.run_marker = self._append_line(entry, summary)
+            else:
+                # Lines of the same shape have about as many tokens, so the
+                # summary is not counted again for every line of the run
+                entry.run_marker.text = summary
+            self._rendered = None
+            return
+        entry.run_shape = shape
+        entry.run_count = 0
+        entry.run_marker = None
+        entry.run_first = self._append_line(entry, text)
+
+    def _append_line(self, entry, text):
+        line = _Line(text, self.tokenizer.count(text))
+        entry.lines.append(line)
+        self.total_tokens += line.tokens
+        self._rendered = None
+        return line
+
+    def _drop_oldest_command(self):
+        entry = self.commands.popleft()
+        self.total_tokens -= entry.header_tokens + sum(line.tokens for line in entry.lines)
+        self._rendered = None
+
+    def _enforce_budget(self):
+        while self.total_tokens > self.max_tokens and self.commands:
+            entry = self.commands[0]
+            if not entry.lines:
+                if len(self.commands) == 1:
+                    # Always keep the current command itself
+                    break
+                self._drop_oldest_command()
+                continue
+            line = entry.lines.popleft()
+            self.total_tokens -= line.tokens
+            if line is entry.run_first or line is entry.run_marker:
+                entry.run_shape = None
+                entry.run_first = None
+                entry.run_marker = None
+            self._rendered = None
+
+ContextManager = _ContextManager()
@@ -0,0 +1,242 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+
+from shell_ai.config import debug_print, get_config_dir
+from shell_ai.suggestion_source import MODEL, Suggestion, source_of
+
+# How often a waiting client checks whether its caller cancelled the request, in seconds.
+CANCEL_POLL_INTERVAL = 0.05
+
+
+def get_socket_path():
+    """
+    Return the path of the Unix domain socket the daemon listens on.
+    """
+    return os.environ.get("SHAI_DAEMON_SOCKET") or os.path.join(get_config_dir(), "daemon.sock")
+
+
+def _send(connection, message):
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Answer a single JSON request per connection.
+
+    Requests are `{"type": "ping"}`, `{"type": "prewarm"}`,
+    `{"type": "accept", "prompt": ..., "command": ..., "ctx": ...}` and
+    `{"type": "suggest", "prompt": ..., "use_cache": ..., "ctx": ..., "exclude": [...], "speculative": ...}`. A
+    suggest request is answered with one `{"type": "suggestion", "command": ..., "source": ...}`
+    line per command as soon as it is generated, followed by `{"type": "done"}`.
+    Closing the connection early cancels the requests still in flight.
+    """
+
+    def handle(self):
+        service = self.server.service
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            request_type = request["type"]
+            if request_type == "ping":
+                _send(self.connection, {"type": "pong"})
+            elif request_type == "prewarm":
+                service.prewarm_connections()
+                _send(self.connection, {"type": "ok"})
+            elif request_type == "accept":
+                service.record_accepted(request["prompt"], request["command"], ctx=request.get("ctx", ""))
+                _send(self.connection, {"type": "ok"})
+            elif request_type == "suggest":
+                self._suggest(service, request)
+            else:
+                _send(self.connection, {"type": "error", "message": f"Unknown request type {request_type}"})
+        except (ValueError, KeyError) as e:
+            _send(self.connection, {"type": "error", "message": f"Invalid request: {e}"})
+        except OSError as e:
+            debug_print(f"Client went away: {e}")
+
+    def _suggest(self, service, request):
+        cancel_event = threading.Event()
+
+        def watch_for_disconnect():
+            # The client sends nothing more, so reading returns once it hangs up
+            try:
+                self.rfile.read(1)
+            except (OSError, ValueError):
+                pass
+            cancel_event.set()
+
+        threading.Thread(target=watch_for_disconnect, daemon=True).start()
+        suggestions = service.iter_suggestions(
+            request["prompt"],
+            use_cache=request.get("use_cache", True),
+            cancel_event=cancel_event,
+            ctx=request.get("ctx", ""),
+            exclude=request.get("exclude", ()),
+            speculative=request.get("speculative", False),
+        )
+        try:
+            for command in suggestions:
+                _send(self.connection, {"type": "suggestion", "command": command, "source": source_of(command)})
+            _send(self.connection, {"type": "done"})
+        except OSError:
+            cancel_event.set()
+            raise
+        except Exception as e:
+            _send(self.connection, {"type": "error", "message": str(e)})
+        finally:
+            suggestions.close()
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service, socket_path=None):
+    """
+    Bind a server answering requests with `service` to a Unix domain socket only its owner can connect to.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("The shai daemon requires Unix domain socket support")
+    socket_path = socket_path or get_socket_path()
+    if connect_daemon(socket_path) is not None:
+        raise RuntimeError(f"A shai daemon is already listening on {socket_path}")
+    # A socket file left behind by a daemon that did not shut down cleanly
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    os.makedirs(os.path.dirname(socket_path), mode=0o700, exist_ok=True)
+
+    # The socket is created with these permissions, so other users can never
+    # connect, not even between binding and a later chmod
+    previous_umask = os.umask(0o177)
+    try:
+        server = _DaemonServer(socket_path, _RequestHandler)
+    finally:
+        os.umask(previous_umask)
+    server.service = service
+    return server
+
+
+def serve(service, socket_path=None):
+    """
+    Serve suggestions from `service` on a Unix domain socket until interrupted.
+    """
+    socket_path = socket_path or get_socket_path()
+    server = create_server(service, socket_path)
+    # Remove the socket when stopped with `kill` too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+class DaemonClient:
+    """
+    Forward prompts to a running daemon, with the same interface as `SuggestionService`.
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _connect(self, request):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            _send(connection, request)
+        except OSError:
+            connection.close()
+            raise
+        return connection
+
+    def _request(self, request):
+        with self._connect(request) as connection:
+            response = json.loads(connection.makefile("rb").readline() or b"null")
+        if not response or response.get("type") == "error":
+            raise RuntimeError((response or {}).get("message", "The shai daemon closed the connection"))
+        return response
+
+    def ping(self):
+        return self._request({"type": "ping"})["type"] == "pong"
+
+    def prewarm_connections(self):
+        try:
+            self._request({"type": "prewarm"})
+        except (OSError, RuntimeError) as e:
+            debug_print(f"Pre-warming through the daemon failed: {e}")
+
+    def record_accepted(self, prompt, command, ctx=""):
+        try:
+            self._request({"type": "accept", "prompt": prompt, "command": command, "ctx": ctx})
+        except (OSError, RuntimeError) as e:
+            debug_print(f"Recording the accepted command failed: {e}")
+
+    def get_suggestions(self, prompt, use_cache=True, ctx="", exclude=()):
+        return list(self.iter_suggestions(prompt, use_cache=use_cache, ctx=ctx, exclude=exclude))
+
+    def iter_suggestions(self, prompt, use_cache=True, cancel_event=None, ctx="", exclude=(), speculative=False):
+        """
+        Yield suggested commands for `prompt` as the daemon generates them.
+
+        Setting `cancel_event` closes the connection, which makes the daemon
+        cancel the requests still in flight.
+        """
+        connection = self._connect({
+            "type": "suggest",
+            "prompt": prompt,
+            "use_cache": use_cache,
+            "ctx": ctx,
+            "exclude": list(exclude),
+            "speculative": speculative,
+        })
+        connection.settimeout(CANCEL_POLL_INTERVAL)
+        buffer = b""
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                try:
+                    data = connection.recv(65536)
+                except socket.timeout:
+                    continue
+                if not data:
+                    raise RuntimeError("The shai daemon closed the connection")
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    response = json.loads(line)
+                    if response["type"] == "suggestion":
+                        yield Suggestion(response["command"], response.get("source", MODEL))
+                    elif response["type"] == "done":
+                        return
+                    else:
+                        raise RuntimeError(response.get("message", "The shai daemon failed"))
+        finally:
+            connection.close()
+
+
+def connect_daemon(socket_path=None, timeout=1):
+    """
+    Return a `DaemonClient` when a daemon answers on `socket_path`, otherwise None.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    socket_path = socket_path or get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    client = DaemonClient(socket_path, timeout=timeout)
+    try:
+        if client.ping():
+            return client
+    except (OSError, ValueError, RuntimeError) as e:
+        debug_print(f"No shai daemon answering on {socket_path}: {e}")
+    return None
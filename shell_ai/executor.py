@@ -0,0 +1,85 @@
+import subprocess
+import sys
+import threading
+from collections import deque, namedtuple
+
+# Bytes of each output stream kept for the context of the next prompt.
+MAX_RETAINED_BYTES = 64 * 1024
+READ_SIZE = 64 * 1024
+
+CommandResult = namedtuple("CommandResult", ["exit_code", "stdout", "stderr"])
+
+
+class OutputRing:
+    """
+    Keep the last `max_bytes` written to it, dropping the oldest chunks first.
+    """
+
+    def __init__(self, max_bytes=MAX_RETAINED_BYTES):
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.chunks and self.size - len(self.chunks[0]) >= self.max_bytes:
+            oldest = self.chunks.popleft()
+            self.size -= len(oldest)
+            self.dropped += len(oldest)
+
+    def getvalue(self):
+        """
+        Return the retained output as text, starting at a line boundary when older output was dropped.
+        """
+        data = b"".join(self.chunks)
+        dropped = self.dropped
+        if len(data) > self.max_bytes:
+            dropped += len(data) - self.max_bytes
+            data = data[-self.max_bytes:]
+        text = data.decode(errors="replace")
+        if dropped:
+            text = text.split("\n", 1)[-1]
+            text = f"({dropped} earlier bytes of output omitted)\n{text}"
+        return text
+
+
+def _tee(source, destination, ring):
+    # Reads return as soon as any output is available, so it shows up live
+    while True:
+        data = source.read(READ_SIZE)
+        if not data:
+            break
+        ring.write(data)
+        try:
+            destination.write(data)
+            destination.flush()
+        except (OSError, ValueError):
+            pass
+    source.close()
+
+
+def run_command(command, max_retained_bytes=MAX_RETAINED_BYTES):
+    """
+    Run `command` in a shell, copying its output to the terminal as it is produced.
+
+    Only the last `max_retained_bytes` of stdout and of stderr are kept in
+    memory, so commands with huge outputs neither stall the terminal nor
+    exhaust memory. Returns a `CommandResult` with the exit code and the
+    retained output.
+    """
+    # Anything printed by shai itself has to appear before the command's output
+    sys.stdout.flush()
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    stdout, stderr = OutputRing(max_retained_bytes), OutputRing(max_retained_bytes)
+    readers = [
+        threading.Thread(target=_tee, args=(process.stdout, sys.stdout.buffer, stdout), daemon=True),
+        threading.Thread(target=_tee, args=(process.stderr, sys.stderr.buffer, stderr), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    exit_code = process.wait()
+    for reader in readers:
+        reader.join()
+    return CommandResult(exit_code, stdout.getvalue(), stderr.getvalue())
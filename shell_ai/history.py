@@ -0,0 +1,272 @@
+import os
+import re
+import time
+
+from shell_ai.config import debug_print
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, writes are unlocked there
+    fcntl = None
+
+# Bytes read from the end of the history file to find the most recent entries.
+TAIL_BYTES = 16 * 1024
+
+
+def _lock(file):
+    if fcntl is not None:
+        # POSIX record locks, the kind zsh takes with HIST_FCNTL_LOCK
+        fcntl.lockf(file, fcntl.LOCK_EX)
+
+
+def _unlock(file):
+    if fcntl is not None:
+        fcntl.lockf(file, fcntl.LOCK_UN)
+
+
+class HistoryWriter:
+    """
+    Append commands to a shell's history file in that shell's format.
+
+    Every entry is written with a single `write` while holding an exclusive
+    lock, so shells and other shai processes writing at the same time don't
+    interleave their entries. With `dedup`, a command identical to one of the
+    last `dedup` entries is skipped, those are parsed from the last
+    `TAIL_BYTES` of the file instead of reading all of it.
+    """
+
+    # Where the shell keeps its history unless HISTFILE says otherwise
+    default_path = None
+
+    def __init__(self, path=None, dedup=1):
+        self.path = path or os.environ.get("HISTFILE") or os.path.expanduser(self.default_path)
+        self.dedup = dedup
+
+    def encode(self, command, timestamp):
+        raise NotImplementedError
+
+    def decode(self, data):
+        """
+        Return the commands in `data`, oldest first. The first one may be cut off.
+        """
+        raise NotImplementedError
+
+    def recent(self, file, count):
+        """
+        Return the last `count` commands of the open history `file`.
+        """
+        size = file.seek(0, os.SEEK_END)
+        file.seek(max(0, size - TAIL_BYTES))
+        data = file.read()
+        commands = self.decode(data)
+        if size > TAIL_BYTES and commands:
+            # The first entry in the tail is most likely incomplete
+            commands = commands[1:]
+        return commands[-count:]
+
+    def append(self, command, timestamp=None):
+        """
+        Write `command` to the history file, returns False when it was skipped as a duplicate.
+        """
+        entry = self.encode(command, int(timestamp or time.time()))
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a+b") as file:
+            _lock(file)
+            try:
+                if self.dedup and command in self.recent(file, self.dedup):
+                    debug_print(f"Not adding a duplicate of a recent entry to {self.path}")
+                    return False
+                # Appending moves to the end regardless of the position read from
+                file.write(entry)
+                file.flush()
+            finally:
+                _unlock(file)
+        return True
+
+
+def _join_continued(lines):
+    """
+    Join lines ending in a backslash with the line after them, the escaping of newlines in zsh, ksh and csh history.
+    """
+    commands = []
+    current = None
+    for line in lines:
+        if current is not None:
+            current += "\n" + line
+        else:
+            current = line
+        if current.endswith("\\"):
+            current = current[:-1]
+            continue
+        commands.append(current)
+        current = None
+    if current is not None:
+        commands.append(current)
+    return commands
+
+
+def _escape_newlines(command):
+    return command.replace("\n", "\\\n")
+
+
+# Bytes zsh stores as a Meta byte followed by the byte xor 32.
+_ZSH_META = 0x83
+_ZSH_METAFIED = {0x00} | set(range(0x83, 0xA3))
+
+
+def _metafy(data):
+    encoded = bytearray()
+    for byte in data:
+        if byte in _ZSH_METAFIED:
+            encoded.append(_ZSH_META)
+            encoded.append(byte ^ 32)
+        else:
+            encoded.append(byte)
+    return bytes(encoded)
+
+
+def _unmetafy(data):
+    decoded = bytearray()
+    meta = False
+    for byte in data:
+        if meta:
+            decoded.append(byte ^ 32)
+            meta = False
+        elif byte == _ZSH_META:
+            meta = True
+        else:
+            decoded.append(byte)
+    return bytes(decoded)
+
+
+class ZshHistory(HistoryWriter):
+    """
+    zsh's extended history, `: <timestamp>:<duration>;<command>`, with newlines
+    escaped by a backslash and non-ASCII bytes metafied like zsh does.
+    """
+
+    default_path = "~/.zsh_history"
+    _entry = re.compile(r"^: \d+:\d+;", re.MULTILINE)
+
+    def encode(self, command, timestamp):
+        return _metafy(f": {timestamp}:0;{_escape_newlines(command)}\n".encode("utf-8"))
+
+    def decode(self, data):
+        text = _unmetafy(data).decode("utf-8", errors="replace")
+        return [self._entry.sub("", command, count=1) for command in _join_continued(text.splitlines())]
+
+
+class BashHistory(HistoryWriter):
+    """
+    bash history with a `#<timestamp>` line before every entry, which bash
+    uses to keep the lines of a multi-line command together.
+    """
+
+    default_path = "~/.bash_history"
+    _timestamp = re.compile(r"^#\d+$")
+
+    def encode(self, command, timestamp):
+        return f"#{timestamp}\n{command}\n".encode("utf-8")
+
+    def decode(self, data):
+        commands = []
+        current = None
+        for line in data.decode("utf-8", errors="replace").splitlines():
+            if self._timestamp.match(line):
+                if current is not None:
+                    commands.append("\n".join(current))
+                current = []
+            elif current is None:
+                # An entry written without a timestamp
+                commands.append(line)
+            else:
+                current.append(line)
+        if current:
+            commands.append("\n".join(current))
+        return commands
+
+
+class KshHistory(HistoryWriter):
+    """
+    ksh history, one command per line with newlines escaped by a backslash.
+    """
+
+    default_path = "~/.sh_history"
+
+    def encode(self, command, timestamp):
+        return f"{_escape_newlines(command)}\n".encode("utf-8")
+
+    def decode(self, data):
+        return _join_continued(data.decode("utf-8", errors="replace").splitlines())
+
+
+class CshHistory(HistoryWriter):
+    """
+    csh and tcsh history as tcsh saves it: a `#+<timestamp>` line before every
+    command, with newlines escaped by a backslash.
+    """
+
+    default_path = "~/.history"
+    _timestamp = re.compile(r"^#\+\d+$")
+
+    def __init__(self, path=None, dedup=1):
+        # HISTFILE is not how csh is configured, it may belong to another shell
+        super().__init__(path=path or os.path.expanduser(self.default_path), dedup=dedup)
+
+    def encode(self, command, timestamp):
+        return f"#+{timestamp}\n{_escape_newlines(command)}\n".encode("utf-8")
+
+    def decode(self, data):
+        lines = [line for line in data.decode("utf-8", errors="replace").splitlines() if not self._timestamp.match(line)]
+        return _join_continued(lines)
+
+
+class FishHistory(HistoryWriter):
+    """
+    fish's YAML-like history, `- cmd: <command>` followed by `  when: <timestamp>`,
+    with backslashes and newlines escaped like fish does.
+    """
+
+    default_path = "~/.local/share/fish/fish_history"
+
+    def __init__(self, path=None, dedup=1):
+        data_home = os.environ.get("XDG_DATA_HOME")
+        default = os.path.join(data_home, "fish", "fish_history") if data_home else os.path.expanduser(self.default_path)
+        # fish ignores HISTFILE
+        super().__init__(path=path or default, dedup=dedup)
+
+    def encode(self, command, timestamp):
+        escaped = command.replace("\\", "\\\\").replace("\n", "\\n")
+        return f"- cmd: {escaped}\n  when: {timestamp}\n".encode("utf-8")
+
+    def decode(self, data):
+        commands = []
+        for line in data.decode("utf-8", errors="replace").splitlines():
+            if line.startswith("- cmd: "):
+                commands.append(re.sub(r"\\(.)", lambda match: "\n" if match.group(1) == "n" else match.group(1), line[len("- cmd: "):]))
+        return commands
+
+
+# Maps the name of a shell's executable to the writer of its history format.
+HISTORY_WRITERS = {
+    "zsh": ZshHistory,
+    "bash": BashHistory,
+    "ksh": KshHistory,
+    "mksh": KshHistory,
+    "csh": CshHistory,
+    "tcsh": CshHistory,
+    "fish": FishHistory,
+}
+
+
+def get_history_writer(shell, dedup=1):
+    """
+    Return the history writer for the shell at path `shell`, e.g. `$SHELL`, or None when it is not supported.
+    """
+    name = os.path.basename(shell or "")
+    writer = HISTORY_WRITERS.get(name)
+    if writer is None:
+        # Versioned or prefixed binaries, such as bash5 or rbash
+        writer = next((HISTORY_WRITERS[known] for known in sorted(HISTORY_WRITERS, key=len, reverse=True) if known in name), None)
+    return writer(dedup=dedup) if writer is not None else None
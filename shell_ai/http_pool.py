@@ -0,0 +1,66 @@
+import asyncio
+import importlib.util
+import threading
+from collections import namedtuple
+
+from shell_ai.config import debug_print
+
+HttpClients = namedtuple("HttpClients", ["sync", "async_"])
+
+
+def create_http_clients(pool_size, keepalive_expiry, on_response=None, **client_kwargs):
+    """
+    Create the sync and async HTTP clients shared by every request to the provider.
+
+    Both keep up to `pool_size` connections alive for `keepalive_expiry` seconds,
+    so later rounds reuse them instead of opening new TLS connections. HTTP/2 is
+    used when the optional `h2` package is installed. `on_response` is called
+    with every response, e.g. to read its rate limit headers.
+    """
+    import httpx
+
+    http2 = importlib.util.find_spec("h2") is not None
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=keepalive_expiry,
+    )
+    sync_hooks, async_hooks = {}, {}
+    if on_response is not None:
+        async def on_async_response(response):
+            on_response(response)
+
+        sync_hooks = {"response": [on_response]}
+        async_hooks = {"response": [on_async_response]}
+    debug_print(f"Creating HTTP connection pool of {pool_size} (http2={http2})")
+    return HttpClients(
+        sync=httpx.Client(http2=http2, limits=limits, event_hooks=sync_hooks, **client_kwargs),
+        async_=httpx.AsyncClient(http2=http2, limits=limits, event_hooks=async_hooks, **client_kwargs),
+    )
+
+
+def prewarm(clients, url, connections, engine=None):
+    """
+    Open `connections` connections to `url` in the background.
+
+    When an `engine` is given its event loop warms the async client, otherwise
+    the sync client is warmed from a daemon thread. Failures are ignored, the
+    connection is only opened ahead of time.
+    """
+    if engine is not None:
+        async def warm():
+            await asyncio.gather(
+                *(clients.async_.head(url) for _ in range(connections)),
+                return_exceptions=True,
+            )
+        engine.submit(warm())
+        return
+
+    def warm_one():
+        try:
+            clients.sync.head(url)
+        except Exception as e:
+            debug_print(f"Pre-warming {url} failed: {e}")
+
+    for _ in range(connections):
+        threading.Thread(target=warm_one, daemon=True).start()
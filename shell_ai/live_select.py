@@ -0,0 +1,105 @@
+import threading
+import time
+
+from shell_ai.config import debug_print
+from shell_ai.providers import timed_import
+from shell_ai.suggestion_source import MODEL, source_of
+from shell_ai.telemetry import record_span
+
+PENDING_LABEL = "  (generating suggestions...)"
+ACCEPTED_LABEL = "  (accepted before)"
+
+_DONE = object()
+
+
+def select_streaming(message, suggestions, system_options, format_name):
+    """
+    Show a selection menu right away and add suggestions to it as they arrive.
+
+    `suggestions` is an iterator of commands, consumed on a background thread.
+    Suggestions are inserted above `system_options` and are selectable as soon
+    as they appear. Commands accepted earlier for a similar prompt go below the
+    model's suggestions, so the cursor never starts on one. Returns the
+    selected value.
+    """
+    import asyncio
+
+    return asyncio.run(_select_streaming(message, suggestions, system_options, format_name))
+
+
+async def _select_streaming(message, suggestions, system_options, format_name):
+    import asyncio
+
+    start = time.perf_counter()
+    inquirer = timed_import("InquirerPy.inquirer")
+    Choice = timed_import("InquirerPy.base.control").Choice
+    Separator = timed_import("InquirerPy.separator").Separator
+
+    choices = [Separator(PENDING_LABEL)] + [
+        Choice(name=format_name(option), value=option) for option in system_options
+    ]
+    prompt = inquirer.select(message=message, choices=choices)
+    control = prompt.content_control
+    initial_index = control.selected_choice_index
+    loop = asyncio.get_running_loop()
+    added = 0
+    model_added = 0
+    # Where the cursor is as long as the user hasn't moved it
+    untouched_index = initial_index
+    errors = []
+
+    def rendered(application):
+        application.after_render -= rendered
+        record_span("menu_render", time.perf_counter() - start)
+
+    prompt.application.after_render += rendered
+
+    def add_suggestion(command):
+        nonlocal added, model_added, untouched_index
+        if added == 0:
+            record_span("menu_first_suggestion", time.perf_counter() - start)
+        from_model = source_of(command) == MODEL
+        position = model_added if from_model else added
+        name = format_name(command) if from_model else format_name(command) + ACCEPTED_LABEL
+        control.choices.insert(position, {"name": name, "value": command, "enabled": False})
+        if from_model and model_added == 0 and control.selected_choice_index == untouched_index:
+            # Nothing the model suggested was selectable yet, so move the cursor to the first suggestion
+            control.selected_choice_index = 0
+        elif control.selected_choice_index >= position:
+            control.selected_choice_index += 1
+        if untouched_index >= position:
+            untouched_index += 1
+        added += 1
+        model_added += from_model
+        prompt.application.invalidate()
+
+    def finish():
+        if errors and added == 0:
+            control.choices[added]["name"] = f"  (failed to generate suggestions: {errors[0]})"
+            prompt.application.invalidate()
+            return
+        # Drop the pending marker which sits right below the suggestions
+        del control.choices[added]
+        if control.selected_choice_index > added:
+            control.selected_choice_index -= 1
+        prompt.application.invalidate()
+
+    def post(callback, *args):
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # The menu already closed
+            pass
+
+    def consume():
+        try:
+            for command in suggestions:
+                post(add_suggestion, command)
+        except Exception as e:
+            debug_print(f"Generating suggestions failed: {e}")
+            errors.append(e)
+        post(finish)
+
+    # A daemon thread, so a request still in flight never delays closing the menu
+    threading.Thread(target=consume, daemon=True).start()
+    return await prompt.execute_async()
@@ -1,23 +1,22 @@
 #!/usr/bin/env python3
 import os
-import platform
 import subprocess
 import sys
 import textwrap
 from enum import Enum
-import json
 import argparse
+import threading
 import time
 
-from InquirerPy import inquirer
-from InquirerPy.base.control import Choice
-from langchain_openai.chat_models import AzureChatOpenAI, ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-from langchain_groq import ChatGroq
-from langchain_mistralai import ChatMistralAI
-from shell_ai.config import load_config
-from shell_ai.code_parser import code_parser, ContextManager
-from shell_ai.parallel_suggestions import generate_suggestions_parallel
+from shell_ai.config import load_config, redact
+from shell_ai.context import ContextManager, get_tokenizer
+from shell_ai.daemon import connect_daemon, get_socket_path, serve
+from shell_ai.executor import run_command
+from shell_ai.history import get_history_writer
+from shell_ai.providers import IMPORT_TIMINGS, get_messages, timed_import
+from shell_ai.speculation import Speculation
+from shell_ai.suggestion_source import CACHE, MODEL, source_of
+from shell_ai.telemetry import SpanLog, configure as configure_telemetry, print_stats, record_span, span
 
 class SelectSystemOptions(Enum):
     OPT_GEN_SUGGESTIONS = "Generate new suggestions"
@@ -40,43 +39,28 @@ def debug_print(*args, **kwargs):
     if os.environ.get("DEBUG", "").lower() == "true":
         print(*args, **kwargs)
 
-def main():
+def print_startup_profile(timings):
     """
-    Required environment variables:
-    - OPENAI_API_KEY: Your OpenAI API key. You can find this on https://beta.openai.com/account/api-keys
-
-    Allowed envionment variables:
-    - OPENAI_MODEL: The name of the OpenAI model to use. Defaults to `gpt-3.5-turbo`.
-    - OLLAMA_MODEL: The name of the Ollama model to use. Defaults to `phi3.5`.
-    - SHAI_SUGGESTION_COUNT: The number of suggestions to generate. Defaults to 3.
-    - SHAI_SKIP_CONFIRM: Skip confirmation of the command to execute. Defaults to false. Set to `true` to skip confirmation.
-    - SHAI_SKIP_HISTORY: Skip writing selected command to shell history (currently supported shells are zsh, bash, csh, tcsh, ksh, and fish). Defaults to false. Set to `true` to skip writing.
-    - CTX: Allow the assistant to keep the console outputs as context allowing the LLM to produce more precise outputs. IMPORTANT: the outputs will be sent to OpenAI through their API, be careful if any sensitive data. Default to false.
-    - SHAI_TEMPERATURE: Controls randomness in the output. Lower values make output more focused and deterministic (default: 0.05).
-    - OLLAMA_API_BASE: The Ollama endpoint to use (default: "http://localhost:11434/v1/").
-    Additional required environment variables for Azure Deployments:
-    - OPENAI_API_KEY: Your OpenAI API key. You can find this on https://beta.openai.com/account/api-keys
-    - OPENAI_API_TYPE: "azure"
-    - AZURE_API_BASE
-    - AZURE_DEPLOYMENT_NAME
+    Print how long each startup phase and on-demand import took.
     """
+    print("Startup profile:")
+    for name, seconds in timings:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+    print(f"  {sum(seconds for _, seconds in timings) * 1000:8.1f} ms  total")
 
-    # Load env configuration
-    loaded_config = load_config()
-    # Load keys of the configuration into environment variables
-    for key, value in loaded_config.items():
-        os.environ[key] = str(value)
-
-    # Dump environment variables for debugging
-    debug_print("Environment variables:")
-    for key, value in os.environ.items():
-        debug_print(f"{key}={value}")
+def build_service(loaded_config, args, startup_timings):
+    """
+    Validate the provider configuration and build the in-process suggestion service.
 
-    # Dump loaded configuration for debugging
-    debug_print("\nLoaded configuration:")
-    for key, value in loaded_config.items():
-        debug_print(f"{key}={value}")
-    debug_print()
+    With `--profile-startup` or `--serve` this runs that mode instead and returns None.
+    """
+    # Imported here rather than at the top, so a prompt forwarded to the
+    # daemon never pays for the suggestion stack
+    from shell_ai.cache import SuggestionCache
+    from shell_ai.command_index import CommandIndex, is_available as command_index_available
+    from shell_ai.scheduler import RequestScheduler
+    from shell_ai.suggestions import SuggestionService
+    from shell_ai.system_context import SystemContext
 
     if (os.environ.get("OPENAI_API_KEY") is None
             and os.environ.get("GROQ_API_KEY") is None
@@ -89,54 +73,40 @@ def main():
         )
         sys.exit(1)
 
-    TEXT_EDITORS = ("vi", "vim", "emacs", "nano", "ed", "micro", "joe", "nvim")
-
-    CTX = os.environ.get("CTX", "False")
-
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--ctx', action='store_true', help='Set context mode to True.')
-    parser.add_argument('prompt', type=str, nargs='*', default=None)
-    args = parser.parse_args()
-    if args.ctx:
-        prompt = args.prompt
-        CTX = 'True'
-    else:
-        # Consume all arguments after the script name as a single sentence
-        prompt = " ".join(sys.argv[1:])
-
-    OPENAI_MODEL = os.environ.get("OPENAI_MODEL", loaded_config.get("OPENAI_MODEL"))
-    OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", loaded_config.get("OLLAMA_MODEL","phi3.5"))
-    OPENAI_MAX_TOKENS = os.environ.get("OPENAI_MAX_TOKENS", None)
-    OLLAMA_MAX_TOKENS = os.environ.get("OLLAMA_MAX_TOKENS", loaded_config.get("OLLAMA_MAX_TOKENS",1500))
-    OLLAMA_API_BASE = os.environ.get("OLLAMA_API_BASE",  loaded_config.get("OLLAMA_API_BASE","http://localhost:11434/v1/"))
-    OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE", None)
-    # Mistral configuration
     MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY")
-    MISTRAL_MODEL = os.environ.get("MISTRAL_MODEL", loaded_config.get("MISTRAL_MODEL"))
-    MISTRAL_API_BASE = os.environ.get("MISTRAL_API_BASE", loaded_config.get("MISTRAL_API_BASE", "https://api.mistral.ai/v1"))
-
-    OPENAI_ORGANIZATION = os.environ.get("OPENAI_ORGANIZATION", None)
-    OPENAI_PROXY = os.environ.get("OPENAI_PROXY", None)
     SHAI_SUGGESTION_COUNT = int(os.environ.get("SHAI_SUGGESTION_COUNT", loaded_config.get("SHAI_SUGGESTION_COUNT", "3")))
 
     # required configs just for azure openai deployments (faster)
     SHAI_API_PROVIDER = os.environ.get("SHAI_API_PROVIDER", loaded_config.get("SHAI_API_PROVIDER", "openai"))
 
-    OPENAI_API_VERSION = os.environ.get("OPENAI_API_VERSION", "2023-05-15")
     if SHAI_API_PROVIDER not in APIProvider.__members__:
         print(
             f"Your SHAI_API_PROVIDER is not valid. Please choose one of {APIProvider.__members__}"
         )
         sys.exit(1)
 
+    # Providers requests fail over to, or are raced against, comma separated
+    SHAI_FALLBACK_PROVIDERS = [
+        fallback.strip()
+        for fallback in os.environ.get("SHAI_FALLBACK_PROVIDERS", loaded_config.get("SHAI_FALLBACK_PROVIDERS", "")).split(",")
+        if fallback.strip()
+    ]
+    for fallback in SHAI_FALLBACK_PROVIDERS:
+        if fallback not in APIProvider.__members__:
+            print(
+                f"Your SHAI_FALLBACK_PROVIDERS entry {fallback} is not valid. Please choose from {APIProvider.__members__}"
+            )
+            sys.exit(1)
+    providers = [SHAI_API_PROVIDER] + SHAI_FALLBACK_PROVIDERS
+
     AZURE_DEPLOYMENT_NAME = os.environ.get("AZURE_DEPLOYMENT_NAME", None)
     AZURE_API_BASE = os.environ.get("AZURE_API_BASE", None)
-    if SHAI_API_PROVIDER == "azure" and AZURE_DEPLOYMENT_NAME is None:
+    if "azure" in providers and AZURE_DEPLOYMENT_NAME is None:
         print(
             "Please set the AZURE_DEPLOYMENT_NAME environment variable to your Azure deployment name."
         )
         sys.exit(1)
-    if SHAI_API_PROVIDER == "azure" and AZURE_API_BASE is None:
+    if "azure" in providers and AZURE_API_BASE is None:
         print(
             "Please set the AZURE_API_BASE environment variable to your Azure API base."
         )
@@ -144,14 +114,13 @@ def main():
 
     # Groq configuration
     GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-    GROQ_MODEL = os.environ.get("GROQ_MODEL", loaded_config.get("GROQ_MODEL"))
-    if SHAI_API_PROVIDER == "groq" and not GROQ_API_KEY:
+    if "groq" in providers and not GROQ_API_KEY:
         print(
             "Please set the GROQ_API_KEY environment variable to your Groq API key."
         )
         sys.exit(1)
 
-    if SHAI_API_PROVIDER == "mistral" and not MISTRAL_API_KEY:
+    if "mistral" in providers and not MISTRAL_API_KEY:
         print(
             "Please set the MISTRAL_API_KEY environment variable to your Mistral API key."
         )
@@ -162,128 +131,391 @@ def main():
     # Get temperature from config or environment
     SHAI_TEMPERATURE = float(os.environ.get("SHAI_TEMPERATURE", loaded_config.get("SHAI_TEMPERATURE", "0.05")))
 
-    # Initialize chat provider based on configuration
-    if SHAI_API_PROVIDER == "openai":
-        chat = ChatOpenAI(
-            model_name=OPENAI_MODEL,
-            openai_api_base=OPENAI_API_BASE,
-            openai_organization=OPENAI_ORGANIZATION,
-            openai_proxy=OPENAI_PROXY,
-            max_tokens=OPENAI_MAX_TOKENS,
-            temperature=SHAI_TEMPERATURE,
-        )
-    elif SHAI_API_PROVIDER == "azure":
-        chat = AzureChatOpenAI(
-            openai_api_base=AZURE_API_BASE,
-            openai_api_version=OPENAI_API_VERSION,
-            deployment_name=AZURE_DEPLOYMENT_NAME,
-            openai_api_key=os.environ.get("OPENAI_API_KEY"),
-            openai_api_type="azure",
-            temperature=SHAI_TEMPERATURE,
-        )
-    elif SHAI_API_PROVIDER == "groq":
-        chat = ChatGroq(
-            model_name=GROQ_MODEL,
-            groq_api_key=GROQ_API_KEY,
-            temperature=SHAI_TEMPERATURE,
+    # Either one request per suggestion (parallel), one request asking for all of
+    # them as a JSON list (batch) or one request using the provider's `n` parameter
+    SHAI_GENERATION_STRATEGY = os.environ.get("SHAI_GENERATION_STRATEGY", loaded_config.get("SHAI_GENERATION_STRATEGY", "parallel"))
+    if SHAI_GENERATION_STRATEGY not in ("parallel", "batch", "n"):
+        print("Your SHAI_GENERATION_STRATEGY is not valid. Please choose one of parallel, batch or n.")
+        sys.exit(1)
+
+    # Generation engine configuration
+    SHAI_ENGINE = os.environ.get("SHAI_ENGINE", loaded_config.get("SHAI_ENGINE", "asyncio"))
+    if SHAI_ENGINE not in ("asyncio", "threads"):
+        print("Your SHAI_ENGINE is not valid. Please choose either asyncio or threads.")
+        sys.exit(1)
+    SHAI_MAX_CONCURRENCY = int(os.environ.get("SHAI_MAX_CONCURRENCY", loaded_config.get("SHAI_MAX_CONCURRENCY", "8")))
+    # A value of 0 disables the request timeout or hedging
+    SHAI_REQUEST_TIMEOUT = float(os.environ.get("SHAI_REQUEST_TIMEOUT", loaded_config.get("SHAI_REQUEST_TIMEOUT", "30"))) or None
+    SHAI_HEDGE_AFTER = float(os.environ.get("SHAI_HEDGE_AFTER", loaded_config.get("SHAI_HEDGE_AFTER", "0"))) or None
+    SHAI_RACE = int(os.environ.get("SHAI_RACE", loaded_config.get("SHAI_RACE", "1")))
+    SHAI_CIRCUIT_FAILURES = int(os.environ.get("SHAI_CIRCUIT_FAILURES", loaded_config.get("SHAI_CIRCUIT_FAILURES", "3")))
+    SHAI_CIRCUIT_COOLDOWN = float(os.environ.get("SHAI_CIRCUIT_COOLDOWN", loaded_config.get("SHAI_CIRCUIT_COOLDOWN", "30")))
+
+    # Requests and tokens per minute each provider allows, learned from its responses when not set
+    SHAI_RATE_LIMIT_RETRIES = int(os.environ.get("SHAI_RATE_LIMIT_RETRIES", loaded_config.get("SHAI_RATE_LIMIT_RETRIES", "3")))
+    rate_limits = {}
+    for provider in providers:
+        requests_per_minute = os.environ.get(f"{provider.upper()}_REQUESTS_PER_MINUTE", loaded_config.get(f"{provider.upper()}_REQUESTS_PER_MINUTE"))
+        tokens_per_minute = os.environ.get(f"{provider.upper()}_TOKENS_PER_MINUTE", loaded_config.get(f"{provider.upper()}_TOKENS_PER_MINUTE"))
+        rate_limits[provider] = (
+            float(requests_per_minute) if requests_per_minute else None,
+            float(tokens_per_minute) if tokens_per_minute else None,
         )
-    elif SHAI_API_PROVIDER == "ollama":
-         chat = ChatOpenAI(
-            model_name=OLLAMA_MODEL,
-            openai_api_base=OLLAMA_API_BASE,
-            max_tokens=OLLAMA_MAX_TOKENS,
-            temperature=SHAI_TEMPERATURE,
-            api_key="ollama"
-         )
-    elif SHAI_API_PROVIDER == "mistral":
-        chat = ChatMistralAI(
-            model_name=MISTRAL_MODEL,
-            api_key=MISTRAL_API_KEY,
-            base_url=MISTRAL_API_BASE,
-            temperature=SHAI_TEMPERATURE,
+    scheduler = RequestScheduler(max_concurrency=SHAI_MAX_CONCURRENCY, limits=rate_limits, retries=SHAI_RATE_LIMIT_RETRIES)
+    # Budget of the next rounds generated before they are asked for, shared by every shai process
+    SHAI_SPECULATION_TOKENS = int(os.environ.get("SHAI_SPECULATION_TOKENS", loaded_config.get("SHAI_SPECULATION_TOKENS", "20000")))
+
+    # Suggestion cache configuration
+    SHAI_CACHE = str(os.environ.get("SHAI_CACHE", loaded_config.get("SHAI_CACHE", "true"))).lower() == "true"
+    SHAI_CACHE_TTL = float(os.environ.get("SHAI_CACHE_TTL", loaded_config.get("SHAI_CACHE_TTL", "604800")))
+    SHAI_CACHE_MAX_ENTRIES = int(os.environ.get("SHAI_CACHE_MAX_ENTRIES", loaded_config.get("SHAI_CACHE_MAX_ENTRIES", "500")))
+    suggestion_cache = SuggestionCache(ttl=SHAI_CACHE_TTL, max_entries=SHAI_CACHE_MAX_ENTRIES) if SHAI_CACHE else None
+
+    # Local index of accepted commands, looked up while the model answers
+    SHAI_INDEX = str(os.environ.get("SHAI_INDEX", loaded_config.get("SHAI_INDEX", "true"))).lower() == "true"
+    SHAI_INDEX_THRESHOLD = float(os.environ.get("SHAI_INDEX_THRESHOLD", loaded_config.get("SHAI_INDEX_THRESHOLD", "0.7")))
+    command_index = None
+    if SHAI_INDEX:
+        if command_index_available():
+            command_index = CommandIndex(threshold=SHAI_INDEX_THRESHOLD)
+        else:
+            debug_print("NumPy is not installed, the local command index is disabled")
+
+    # HTTP connection pool configuration
+    SHAI_HTTP_POOL = str(os.environ.get("SHAI_HTTP_POOL", loaded_config.get("SHAI_HTTP_POOL", "true"))).lower() == "true"
+    SHAI_HTTP_KEEPALIVE = float(os.environ.get("SHAI_HTTP_KEEPALIVE", loaded_config.get("SHAI_HTTP_KEEPALIVE", "120")))
+    SHAI_PREWARM = str(os.environ.get("SHAI_PREWARM", loaded_config.get("SHAI_PREWARM", "true"))).lower() == "true"
+    # Description of the system in the prompt, cached on disk
+    SHAI_SYSTEM_TOOLS = str(os.environ.get("SHAI_SYSTEM_TOOLS", loaded_config.get("SHAI_SYSTEM_TOOLS", "true"))).lower() == "true"
+    SHAI_STREAM = str(os.environ.get("SHAI_STREAM", loaded_config.get("SHAI_STREAM", "true"))).lower() == "true"
+
+    service = SuggestionService(
+        provider=SHAI_API_PROVIDER,
+        config=loaded_config,
+        temperature=SHAI_TEMPERATURE,
+        suggestion_count=SHAI_SUGGESTION_COUNT,
+        strategy=SHAI_GENERATION_STRATEGY,
+        engine=SHAI_ENGINE,
+        max_concurrency=SHAI_MAX_CONCURRENCY,
+        request_timeout=SHAI_REQUEST_TIMEOUT,
+        hedge_after=SHAI_HEDGE_AFTER,
+        http_pool=SHAI_HTTP_POOL,
+        http_keepalive=SHAI_HTTP_KEEPALIVE,
+        prewarm=SHAI_PREWARM,
+        cache=suggestion_cache,
+        index=command_index,
+        fallback_providers=SHAI_FALLBACK_PROVIDERS,
+        race=SHAI_RACE,
+        circuit_failures=SHAI_CIRCUIT_FAILURES,
+        circuit_cooldown=SHAI_CIRCUIT_COOLDOWN,
+        stream=SHAI_STREAM,
+        system_context=SystemContext(tools=SHAI_SYSTEM_TOOLS),
+        scheduler=scheduler,
+        speculation_tokens=SHAI_SPECULATION_TOKENS,
+    )
+
+    if args.profile_startup:
+        client_start = time.perf_counter()
+        service.get_chat()
+        # Exclude the backend import itself, it is reported on its own line
+        client_elapsed = time.perf_counter() - client_start - sum(IMPORT_TIMINGS.values())
+        get_messages()
+        timed_import("InquirerPy.inquirer")
+        timed_import("InquirerPy.base.control")
+        startup_timings.extend(
+            (f"import {name}", seconds) for name, seconds in IMPORT_TIMINGS.items()
         )
+        startup_timings.append((f"build {SHAI_API_PROVIDER} client", client_elapsed))
+        print_startup_profile(startup_timings)
+        return None
+
+    if args.serve:
+        # Initialize the providers and connections up front so the first prompt is fast
+        for provider in service.providers:
+            service.get_chat(provider)
+        service.prewarm_connections()
+        print(f"shai daemon listening on {get_socket_path()}")
+        try:
+            serve(service)
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        return None
+
+    return service
 
-    if platform.system() == "Linux":
-        info = platform.freedesktop_os_release()
-        plaform_string =  f"The system the shell command will be executed on is {platform.system()} {platform.release()}, running {info.get('ID')} version {info.get('VERSION_ID', info.get('BUILD_ID'))}. \n"
-    else:
-        plaform_string = f"The system the shell command will be executed on is {platform.system()} {platform.release()}. \n"
-
-
-    def get_suggestions(prompt):
-        base_system_message = """You are an expert at using shell commands. I need you to provide a response in the format `{"command": "your_shell_command_here"}`. """ + plaform_string + """ Only provide a single executable line of shell code as the value for the "command" key. Never output any text outside the JSON structure. The command will be directly executed in a shell. For example, if I ask to display the message abc, you should respond with ```json\n{"command": "echo abc"}\n```. Make sure the output is valid JSON."""
-        
-        ctx = ContextManager.get_ctx()
-        if ctx:
-            base_system_message += """ Between [], these are the last 1500 tokens from the previous command's output, you can use them as context: [""" + ctx + """]"""
-
-        system_message = SystemMessage(content=base_system_message)
-
-        def generate_single_suggestion():
-            messages = [
-                system_message,
-                HumanMessage(content=f"Generate a shell command that satisfies this user request: {prompt}"),
-            ]
-            debug_print(f"Messages: {messages}")
-            response = chat.generate(
-                messages=[messages]
-            )
-            try:
-                debug_print(f"Response: {response.generations[0][0].message.content}")
-                json_content = code_parser(response.generations[0][0].message.content)
-                command_json = json.loads(json_content)
-                command = command_json.get("command", "")
-                return command if command else None
-            except (json.JSONDecodeError, IndexError):
-                return None
-
-        # Generate suggestions in parallel with max 4 workers
-        commands = generate_suggestions_parallel(
-            generate_single_suggestion,
-            count=SHAI_SUGGESTION_COUNT,
-            max_workers=4
+def main():
+    """
+    Required environment variables:
+    - OPENAI_API_KEY: Your OpenAI API key. You can find this on https://beta.openai.com/account/api-keys
+
+    Allowed envionment variables:
+    - OPENAI_MODEL: The name of the OpenAI model to use. Defaults to `gpt-3.5-turbo`.
+    - OLLAMA_MODEL: The name of the Ollama model to use. Defaults to `phi3.5`.
+    - SHAI_SUGGESTION_COUNT: The number of suggestions to generate. Defaults to 3.
+    - SHAI_SKIP_CONFIRM: Skip confirmation of the command to execute. Defaults to false. Set to `true` to skip confirmation.
+    - SHAI_SKIP_HISTORY: Skip writing selected command to shell history (currently supported shells are zsh, bash, csh, tcsh, ksh, and fish). Defaults to false. Set to `true` to skip writing.
+    - SHAI_HISTORY_DEDUP: Skip writing a command to history when it matches one of this many most recent entries, 0 writes every command (default: 1).
+    - CTX: Allow the assistant to keep the console outputs as context allowing the LLM to produce more precise outputs. IMPORTANT: the outputs will be sent to OpenAI through their API, be careful if any sensitive data. Default to false.
+    - SHAI_CONTEXT_TOKENS: Token budget for the commands and outputs kept as context in CTX mode (default: 1500).
+    - SHAI_CONTEXT_COMMANDS: Number of previous commands kept as context in CTX mode (default: 3).
+    - SHAI_CONTEXT_MAX_BYTES: Bytes of a command's stdout and of its stderr kept in memory for the context in CTX mode, the output itself is shown live (default: 65536).
+    - SHAI_CONTEXT_TOKENIZER: How context tokens are counted, `approximate`, `chars` or `tiktoken` (requires the tiktoken package). Defaults to approximate.
+    - SHAI_TEMPERATURE: Controls randomness in the output. Lower values make output more focused and deterministic (default: 0.05).
+    - OLLAMA_API_BASE: The Ollama endpoint to use (default: "http://localhost:11434/v1/").
+    - SHAI_STREAM_SUGGESTIONS: Open the menu immediately and add suggestions as they arrive. Defaults to true.
+    - SHAI_GENERATION_STRATEGY: `parallel` sends one request per suggestion, `batch` asks for all suggestions as a JSON list in one request and `n` uses the provider's `n` parameter (OpenAI and Azure only, others fall back to batch). Defaults to parallel.
+    - SHAI_ENGINE: How suggestion requests are run, either `asyncio` (one shared event loop) or `threads`. Defaults to asyncio.
+    - SHAI_MAX_CONCURRENCY: Maximum number of requests in flight at once (default: 8).
+    - SHAI_REQUEST_TIMEOUT: Seconds before a single asyncio request is abandoned, 0 disables the timeout (default: 30).
+    - SHAI_HEDGE_AFTER: Seconds after which a still outstanding asyncio request is re-issued, first answer wins. 0 disables hedging (default: 0).
+    - SHAI_INDEX: Show previously accepted commands for the same prompt worded differently below the model's suggestions, requires NumPy (`pip install shell-ai[index]`). Defaults to true.
+    - SHAI_INDEX_THRESHOLD: Minimum similarity, between 0 and 1, of a stored prompt for its command to be shown (default: 0.7).
+    - SHAI_FALLBACK_PROVIDERS: Comma separated providers, e.g. `ollama`, used next to SHAI_API_PROVIDER. Requests go to the fastest healthy provider and fail over to the others. Defaults to none.
+    - SHAI_RACE: Number of providers every request is sent to at once, the first valid answer wins (default: 1).
+    - SHAI_CIRCUIT_FAILURES: Consecutive failures after which a provider is skipped (default: 3).
+    - SHAI_CIRCUIT_COOLDOWN: Seconds a failing provider is skipped before it is tried again (default: 30).
+    - SHAI_SYSTEM_TOOLS: Tell the model which common optional tools, e.g. rg, fd or jq, are installed. Defaults to true.
+    - SHAI_STREAM: Stream responses and stop reading as soon as the command in them is complete, not used by the `n` strategy. Defaults to true.
+    - SHAI_RATE_LIMIT_RETRIES: Retries of a request that was rate limited or failed temporarily, paced to the provider's limits (default: 3).
+    - GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE (and the same for OPENAI, AZURE, OLLAMA and MISTRAL): Rate limits to keep requests within, otherwise learned from the provider's responses. Default to none.
+    - SHAI_SPECULATION_TOKENS: While the menu is shown the next round of suggestions is generated at a slightly higher temperature, so `Generate new suggestions` is instant. Caps the estimated tokens an hour spent on it by every shai process, 0 disables it (default: 20000).
+    - SHAI_HTTP_POOL: Share one keep-alive HTTP connection pool, sized by SHAI_MAX_CONCURRENCY, between all requests. Defaults to true.
+    - SHAI_HTTP_KEEPALIVE: Seconds an idle pooled connection is kept open (default: 120).
+    - SHAI_PREWARM: Open connections to the provider while a new command is being typed. Defaults to true.
+    - SHAI_BATCH_WORKERS: Prompts generated at once with `--batch` (default: 4).
+    - SHAI_DAEMON: Forward prompts to a daemon started with `shai --serve` when one is running. Defaults to true.
+    - SHAI_DAEMON_SOCKET: Path of the daemon's Unix domain socket (default: `~/.config/shell-ai/daemon.sock`).
+    - SHAI_STATS: Record how long each phase of a run takes in a local log, summarized by `shai --stats`. Defaults to true.
+    - SHAI_STATS_MAX_BYTES: Size after which the timing log is rotated, three rotated logs are kept (default: 1048576).
+    - SHAI_CACHE: Reuse previously generated suggestions for the same prompt, platform, model and temperature. Defaults to true.
+    - SHAI_CACHE_TTL: Seconds a cached suggestion stays valid (default: 604800, one week).
+    - SHAI_CACHE_MAX_ENTRIES: Maximum number of cached prompts, least recently used are evicted first (default: 500).
+    Additional required environment variables for Azure Deployments:
+    - OPENAI_API_KEY: Your OpenAI API key. You can find this on https://beta.openai.com/account/api-keys
+    - OPENAI_API_TYPE: "azure"
+    - AZURE_API_BASE
+    - AZURE_DEPLOYMENT_NAME
+    """
+
+    startup_timings = []
+    config_start = time.perf_counter()
+    # Load env configuration
+    loaded_config = load_config()
+    startup_timings.append(("load_config", time.perf_counter() - config_start))
+    # Load keys of the configuration into environment variables
+    for key, value in loaded_config.items():
+        os.environ[key] = str(value)
+
+    # Timing spans of every run, summarized by `shai --stats`
+    SHAI_STATS = str(os.environ.get("SHAI_STATS", loaded_config.get("SHAI_STATS", "true"))).lower() == "true"
+    SHAI_STATS_MAX_BYTES = int(os.environ.get("SHAI_STATS_MAX_BYTES", loaded_config.get("SHAI_STATS_MAX_BYTES", "1048576")))
+    span_log = SpanLog(max_bytes=SHAI_STATS_MAX_BYTES)
+    if SHAI_STATS:
+        configure_telemetry(span_log)
+    record_span("load_config", startup_timings[0][1])
+
+    # Dump environment variables for debugging, without credentials
+    debug_print("Environment variables:")
+    for key, value in os.environ.items():
+        debug_print(f"{key}={redact(key, value)}")
+
+    # Dump loaded configuration for debugging
+    debug_print("\nLoaded configuration:")
+    for key, value in loaded_config.items():
+        debug_print(f"{key}={redact(key, value)}")
+    debug_print()
+
+    TEXT_EDITORS = ("vi", "vim", "emacs", "nano", "ed", "micro", "joe", "nvim")
+
+    CTX = os.environ.get("CTX", "False")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ctx', action='store_true', help='Set context mode to True.')
+    parser.add_argument('--profile-startup', action='store_true', help='Print per-import startup timings and exit.')
+    parser.add_argument('--serve', action='store_true', help='Run a background daemon that answers prompts for other shai invocations.')
+    parser.add_argument('--stats', nargs='?', const=0, type=float, metavar='DAYS', help='Print timing percentiles per provider and model, optionally of the last DAYS days, and exit.')
+    parser.add_argument('--batch', nargs='?', const='-', metavar='FILE', help='Read prompts from FILE, or stdin, one per line or as JSON lines, and write the suggestions as JSON lines without a menu.')
+    parser.add_argument('--workers', type=int, help='Prompts generated at once in batch mode (default: SHAI_BATCH_WORKERS or 4).')
+    parser.add_argument('--execute', action='store_true', help='In batch mode, run the top command of every prompt and include its output.')
+    parser.add_argument('prompt', type=str, nargs='*', default=None)
+    args = parser.parse_args()
+    if args.stats is not None:
+        print_stats(span_log, days=args.stats)
+        return
+    if args.ctx:
+        CTX = 'True'
+    if CTX == 'True':
+        ContextManager.configure(
+            max_tokens=int(os.environ.get("SHAI_CONTEXT_TOKENS", loaded_config.get("SHAI_CONTEXT_TOKENS", 1500))),
+            max_commands=int(os.environ.get("SHAI_CONTEXT_COMMANDS", loaded_config.get("SHAI_CONTEXT_COMMANDS", 3))),
+            tokenizer=get_tokenizer(os.environ.get("SHAI_CONTEXT_TOKENIZER", loaded_config.get("SHAI_CONTEXT_TOKENIZER", "approximate"))),
         )
-        
-        # Filter out None values and deduplicate
-        commands = list(set(cmd for cmd in commands if cmd))
-        
-        return commands
+    SHAI_CONTEXT_MAX_BYTES = int(os.environ.get("SHAI_CONTEXT_MAX_BYTES", loaded_config.get("SHAI_CONTEXT_MAX_BYTES", 65536)))
+    # Consume all remaining arguments as a single sentence
+    prompt = " ".join(args.prompt)
+
+    SHAI_STREAM_SUGGESTIONS = str(os.environ.get("SHAI_STREAM_SUGGESTIONS", loaded_config.get("SHAI_STREAM_SUGGESTIONS", "true"))).lower() == "true"
+
+    if not prompt and not (args.profile_startup or args.serve or args.batch):
+        print("Describe what you want to do as a single sentence. `shai <sentence>`")
+        return
+
+    # Forward prompts to a running daemon, which already holds an initialized
+    # provider, and only build everything in-process when there is none
+    SHAI_DAEMON = str(os.environ.get("SHAI_DAEMON", loaded_config.get("SHAI_DAEMON", "true"))).lower() == "true"
+    service = None
+    if SHAI_DAEMON and (prompt or args.batch) and not args.profile_startup:
+        service = connect_daemon()
+        if service is not None:
+            debug_print(f"Using the shai daemon at {service.socket_path}")
+    if service is None:
+        service = build_service(loaded_config, args, startup_timings)
+        if service is None:
+            return
+
+    if args.batch:
+        from shell_ai.batch import run_batch
+
+        SHAI_BATCH_WORKERS = args.workers or int(os.environ.get("SHAI_BATCH_WORKERS", loaded_config.get("SHAI_BATCH_WORKERS", "4")))
+        try:
+            with span("batch", workers=SHAI_BATCH_WORKERS, execute=args.execute):
+                if args.batch == "-":
+                    failures = run_batch(service, sys.stdin, sys.stdout, workers=SHAI_BATCH_WORKERS, execute=args.execute)
+                else:
+                    with open(args.batch) as prompts:
+                        failures = run_batch(service, prompts, sys.stdout, workers=SHAI_BATCH_WORKERS, execute=args.execute)
+        except BrokenPipeError:
+            # The reader of the results went away, e.g. `shai --batch | head`.
+            # Point stdout at /dev/null so flushing it on exit doesn't fail again
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+        sys.exit(1 if failures else 0)
 
     if prompt:
+        # Only needed for the menu, so printing the usage doesn't pay for it
+        from shell_ai.live_select import ACCEPTED_LABEL, select_streaming
+
+        inquirer = timed_import("InquirerPy.inquirer")
+        Choice = timed_import("InquirerPy.base.control").Choice
         if CTX == 'True':
             print(f"{Colors.WARNING}WARNING{Colors.END} Context mode: datas will be sent to OpenAI, be careful if any sensitive datas...\n")
             print(f">>> {os.getcwd()}") 
+        system_options = [
+            SelectSystemOptions.OPT_GEN_SUGGESTIONS.value,
+            SelectSystemOptions.OPT_NEW_COMMAND.value,
+            SelectSystemOptions.OPT_DISMISS.value,
+        ]
+
+        def format_option(option):
+            # Wrap the text to the terminal width
+            return textwrap.fill(option, os.get_terminal_size().columns, subsequent_indent="  ")
+
+        SHAI_SKIP_HISTORY = os.environ.get("SHAI_SKIP_HISTORY") == "true"
+        SHAI_HISTORY_DEDUP = int(os.environ.get("SHAI_HISTORY_DEDUP", loaded_config.get("SHAI_HISTORY_DEDUP", 1)))
+        history_writer = None if SHAI_SKIP_HISTORY else get_history_writer(os.environ.get("SHELL", ""), dedup=SHAI_HISTORY_DEDUP)
+
+        # 0 disables speculation, the budget itself is kept by the service, shared by every process
+        SHAI_SPECULATION_TOKENS = int(os.environ.get("SHAI_SPECULATION_TOKENS", loaded_config.get("SHAI_SPECULATION_TOKENS", "20000")))
+        speculation = None
+        # Rounds run on the menu's consumer thread, cancelling happens on this one
+        speculation_lock = threading.Lock()
+        # Every command shown for the prompt, new rounds don't repeat them
+        shown = []
+
+        def cancel_speculation():
+            nonlocal speculation
+            with speculation_lock:
+                if speculation is not None:
+                    speculation.cancel()
+                    speculation = None
+
+        def suggestion_round(prompt, use_cache, cancel_event, ctx):
+            """
+            Yield the suggestions of a round, taken from the speculation when one
+            was prepared, and once they are all shown speculate on the next round.
+            """
+            nonlocal speculation
+            if use_cache:
+                # A new prompt, or a new round of one in context mode
+                shown.clear()
+            with speculation_lock:
+                ready = speculation if speculation is not None and not use_cache and speculation.matches(prompt, ctx) else None
+                if ready is None and speculation is not None:
+                    speculation.cancel()
+                speculation = None
+            commands = []
+            if ready is not None:
+                for command in ready.iter_suggestions(cancel_event):
+                    commands.append(command)
+                    yield command
+                ready.cancel()
+            if not commands and not (cancel_event and cancel_event.is_set()):
+                # Nothing was prepared, or the speculation came back empty
+                for command in service.iter_suggestions(
+                    prompt,
+                    use_cache=use_cache,
+                    cancel_event=cancel_event,
+                    ctx=ctx,
+                    exclude=() if use_cache else list(shown),
+                ):
+                    commands.append(command)
+                    yield command
+            shown.extend(commands)
+            # A round from the cache cost nothing, so it isn't worth paying for the next one up front
+            from_cache = all(source_of(command) == CACHE for command in commands)
+            if SHAI_SPECULATION_TOKENS > 0 and commands and not from_cache:
+                with speculation_lock:
+                    # Checked under the lock, so a round the menu closed on
+                    # never starts a speculation after it was cancelled
+                    if not (cancel_event and cancel_event.is_set()):
+                        speculation = Speculation(service, prompt, shown, ctx=ctx)
+
+        use_cache = True
         while True:
-            options = get_suggestions(prompt)
-            options.append(SelectSystemOptions.OPT_GEN_SUGGESTIONS.value)
-            options.append(SelectSystemOptions.OPT_NEW_COMMAND.value)
-            options.append(SelectSystemOptions.OPT_DISMISS.value)
-
-            # Get the terminal width
-            terminal_width = os.get_terminal_size().columns
-
-            # For each option for the name value of the Choice,
-            # wrap the text to the terminal width
-            choices = [
-                Choice(
-                    name=textwrap.fill(option, terminal_width, subsequent_indent="  "),
-                    value=option,
-                )
-                for option in options
-            ]
             try:
-                selection = inquirer.select(
-                    message="Select a command:", choices=choices
-                ).execute()
+                if SHAI_STREAM_SUGGESTIONS:
+                    # Show the menu right away and add suggestions as they arrive,
+                    # requests still in flight are abandoned once a choice is made
+                    cancel_event = threading.Event()
+                    try:
+                        selection = select_streaming(
+                            "Select a command:",
+                            suggestion_round(prompt, use_cache, cancel_event, ContextManager.get_ctx()),
+                            system_options,
+                            format_option,
+                        )
+                    finally:
+                        cancel_event.set()
+                else:
+                    # Commands accepted for similar prompts go below the model's suggestions
+                    commands = sorted(suggestion_round(prompt, use_cache, None, ContextManager.get_ctx()), key=lambda command: source_of(command) != MODEL)
+                    choices = [
+                        Choice(name=format_option(command) + ("" if source_of(command) == MODEL else ACCEPTED_LABEL), value=command)
+                        for command in commands
+                    ] + [Choice(name=format_option(option), value=option) for option in system_options]
+                    selection = inquirer.select(
+                        message="Select a command:", choices=choices
+                    ).execute()
+                use_cache = True
 
                 try:
                     if selection == SelectSystemOptions.OPT_DISMISS.value:
+                        cancel_speculation()
                         sys.exit(0)
                     elif selection == SelectSystemOptions.OPT_NEW_COMMAND.value:
+                        cancel_speculation()
+                        service.prewarm_connections()
                         prompt = input("New command: ")
                         continue
                     elif selection == SelectSystemOptions.OPT_GEN_SUGGESTIONS.value:
+                        # Explicitly asking for new suggestions bypasses the cache
+                        use_cache = False
                         continue
+                    # A command was picked, the next round won't be asked for
+                    cancel_speculation()
                     if os.environ.get("SHAI_SKIP_CONFIRM") != "true":
                         user_command = inquirer.text(
                             message="Confirm:", default=selection
@@ -291,39 +523,23 @@ def main():
                     else:
                         user_command = selection
 
+                    service.record_accepted(prompt, user_command, ctx=ContextManager.get_ctx())
+
                     # Write executed command to shell history for easy reuse.
-                    if os.environ.get("SHAI_SKIP_HISTORY") != "true":
-                        # Determine active shell and write to history
-                        shell = os.environ.get("SHELL", "")
-                        history_file_path = None
-                        history_format = None
-                        if "zsh" in shell:
-                            history_file_path = os.path.expanduser("~/.zsh_history")
-                            history_format = ": {}:0;{}\n"
-                        elif "bash" in shell:
-                            history_file_path = os.path.expanduser("~/.bash_history")
-                            history_format = ": {}:0;{}\n"
-                        elif "csh" in shell or "tcsh" in shell:
-                            # csh and tcsh share the same history file
-                            history_file_path = os.path.expanduser("~/.history")
-                            history_format = "{} {}\n"
-                        elif "ksh" in shell:
-                            history_file_path = os.path.expanduser("~/.sh_history")
-                            history_format = ": {}:0;{}\n"
-                        elif "fish" in shell:
-                            history_file_path = os.path.expanduser("~/.local/share/fish/fish_history")
-                            history_format = "- cmd: {}\n  when: {}\n"
-
-                        if history_file_path:
-                            with open(history_file_path, "a") as history_file:
-                                timestamp = int(time.time())
-                                history_file.write(history_format.format(timestamp, user_command))
-                        else:
-                            print(f"{Colors.WARNING}Warning:{Colors.END} Unsupported shell. History will not be saved. Please set SHAI_SKIP_HISTORY to true to disable.")
+                    if SHAI_SKIP_HISTORY:
+                        pass
+                    elif history_writer is None:
+                        print(f"{Colors.WARNING}Warning:{Colors.END} Unsupported shell. History will not be saved. Please set SHAI_SKIP_HISTORY to true to disable.")
+                    else:
+                        try:
+                            history_writer.append(user_command)
+                        except OSError as e:
+                            print(f"{Colors.WARNING}Warning:{Colors.END} Could not write to {history_writer.path}: {e}")
 
                     # Default mode
                     if CTX == "False":
-                        subprocess.run(user_command, shell=True, check=True)
+                        with span("execute"):
+                            subprocess.run(user_command, shell=True, check=True)
                         break
                     # Context mode
                     elif user_command.startswith(TEXT_EDITORS):
@@ -332,18 +548,20 @@ def main():
                         path = os.path.expanduser('/'.join(user_command.split(" ")[1:]))
                         os.chdir(path)
                     else:
-                        result = subprocess.run(user_command, shell=True, check=True, capture_output=True).stdout.decode()
-                        if len(result) > 0:
-                            print(f"\n{result}")
-                        ContextManager.add_chunk(result)
+                        with span("execute", context=True) as attributes:
+                            result = run_command(user_command, max_retained_bytes=SHAI_CONTEXT_MAX_BYTES)
+                            attributes["exit_code"] = result.exit_code
+                        ContextManager.add_command(user_command, result.stdout, exit_code=result.exit_code, stderr=result.stderr)
+                        if result.exit_code:
+                            print(f"{Colors.WARNING}Command exited with status {result.exit_code}{Colors.END}")
+                    service.prewarm_connections()
                     prompt = input(f">>> {os.getcwd()}\nNew command: ") 
                 except Exception as e:
                     print(f"{Colors.WARNING}Error{Colors.END} executing command: {e}")
             except KeyboardInterrupt:
+                cancel_speculation()
                 print("Exiting...")
                 sys.exit(0)
-    else:
-        print("Describe what you want to do as a single sentence. `shai <sentence>`")
 
 
 if __name__ == "__main__":
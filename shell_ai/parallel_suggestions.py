@@ -1,28 +1,86 @@
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Callable, Any
+import queue
+import threading
+from typing import Iterator, Callable, Any, Optional
 
-def generate_suggestions_parallel(
+from shell_ai.config import debug_print
+
+
+def generate_suggestions_stream(
     generator_func: Callable,
     count: int,
     max_workers: int,
     *args: Any,
+    cancel_event: Optional[threading.Event] = None,
+    side: Optional[Callable] = None,
     **kwargs: Any
-) -> List[str]:
+) -> Iterator[str]:
     """
-    Generate multiple suggestions in parallel using a ThreadPoolExecutor.
-    
+    Generate multiple suggestions in parallel and yield each one as soon as it completes.
+
+    Requests run on daemon threads, so a request still in flight after the
+    stream is abandoned never delays the process from exiting. A failed
+    request is logged and skipped, the error is only raised once every
+    request has finished without one succeeding.
+
     Args:
         generator_func: The function that generates a single suggestion
         count: Number of suggestions to generate
         max_workers: Maximum number of parallel workers
+        cancel_event: Once set, requests that have not started yet are skipped
+            and the stream stops at the next completed request
+        side: A function run on its own thread alongside the requests, its
+            result is yielded as soon as it returns. It is not one of the
+            `count` requests, when it fails that is only logged
         *args, **kwargs: Arguments to pass to generator_func
-    
-    Returns:
-        List of generated suggestions
+
+    Yields:
+        Generated suggestions in completion order
     """
-    with ThreadPoolExecutor(max_workers=min(count, max_workers)) as executor:
-        futures = [
-            executor.submit(generator_func, *args, **kwargs)
-            for _ in range(count)
-        ]
-        return [future.result() for future in futures] 
\ No newline at end of file
+    results: "queue.Queue" = queue.Queue()
+    slots = threading.Semaphore(min(count, max_workers))
+    stopped = threading.Event()
+
+    def worker():
+        with slots:
+            if stopped.is_set() or (cancel_event is not None and cancel_event.is_set()):
+                results.put((None, None, False))
+                return
+            try:
+                results.put((generator_func(*args, **kwargs), None, False))
+            except Exception as e:
+                results.put((None, e, False))
+
+    def side_worker():
+        try:
+            results.put((side(), None, True))
+        except Exception as e:
+            results.put((None, e, True))
+
+    for _ in range(count):
+        threading.Thread(target=worker, daemon=True).start()
+    if side is not None:
+        threading.Thread(target=side_worker, daemon=True).start()
+    errors = []
+    succeeded = 0
+    try:
+        for _ in range(count + (side is not None)):
+            result, error, from_side = results.get()
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            if from_side:
+                if error is not None:
+                    debug_print(f"Side task failed: {error!r}")
+                else:
+                    yield result
+                continue
+            if error is not None:
+                debug_print(f"Suggestion request failed: {error!r}")
+                errors.append(error)
+                continue
+            succeeded += 1
+            yield result
+        if errors and not succeeded:
+            raise errors[-1]
+    finally:
+        # Requests that have not started yet are skipped, results still in flight are discarded
+        stopped.set()
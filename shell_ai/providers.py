@@ -0,0 +1,199 @@
+import importlib
+import os
+import time
+
+from shell_ai.telemetry import record_span
+
+# Wall time spent importing each module through `timed_import`, in seconds.
+IMPORT_TIMINGS = {}
+
+
+def timed_import(module_name):
+    """
+    Import a module on demand and record how long the first import took.
+    """
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if module_name not in IMPORT_TIMINGS:
+        IMPORT_TIMINGS[module_name] = time.perf_counter() - start
+        record_span("import", IMPORT_TIMINGS[module_name], module=module_name)
+    return module
+
+
+def _setting(config, key, default=None):
+    return os.environ.get(key, config.get(key, default))
+
+
+def _client_kwargs(http_clients, sync_key, async_key):
+    if http_clients is None:
+        return {}
+    return {sync_key: http_clients.sync, async_key: http_clients.async_}
+
+
+def _retry_kwargs(max_retries):
+    if max_retries is None:
+        return {}
+    return {"max_retries": max_retries}
+
+
+def _build_openai(config, temperature, http_clients=None, max_retries=None):
+    chat_models = timed_import("langchain_openai.chat_models")
+    return chat_models.ChatOpenAI(
+        model_name=_setting(config, "OPENAI_MODEL"),
+        openai_api_base=_setting(config, "OPENAI_API_BASE"),
+        openai_organization=_setting(config, "OPENAI_ORGANIZATION"),
+        # A shared client already carries the proxy, see `get_http_client_kwargs`
+        openai_proxy=None if http_clients else _setting(config, "OPENAI_PROXY"),
+        max_tokens=_setting(config, "OPENAI_MAX_TOKENS"),
+        temperature=temperature,
+        # Token usage of streamed responses, sent in their last chunk
+        stream_usage=True,
+        **_client_kwargs(http_clients, "http_client", "http_async_client"),
+        **_retry_kwargs(max_retries),
+    )
+
+
+def _build_azure(config, temperature, http_clients=None, max_retries=None):
+    chat_models = timed_import("langchain_openai.chat_models")
+    return chat_models.AzureChatOpenAI(
+        openai_api_base=_setting(config, "AZURE_API_BASE"),
+        openai_api_version=_setting(config, "OPENAI_API_VERSION", "2023-05-15"),
+        deployment_name=_setting(config, "AZURE_DEPLOYMENT_NAME"),
+        openai_api_key=_setting(config, "OPENAI_API_KEY"),
+        openai_api_type="azure",
+        temperature=temperature,
+        **_client_kwargs(http_clients, "http_client", "http_async_client"),
+        **_retry_kwargs(max_retries),
+    )
+
+
+def _build_groq(config, temperature, http_clients=None, max_retries=None):
+    langchain_groq = timed_import("langchain_groq")
+    return langchain_groq.ChatGroq(
+        model_name=_setting(config, "GROQ_MODEL"),
+        groq_api_key=_setting(config, "GROQ_API_KEY"),
+        temperature=temperature,
+        **_client_kwargs(http_clients, "http_client", "http_async_client"),
+        **_retry_kwargs(max_retries),
+    )
+
+
+def _build_ollama(config, temperature, http_clients=None, max_retries=None):
+    chat_models = timed_import("langchain_openai.chat_models")
+    return chat_models.ChatOpenAI(
+        model_name=_setting(config, "OLLAMA_MODEL", "phi3.5"),
+        openai_api_base=_setting(config, "OLLAMA_API_BASE", "http://localhost:11434/v1/"),
+        max_tokens=_setting(config, "OLLAMA_MAX_TOKENS", 1500),
+        temperature=temperature,
+        # Token usage of streamed responses, sent in their last chunk
+        stream_usage=True,
+        api_key="ollama",
+        **_client_kwargs(http_clients, "http_client", "http_async_client"),
+        **_retry_kwargs(max_retries),
+    )
+
+
+def _build_mistral(config, temperature, http_clients=None, max_retries=None):
+    langchain_mistralai = timed_import("langchain_mistralai")
+    return langchain_mistralai.ChatMistralAI(
+        model_name=_setting(config, "MISTRAL_MODEL"),
+        api_key=_setting(config, "MISTRAL_API_KEY"),
+        base_url=_setting(config, "MISTRAL_API_BASE", "https://api.mistral.ai/v1"),
+        temperature=temperature,
+        # These clients are created with the base URL and auth headers, see `get_http_client_kwargs`
+        **_client_kwargs(http_clients, "client", "async_client"),
+        **_retry_kwargs(max_retries),
+    )
+
+
+# Maps SHAI_API_PROVIDER values to a builder for that provider's chat client.
+PROVIDERS = {
+    "openai": _build_openai,
+    "azure": _build_azure,
+    "groq": _build_groq,
+    "ollama": _build_ollama,
+    "mistral": _build_mistral,
+}
+
+
+def build_chat(provider, config, temperature, http_clients=None, max_retries=None):
+    """
+    Build the chat client for `provider`, importing only the LangChain
+    integration that provider needs.
+
+    `http_clients` are shared HTTP clients from `create_http_clients`, when
+    omitted the integration creates its own. `max_retries` overrides how often
+    the integration retries a failed request itself.
+    """
+    return PROVIDERS[provider](config, temperature, http_clients=http_clients, max_retries=max_retries)
+
+
+# Default API endpoint of each provider, used to open connections ahead of time.
+BASE_URLS = {
+    "openai": ("OPENAI_API_BASE", "https://api.openai.com/v1"),
+    "azure": ("AZURE_API_BASE", None),
+    "groq": ("GROQ_API_BASE", "https://api.groq.com"),
+    "ollama": ("OLLAMA_API_BASE", "http://localhost:11434/v1/"),
+    "mistral": ("MISTRAL_API_BASE", "https://api.mistral.ai/v1"),
+}
+
+
+def get_base_url(provider, config):
+    """
+    Return the API endpoint requests for `provider` are sent to.
+    """
+    key, default = BASE_URLS[provider]
+    return _setting(config, key) or default
+
+
+def get_http_client_kwargs(provider, config):
+    """
+    Return the extra arguments the shared HTTP clients need for `provider`.
+
+    The Mistral integration sends requests with relative URLs through the
+    client it is given, and a shared client replaces the OpenAI proxy setting.
+    """
+    if provider == "mistral":
+        return {
+            "base_url": get_base_url(provider, config),
+            "headers": {
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "Authorization": f"Bearer {_setting(config, 'MISTRAL_API_KEY')}",
+            },
+            # Same as the integration's default request timeout
+            "timeout": 120,
+        }
+    if provider == "openai" and _setting(config, "OPENAI_PROXY"):
+        return {"proxy": _setting(config, "OPENAI_PROXY")}
+    return {}
+
+
+def get_messages():
+    """
+    Return the (SystemMessage, HumanMessage) classes, imported on first use.
+    """
+    messages = timed_import("langchain_core.messages")
+    return messages.SystemMessage, messages.HumanMessage
+
+
+# Providers whose API returns several completions for one request through `n`.
+SUPPORTS_N = {"openai", "azure"}
+
+
+# Config key holding the model (or deployment) name for each provider.
+MODEL_SETTINGS = {
+    "openai": ("OPENAI_MODEL", None),
+    "azure": ("AZURE_DEPLOYMENT_NAME", None),
+    "groq": ("GROQ_MODEL", None),
+    "ollama": ("OLLAMA_MODEL", "phi3.5"),
+    "mistral": ("MISTRAL_MODEL", None),
+}
+
+
+def get_model_name(provider, config):
+    """
+    Return the model name `provider` will be called with.
+    """
+    key, default = MODEL_SETTINGS[provider]
+    return _setting(config, key, default)
@@ -0,0 +1,227 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+
+from shell_ai.config import debug_print
+
+# Number of recent requests the statistics of a provider are computed over.
+STATS_WINDOW = 50
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 30
+
+
+class ProviderStats:
+    """
+    Rolling latency and error statistics of one provider, with a circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and the
+    provider is only used when no other one is available. Once `cooldown`
+    seconds have passed it gets requests again, and a single further failure
+    opens the circuit anew until a request succeeds.
+    """
+
+    def __init__(self, window=STATS_WINDOW, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.open_until = 0
+
+    def record_failure(self):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + self.cooldown
+
+    def percentile(self, fraction):
+        """
+        Return the latency below which `fraction` of recent successful requests finished, or None.
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def is_open(self, now=None):
+        return (now or time.monotonic()) < self.open_until
+
+    def expected_latency(self):
+        """
+        Estimate the time to a successful answer, counting failed requests as retries.
+
+        Providers without any history are estimated at 0 so they get tried.
+        """
+        p50 = self.percentile(0.5) or 0.0
+        return p50 / max(1 - self.error_rate(), 0.1)
+
+
+class ProviderRouter:
+    """
+    Send requests to the fastest healthy providers and fail over to the others.
+
+    Every request is raced on the `race` best ranked providers, the first
+    non-empty result wins and the other attempts are cancelled. When an
+    attempt fails or returns nothing the next provider in the ranking is
+    tried, until one succeeds or all of them failed.
+
+    Attempts are plain callables taking a provider name, so any backend, or a
+    fake one injecting delays and errors, can be routed.
+    """
+
+    def __init__(self, providers, race=1, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.providers = list(providers)
+        self.race = max(1, race)
+        self.stats = {
+            provider: ProviderStats(failure_threshold=failure_threshold, cooldown=cooldown)
+            for provider in self.providers
+        }
+        # Attempts finish on the event loop and on worker threads
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        """
+        Return the providers best first: closed circuits, then lowest expected latency, then configured order.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return sorted(
+                self.providers,
+                key=lambda provider: (self.stats[provider].is_open(now), self.stats[provider].expected_latency()),
+            )
+
+    def summary(self):
+        """
+        Return the p50 and p95 latency, error rate and circuit state of every provider.
+        """
+        with self._lock:
+            return {
+                provider: {
+                    "p50": stats.percentile(0.5),
+                    "p95": stats.percentile(0.95),
+                    "error_rate": stats.error_rate(),
+                    "open": stats.is_open(),
+                }
+                for provider, stats in self.stats.items()
+            }
+
+    def _record(self, provider, started, result):
+        with self._lock:
+            if result:
+                self.stats[provider].record_success(time.monotonic() - started)
+            else:
+                self.stats[provider].record_failure()
+
+    async def _attempt_async(self, attempt, provider):
+        started = time.monotonic()
+        try:
+            result = await attempt(provider)
+        except asyncio.CancelledError:
+            # Lost the race or the caller gave up, says nothing about the provider
+            raise
+        except Exception as e:
+            debug_print(f"{provider} failed: {e!r}")
+            self._record(provider, started, None)
+            raise
+        self._record(provider, started, result)
+        return result
+
+    async def arun(self, attempt):
+        """
+        Await `attempt(provider)` on the best providers and return the first non-empty result.
+
+        Raises the last error when every provider failed with one.
+        """
+        ranking = self.ranked()
+        debug_print(f"Provider ranking: {ranking}")
+        remaining = iter(ranking)
+        pending = set()
+        last_error = None
+
+        def launch():
+            provider = next(remaining, None)
+            if provider is not None:
+                pending.add(asyncio.ensure_future(self._attempt_async(attempt, provider)))
+
+        for _ in range(self.race):
+            launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        last_error = e
+                        result = None
+                    if result:
+                        return result
+                    # Fail over to the next provider in the ranking
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        if last_error is not None:
+            raise last_error
+        return []
+
+    def run(self, attempt):
+        """
+        Call `attempt(provider)` on the best providers from worker threads and return the first non-empty result.
+
+        Attempts that lose the race keep running in the background, only
+        their statistics are recorded. Raises the last error when every
+        provider failed with one.
+        """
+        ranking = self.ranked()
+        debug_print(f"Provider ranking: {ranking}")
+        remaining = iter(ranking)
+        results = queue.Queue()
+        running = 0
+        last_error = None
+
+        def worker(provider):
+            started = time.monotonic()
+            try:
+                result = attempt(provider)
+            except Exception as e:
+                debug_print(f"{provider} failed: {e!r}")
+                self._record(provider, started, None)
+                results.put((None, e))
+                return
+            self._record(provider, started, result)
+            results.put((result, None))
+
+        def launch():
+            provider = next(remaining, None)
+            if provider is None:
+                return 0
+            threading.Thread(target=worker, args=(provider,), daemon=True).start()
+            return 1
+
+        for _ in range(self.race):
+            running += launch()
+        while running:
+            result, error = results.get()
+            running -= 1
+            if result:
+                return result
+            last_error = error or last_error
+            running += launch()
+        if last_error is not None:
+            raise last_error
+        return []
@@ -0,0 +1,322 @@
+import asyncio
+import random
+import re
+import threading
+import time
+
+from shell_ai.config import debug_print
+
+# Providers state their limits per minute.
+WINDOW = 60.0
+DEFAULT_RETRIES = 3
+# First and longest pause after a failed request without a Retry-After, in seconds.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# Rate limit errors within this many seconds of the last decrease of the
+# concurrency limit are answers to requests sent before it and don't lower it again.
+DECREASE_INTERVAL = 1.0
+# How often a request waiting for a free concurrency slot checks again, in seconds.
+SLOT_POLL_INTERVAL = 0.02
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_duration(value):
+    """
+    Return the seconds in a rate limit header value such as `1.5`, `20ms`, `6m0s` or `2m59.56s`, or None.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_rate_limited(error):
+    """
+    Return whether `error` is an HTTP 429 from a provider, as raised by the OpenAI, Groq or Mistral clients.
+    """
+    return _status_code(error) == 429
+
+
+def is_transient(error):
+    """
+    Return whether retrying the request that raised `error` may succeed: rate
+    limits, timeouts, conflicts, server errors and failed connections.
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    name = type(error).__name__
+    return "Connection" in name or "Timeout" in name
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        milliseconds = parse_duration(headers["retry-after-ms"])
+        return milliseconds / 1000 if milliseconds is not None else None
+    return parse_duration(headers.get("retry-after"))
+
+
+class TokenBucket:
+    """
+    Allow `per_minute` units a minute, refilled continuously, in bursts of at most that many.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / WINDOW)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """
+        Return the seconds until `amount` units are available.
+        """
+        self._refill(now)
+        # A request larger than the whole budget runs once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * WINDOW / self.capacity
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+
+    def observe(self, limit, remaining, now):
+        """
+        Adopt the limit and remaining budget the provider reported, which also
+        counts requests made by other clients sharing the API key.
+        """
+        self._refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+
+class _ProviderState:
+    def __init__(self, max_concurrency, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.rate_limited = 0
+        self.consecutive_rate_limits = 0
+
+
+class RequestScheduler:
+    """
+    Pace the requests to every provider so bursts stay within its rate limits.
+
+    Each provider gets token buckets for its requests and tokens per minute,
+    from `limits` (`{provider: (requests_per_minute, tokens_per_minute)}`,
+    either may be None) or learned from the `x-ratelimit-*` headers of its
+    responses, see `observe_headers`. The number of requests in flight is
+    adjusted AIMD style: it grows by one per round of successful requests and
+    halves on a rate limit error. A rate limited request pauses every request
+    to that provider for the Retry-After the provider sent, or a jittered,
+    doubling backoff, and is retried up to `retries` times like other
+    transient errors.
+
+    One scheduler is meant to be shared by every request of the process, and
+    so by every client of the daemon.
+    """
+
+    def __init__(self, max_concurrency=8, limits=None, retries=DEFAULT_RETRIES):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limits = limits or {}
+        self.retries = retries
+        self._states = {}
+        # Requests run on the event loop and on worker threads
+        self._lock = threading.Lock()
+
+    def _state(self, provider):
+        if provider not in self._states:
+            requests_per_minute, tokens_per_minute = self.limits.get(provider, (None, None))
+            self._states[provider] = _ProviderState(self.max_concurrency, requests_per_minute, tokens_per_minute)
+        return self._states[provider]
+
+    def summary(self):
+        """
+        Return the concurrency limit, requests in flight and rate limit errors of every provider.
+        """
+        with self._lock:
+            return {
+                provider: {
+                    "concurrency": state.concurrency,
+                    "in_flight": state.in_flight,
+                    "rate_limited": state.rate_limited,
+                    "tokens": state.tokens.capacity if state.tokens else None,
+                }
+                for provider, state in self._states.items()
+            }
+
+    def observe_headers(self, provider, headers):
+        """
+        Update the budgets of `provider` from the rate limit headers of one of its responses.
+
+        Groq reports its request limit per day, so a request budget is only
+        taken from the headers once it is exhausted, token limits are per
+        minute at every provider.
+        """
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        limit_tokens = headers.get("x-ratelimit-limit-tokens")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is None and remaining_tokens is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(provider)
+            try:
+                if remaining_requests is not None:
+                    if state.requests:
+                        state.requests.observe(None, int(remaining_requests), now)
+                    if int(remaining_requests) <= 0:
+                        reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                        state.blocked_until = max(state.blocked_until, now + (reset or BACKOFF_BASE))
+                if limit_tokens is not None or remaining_tokens is not None:
+                    if state.tokens is None and limit_tokens is not None:
+                        state.tokens = TokenBucket(int(limit_tokens))
+                    if state.tokens is not None:
+                        state.tokens.observe(
+                            int(limit_tokens) if limit_tokens is not None else None,
+                            int(remaining_tokens) if remaining_tokens is not None else None,
+                            now,
+                        )
+            except ValueError:
+                debug_print(f"Ignoring malformed rate limit headers from {provider}")
+
+    def _try_acquire(self, provider, tokens):
+        """
+        Start a request and return 0, or return the seconds to wait before trying again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(provider)
+            delay = state.blocked_until - now
+            if delay <= 0 and state.in_flight >= int(state.concurrency):
+                delay = SLOT_POLL_INTERVAL
+            if delay <= 0 and state.requests:
+                delay = state.requests.delay(1, now)
+            if delay <= 0 and state.tokens:
+                delay = state.tokens.delay(tokens, now)
+            if delay > 0:
+                return delay
+            state.in_flight += 1
+            if state.requests:
+                state.requests.take(1, now)
+            if state.tokens:
+                state.tokens.take(tokens, now)
+            return 0.0
+
+    def _abandon(self, provider):
+        with self._lock:
+            self._state(provider).in_flight -= 1
+
+    def _release(self, provider, error=None):
+        """
+        Finish a request and return whether it failed with an error worth retrying.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(provider)
+            state.in_flight -= 1
+            if error is None:
+                state.consecutive_rate_limits = 0
+                # Additive increase, by one once every slot completed a request
+                state.concurrency = min(state.max_concurrency, state.concurrency + 1 / state.concurrency)
+                return False
+            if not is_rate_limited(error):
+                return is_transient(error)
+            state.rate_limited += 1
+            state.consecutive_rate_limits += 1
+            if now - state.last_decrease > DECREASE_INTERVAL:
+                state.concurrency = max(1.0, state.concurrency / 2)
+                state.last_decrease = now
+                debug_print(f"{provider} rate limited, lowering concurrency to {int(state.concurrency)}")
+            retry_after = _retry_after(error)
+            if retry_after is None:
+                retry_after = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (state.consecutive_rate_limits - 1))
+            # Jitter keeps the paused requests from all retrying at the same moment
+            state.blocked_until = max(state.blocked_until, now + retry_after * random.uniform(1.0, 1.5))
+            return True
+
+    def _backoff(self, error, attempt):
+        # Rate limited requests wait for the provider to unblock, see `_try_acquire`
+        if is_rate_limited(error):
+            return 0.0
+        return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def run(self, provider, call, tokens=1, retries=None):
+        """
+        Call `call()` once `provider` has budget for a request of `tokens` tokens and return its result.
+
+        Transient errors are retried up to `retries` times, by default the
+        scheduler's, the last error is raised.
+        """
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            delay = self._try_acquire(provider, tokens)
+            while delay:
+                time.sleep(delay)
+                delay = self._try_acquire(provider, tokens)
+            try:
+                result = call()
+            except Exception as e:
+                if not self._release(provider, e) or attempt == retries:
+                    raise
+                debug_print(f"{provider} request failed with {e!r}, retrying")
+                time.sleep(self._backoff(e, attempt))
+                continue
+            except BaseException:
+                self._abandon(provider)
+                raise
+            self._release(provider)
+            return result
+
+    async def arun(self, provider, call, tokens=1, retries=None):
+        """
+        Like `run`, awaiting `call()`. Cancelling it while it waits takes no budget.
+        """
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            delay = self._try_acquire(provider, tokens)
+            while delay:
+                await asyncio.sleep(delay)
+                delay = self._try_acquire(provider, tokens)
+            try:
+                result = await call()
+            except Exception as e:
+                if not self._release(provider, e) or attempt == retries:
+                    raise
+                debug_print(f"{provider} request failed with {e!r}, retrying")
+                await asyncio.sleep(self._backoff(e, attempt))
+                continue
+            except BaseException:
+                # Cancelled, says nothing about the provider
+                self._abandon(provider)
+                raise
+            self._release(provider)
+            return result
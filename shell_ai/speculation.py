@@ -0,0 +1,79 @@
+import threading
+
+from shell_ai.config import debug_print
+
+# How often a caller waiting for the next speculative suggestion checks whether it was cancelled, in seconds.
+CANCEL_POLL_INTERVAL = 0.05
+
+
+class Speculation:
+    """
+    Generate the next round of suggestions for a prompt in the background.
+
+    Started while the menu shows the current round, with its commands in
+    `exclude`, so choosing "Generate new suggestions" shows suggestions that
+    are already there, or still arriving, instead of starting a new round.
+    The round is a speculative one of `service`, see
+    `SuggestionService.iter_suggestions`, so it is paid for from the
+    speculation budget. `cancel` stops the requests still in flight.
+    """
+
+    def __init__(self, service, prompt, exclude, ctx=""):
+        self.prompt = prompt
+        self.ctx = ctx
+        self.commands = []
+        self.done = False
+        self._cancel_event = threading.Event()
+        self._condition = threading.Condition()
+        # A daemon thread, so speculation never delays exiting
+        threading.Thread(target=self._run, args=(service, list(exclude)), daemon=True).start()
+
+    def _run(self, service, exclude):
+        try:
+            for command in service.iter_suggestions(
+                self.prompt,
+                use_cache=False,
+                cancel_event=self._cancel_event,
+                ctx=self.ctx,
+                exclude=exclude,
+                speculative=True,
+            ):
+                with self._condition:
+                    self.commands.append(command)
+                    self._condition.notify_all()
+        except Exception as e:
+            debug_print(f"Generating speculative suggestions failed: {e}")
+        finally:
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+
+    def matches(self, prompt, ctx=""):
+        """
+        Return whether this speculation is the next round of `prompt` with `ctx`.
+        """
+        return self.prompt == prompt and self.ctx == ctx and not self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def iter_suggestions(self, cancel_event=None):
+        """
+        Yield the commands generated so far, then the rest as they arrive.
+
+        Stops early once this speculation or `cancel_event` is cancelled.
+        """
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.commands) and not self.done and not self._cancel_event.is_set():
+                    if cancel_event is not None and cancel_event.is_set():
+                        return
+                    self._condition.wait(CANCEL_POLL_INTERVAL)
+                if index >= len(self.commands):
+                    return
+                command = self.commands[index]
+            index += 1
+            yield command
@@ -0,0 +1,25 @@
+# Where a suggestion came from.
+MODEL = "model"
+INDEX = "index"
+CACHE = "cache"
+
+
+class Suggestion(str):
+    """
+    A suggested command that also records its `source`, `MODEL`, `INDEX` or `CACHE`.
+
+    It is a `str`, so callers that don't care where a command came from use it
+    like any other.
+    """
+
+    def __new__(cls, command, source=MODEL):
+        suggestion = super().__new__(cls, command)
+        suggestion.source = source
+        return suggestion
+
+
+def source_of(command):
+    """
+    Return where `command` came from, plain strings are the model's.
+    """
+    return getattr(command, "source", MODEL)
@@ -0,0 +1,482 @@
+import json
+import threading
+import time
+
+from shell_ai.async_engine import AsyncSuggestionEngine
+from shell_ai.cache import TokenBudget, make_cache_key
+from shell_ai.code_parser import CommandStreamParser, parse_commands
+from shell_ai.config import debug_print
+from shell_ai.http_pool import create_http_clients, prewarm
+from shell_ai.parallel_suggestions import generate_suggestions_stream
+from shell_ai.providers import (
+    SUPPORTS_N,
+    build_chat,
+    get_base_url,
+    get_http_client_kwargs,
+    get_messages,
+    get_model_name,
+)
+from shell_ai.router import DEFAULT_COOLDOWN, DEFAULT_FAILURE_THRESHOLD, ProviderRouter
+from shell_ai.suggestion_source import CACHE, INDEX, MODEL, Suggestion, source_of
+from shell_ai.system_context import get_platform_string
+from shell_ai.telemetry import record_span, span, token_usage
+
+# Rough number of tokens a model answers a single suggestion with.
+COMPLETION_TOKENS = 64
+# How much higher the temperature of speculative rounds is, so they differ from the round shown.
+SPECULATION_TEMPERATURE_STEP = 0.2
+# The speculation budget is per hour, shared by every process.
+SPECULATION_WINDOW = 3600.0
+
+
+def _finish_stream(parser, attributes, usage, content_chunks, parse_seconds):
+    debug_print(f"Streamed response: {parser.text()}")
+    attributes["streamed_chars"] = len(parser.text())
+    if usage:
+        attributes["prompt_tokens"], attributes["completion_tokens"] = usage.get("input_tokens"), usage.get("output_tokens")
+    else:
+        # The usage is only sent at the end of a stream, which an early exit
+        # never reads, and streams carry about one token per chunk
+        attributes["completion_tokens"] = content_chunks
+        attributes["usage_estimated"] = True
+    start = time.perf_counter()
+    commands = parser.close()
+    record_span("parse", parse_seconds + time.perf_counter() - start, provider=attributes.get("provider"), commands=len(commands))
+    return commands
+
+
+def _stream_commands(chat, messages, single, attributes, **kwargs):
+    """
+    Read a streamed response until its commands are complete, then close the stream.
+    """
+    parser = CommandStreamParser(single=single)
+    usage = None
+    content_chunks = 0
+    parse_seconds = 0.0
+    chunks = chat.stream(messages, **kwargs)
+    try:
+        for chunk in chunks:
+            usage = chunk.usage_metadata or usage
+            if not chunk.content:
+                continue
+            content_chunks += 1
+            start = time.perf_counter()
+            complete = parser.feed(chunk.content)
+            parse_seconds += time.perf_counter() - start
+            if complete:
+                # Closing the stream ends the request, the rest is never generated
+                attributes["early_exit"] = True
+                break
+    finally:
+        chunks.close()
+    return _finish_stream(parser, attributes, usage, content_chunks, parse_seconds)
+
+
+async def _astream_commands(chat, messages, single, attributes, **kwargs):
+    """
+    Like `_stream_commands`, for the asyncio engine.
+    """
+    parser = CommandStreamParser(single=single)
+    usage = None
+    content_chunks = 0
+    parse_seconds = 0.0
+    chunks = chat.astream(messages, **kwargs)
+    try:
+        async for chunk in chunks:
+            usage = chunk.usage_metadata or usage
+            if not chunk.content:
+                continue
+            content_chunks += 1
+            start = time.perf_counter()
+            complete = parser.feed(chunk.content)
+            parse_seconds += time.perf_counter() - start
+            if complete:
+                attributes["early_exit"] = True
+                break
+    finally:
+        await chunks.aclose()
+    return _finish_stream(parser, attributes, usage, content_chunks, parse_seconds)
+
+
+class SuggestionService:
+    """
+    Generate suggested commands for prompts.
+
+    The chat clients, HTTP connection pools, event loop and cache are created
+    on first use and kept for the lifetime of the service, so every later
+    prompt reuses them. With `fallback_providers`, requests are routed between
+    `provider` and those by a `ProviderRouter`. With `stream`, responses are
+    streamed and closed as soon as the commands in them are complete.
+    `system_context`, a `SystemContext`, describes the system in the prompt,
+    by default only the platform is described. With a `RequestScheduler`
+    every request is paced to the provider's rate limits and retried by it.
+    Speculative rounds, generated before the user asks for them, may spend
+    an estimated `speculation_tokens` tokens an hour between all processes,
+    None doesn't limit them.
+    """
+
+    def __init__(
+        self,
+        provider,
+        config,
+        temperature,
+        suggestion_count,
+        strategy="parallel",
+        engine="asyncio",
+        max_concurrency=8,
+        request_timeout=None,
+        hedge_after=None,
+        http_pool=True,
+        http_keepalive=120,
+        prewarm=True,
+        cache=None,
+        index=None,
+        fallback_providers=(),
+        race=1,
+        circuit_failures=DEFAULT_FAILURE_THRESHOLD,
+        circuit_cooldown=DEFAULT_COOLDOWN,
+        stream=True,
+        system_context=None,
+        scheduler=None,
+        speculation_tokens=None,
+    ):
+        self.provider = provider
+        self.providers = [provider] + [fallback for fallback in fallback_providers if fallback != provider]
+        self.config = config
+        self.temperature = temperature
+        self.suggestion_count = suggestion_count
+        self.strategy = strategy
+        self.engine_name = engine
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.hedge_after = hedge_after
+        self.http_pool = http_pool
+        self.http_keepalive = http_keepalive
+        self.prewarm = prewarm
+        self.cache = cache
+        self.index = index
+        self.stream = stream
+        self.scheduler = scheduler
+        self.platform_string = system_context.get() if system_context is not None else get_platform_string()
+        self._system_messages = {}
+        self._speculation_budget = TokenBudget("speculation", speculation_tokens, SPECULATION_WINDOW) if speculation_tokens is not None else None
+        self.router = ProviderRouter(
+            self.providers,
+            race=race,
+            failure_threshold=circuit_failures,
+            cooldown=circuit_cooldown,
+        )
+        self._chats = {}
+        self._http_clients = {}
+        self._engine = None
+        self._lock = threading.Lock()
+
+    def get_chat(self, provider=None):
+        """
+        Return the chat client of `provider`, by default the primary one,
+        building it and its connection pool on first use.
+        """
+        provider = provider or self.provider
+        with self._lock:
+            if provider not in self._chats:
+                if self.http_pool:
+                    # One keep-alive pool sized for the fan-out, shared by every round
+                    self._http_clients[provider] = create_http_clients(
+                        pool_size=self.max_concurrency,
+                        keepalive_expiry=self.http_keepalive,
+                        on_response=self._response_observer(provider),
+                        **get_http_client_kwargs(provider, self.config),
+                    )
+                # Initialize chat provider based on configuration, importing only its backend
+                with span("build_client", provider=provider, model=get_model_name(provider, self.config)):
+                    self._chats[provider] = build_chat(
+                        provider,
+                        self.config,
+                        self.temperature,
+                        http_clients=self._http_clients.get(provider),
+                        # Failing over beats retrying the same provider with backoff,
+                        # and the scheduler retries with the provider's limits in mind
+                        max_retries=0 if len(self.providers) > 1 or self.scheduler is not None else None,
+                    )
+            return self._chats[provider]
+
+    def _response_observer(self, provider):
+        if self.scheduler is None:
+            return None
+        return lambda response: self.scheduler.observe_headers(provider, response.headers)
+
+    def get_engine(self):
+        """
+        Return the asyncio engine, one event loop is shared by every suggestion round.
+        """
+        with self._lock:
+            if self._engine is None:
+                self._engine = AsyncSuggestionEngine(
+                    max_concurrency=self.max_concurrency,
+                    request_timeout=self.request_timeout,
+                    hedge_after=self.hedge_after,
+                )
+            return self._engine
+
+    def prewarm_connections(self):
+        """
+        Open connections to the provider in the background, e.g. while the user types.
+        """
+        if not (self.http_pool and self.prewarm):
+            return
+
+        def warm():
+            connections = self.suggestion_count if self.strategy == "parallel" else 1
+            for provider in self.providers:
+                self.get_chat(provider)
+                prewarm(
+                    self._http_clients[provider],
+                    get_base_url(provider, self.config),
+                    connections=min(connections, self.max_concurrency),
+                    engine=self.get_engine() if self.engine_name == "asyncio" else None,
+                )
+
+        # Building the client may import the provider, so don't hold up the caller
+        threading.Thread(target=warm, daemon=True).start()
+
+    def cache_key(self, prompt, ctx=""):
+        # Suggestions that depend on the previous command's output are never cached
+        if self.cache is None or ctx:
+            return None
+        models = ",".join(str(get_model_name(provider, self.config)) for provider in self.providers)
+        return make_cache_key(prompt, self.platform_string, ",".join(self.providers), models, self.temperature)
+
+    def record_accepted(self, prompt, command, ctx=""):
+        """
+        Remember the command the user picked for `prompt`.
+        """
+        cache_key = self.cache_key(prompt, ctx)
+        if cache_key:
+            self.cache.record_accepted(cache_key, command)
+        # Like the cache, the index only holds prompts that stand on their own
+        if self.index is not None and not ctx:
+            self.index.add(prompt, command)
+
+    def system_message(self, strategy):
+        """
+        Return the system prompt of `strategy`, built once so it is byte-identical for every prompt.
+        """
+        if strategy not in self._system_messages:
+            if strategy == "parallel":
+                self._system_messages[strategy] = """You are an expert at using shell commands. I need you to provide a response in the format `{"command": "your_shell_command_here"}`. """ + self.platform_string + """ Only provide a single executable line of shell code as the value for the "command" key. Never output any text outside the JSON structure. The command will be directly executed in a shell. For example, if I ask to display the message abc, you should respond with ```json\n{"command": "echo abc"}\n```. Make sure the output is valid JSON."""
+            else:
+                self._system_messages[strategy] = """You are an expert at using shell commands. I need you to provide a response in the format `{"commands": ["first_shell_command", "second_shell_command"]}`. """ + self.platform_string + """ Only provide single executable lines of shell code as the entries of the "commands" list, and make every entry a different way to satisfy the request. Never output any text outside the JSON structure. The commands will be directly executed in a shell. For example, if I ask for two ways to display the message abc, you should respond with ```json\n{"commands": ["echo abc", "printf 'abc'"]}\n```. Make sure the output is valid JSON."""
+        return self._system_messages[strategy]
+
+    def _take_speculation_budget(self, tokens):
+        return self._speculation_budget is None or self._speculation_budget.take(tokens)
+
+    def get_suggestions(self, prompt, use_cache=True, ctx="", exclude=()):
+        return list(self.iter_suggestions(prompt, use_cache=use_cache, ctx=ctx, exclude=exclude))
+
+    def iter_suggestions(self, prompt, use_cache=True, cancel_event=None, ctx="", exclude=(), speculative=False):
+        """
+        Yield unique suggested commands for `prompt` as soon as each one is available.
+
+        `ctx` is output of previous commands the model may use as context.
+        Commands in `exclude`, e.g. the ones already shown, are asked to be
+        avoided and are never yielded. A `speculative` round prepares
+        suggestions the user may ask for next: it is generated at a slightly
+        higher temperature, bypasses the cache and yields nothing once the
+        speculation budget is spent.
+        """
+        start = time.perf_counter()
+        attributes = {"provider": ",".join(self.providers), "strategy": self.strategy, "count": 0}
+        if speculative:
+            attributes["speculative"] = True
+        suggestions = self._iter_suggestions(prompt, use_cache and not speculative, cancel_event, ctx, exclude, speculative)
+        try:
+            for command in suggestions:
+                if not attributes["count"]:
+                    attributes["first_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                attributes["count"] += 1
+                yield command
+        finally:
+            suggestions.close()
+            record_span("suggestions", time.perf_counter() - start, **attributes)
+
+    def _iter_suggestions(self, prompt, use_cache, cancel_event, ctx, exclude, speculative):
+        # Speculative rounds are generated differently, so they are never cached
+        cache_key = self.cache_key(prompt, ctx) if not speculative else None
+        if cache_key and use_cache:
+            cached = self.cache.get(cache_key)
+            if cached:
+                debug_print(f"Using {len(cached)} cached suggestions")
+                yield from (Suggestion(command, CACHE) for command in cached if command not in exclude)
+                return
+
+        commands = []
+
+        def lookup_index():
+            # Runs while the model answers, so it never delays the requests
+            return [Suggestion(command, INDEX) for command in self.index.search(prompt, limit=self.suggestion_count)]
+
+        SystemMessage, HumanMessage = get_messages()
+        chats = {provider: self.get_chat(provider) for provider in self.providers}
+        strategy = self.strategy
+        if strategy == "n" and not SUPPORTS_N.intersection(self.providers):
+            debug_print(f"{', '.join(self.providers)} do not support n, using the batch strategy instead")
+            strategy = "batch"
+
+        def build_messages(prompt_strategy):
+            base_system_message = self.system_message(prompt_strategy)
+            if prompt_strategy == "parallel":
+                request = f"Generate a shell command that satisfies this user request: {prompt}"
+            else:
+                request = f"Generate {self.suggestion_count} different shell commands that satisfy this user request: {prompt}"
+            if exclude:
+                request += " Do not suggest any of these commands: " + json.dumps(list(exclude))
+
+            if ctx:
+                # Appended last, so the rest of the prompt stays a stable prefix
+                base_system_message += """ Between [], these are the most recent commands, each after a `$`, with their output (repeated lines are summarized), you can use them as context: [""" + ctx + """]"""
+
+            return [
+                SystemMessage(content=base_system_message),
+                HumanMessage(content=request),
+            ]
+
+        # With the `n` strategy every one of the n candidates is a single command
+        messages = build_messages("parallel" if strategy == "n" else strategy)
+        # Providers without `n` answer the batch prompt instead
+        batch_messages = build_messages("batch") if strategy == "n" and not SUPPORTS_N.issuperset(self.providers) else None
+
+        def messages_for(provider):
+            return batch_messages if batch_messages is not None and provider not in SUPPORTS_N else messages
+
+        # Speculative rounds differ from the round shown by their temperature
+        temperature_kwargs = {"temperature": min(1.0, self.temperature + SPECULATION_TEMPERATURE_STEP)} if speculative else {}
+
+        def generate_kwargs(provider):
+            # With the `n` strategy the provider returns every candidate in one response
+            kwargs = {"n": self.suggestion_count} if strategy == "n" and provider in SUPPORTS_N else {}
+            return {**kwargs, **temperature_kwargs}
+
+        def parse_response(provider, response):
+            with span("parse", provider=provider) as attributes:
+                commands = []
+                for generation in response.generations[0]:
+                    debug_print(f"Response: {generation.message.content}")
+                    commands.extend(parse_commands(generation.message.content))
+                attributes["commands"] = len(commands)
+            return commands
+
+        def generate_span(provider):
+            return span("generate", provider=provider, model=get_model_name(provider, self.config), strategy=strategy)
+
+        # Every candidate of the `n` strategy arrives interleaved in one stream, so it is not streamed
+        stream = self.stream and strategy != "n"
+        single = strategy == "parallel"
+        # Rough size of a request for the scheduler's token budgets
+        request_tokens = sum(len(message.content) for message in messages) // 4 + COMPLETION_TOKENS * (1 if single else self.suggestion_count)
+        # With several providers the router fails over instead of retrying
+        retries = 0 if len(self.providers) > 1 else None
+
+        def generate_single_suggestion():
+            debug_print(f"Messages: {messages_for(self.provider)}")
+
+            def send(provider):
+                if stream:
+                    with generate_span(provider) as attributes:
+                        streamed = _stream_commands(chats[provider], messages_for(provider), single, attributes, **temperature_kwargs)
+                        attributes["commands"] = len(streamed)
+                    return streamed
+                with generate_span(provider) as attributes:
+                    response = chats[provider].generate(
+                        messages=[messages_for(provider)], **generate_kwargs(provider)
+                    )
+                    attributes["prompt_tokens"], attributes["completion_tokens"] = token_usage(response)
+                return parse_response(provider, response)
+
+            def attempt(provider):
+                if self.scheduler is None:
+                    return send(provider)
+                return self.scheduler.run(provider, lambda: send(provider), tokens=request_tokens, retries=retries)
+
+            return self.router.run(attempt)
+
+        async def agenerate_single_suggestion():
+            debug_print(f"Messages: {messages_for(self.provider)}")
+
+            async def send(provider):
+                if stream:
+                    with generate_span(provider) as attributes:
+                        streamed = await _astream_commands(chats[provider], messages_for(provider), single, attributes, **temperature_kwargs)
+                        attributes["commands"] = len(streamed)
+                    return streamed
+                with generate_span(provider) as attributes:
+                    response = await chats[provider].agenerate(
+                        messages=[messages_for(provider)], **generate_kwargs(provider)
+                    )
+                    attributes["prompt_tokens"], attributes["completion_tokens"] = token_usage(response)
+                return parse_response(provider, response)
+
+            async def attempt(provider):
+                if self.scheduler is None:
+                    return await send(provider)
+                return await self.scheduler.arun(provider, lambda: send(provider), tokens=request_tokens, retries=retries)
+
+            return await self.router.arun(attempt)
+
+        # The batched strategies ask for every candidate in a single request
+        request_count = self.suggestion_count if strategy == "parallel" else 1
+        if speculative and not self._take_speculation_budget(request_tokens * request_count):
+            debug_print("The speculation budget is spent, not generating suggestions ahead of time")
+            return
+
+        side = lookup_index if self.index is not None and use_cache and not ctx else None
+        if self.engine_name == "asyncio":
+            suggestions = self.get_engine().stream(
+                agenerate_single_suggestion,
+                count=request_count,
+                cancel_event=cancel_event,
+                side=side,
+            )
+        else:
+            suggestions = generate_suggestions_stream(
+                generate_single_suggestion,
+                count=request_count,
+                max_workers=self.max_concurrency,
+                cancel_event=cancel_event,
+                side=side,
+            )
+
+        error = None
+        generated = 0
+        try:
+            for batch in suggestions:
+                # Skip timed out requests and deduplicate, a batch may hold more
+                # than asked for. Commands accepted for similar prompts are
+                # shown as soon as they are found, they don't count towards the
+                # model's suggestions
+                for command in batch or []:
+                    from_model = source_of(command) == MODEL
+                    if from_model and generated >= self.suggestion_count:
+                        continue
+                    if command not in commands and command not in exclude:
+                        commands.append(command)
+                        generated += from_model
+                        yield command
+                if generated >= self.suggestion_count:
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            # Cancels the requests still in flight once enough suggestions arrived
+            suggestions.close()
+
+        if error is not None:
+            if not commands:
+                raise error
+            debug_print(f"Generating suggestions failed, showing the accepted ones only: {error}")
+            return
+
+        # Only cache complete rounds, not ones the user cut short, nor ones
+        # that left out the commands already shown
+        if cache_key and not exclude and not (cancel_event and cancel_event.is_set()):
+            self.cache.put(cache_key, commands)
@@ -0,0 +1,128 @@
+import json
+import os
+import platform
+import shutil
+
+from shell_ai.config import debug_print, get_config_dir
+
+# Bump when the format of the cached context changes.
+CONTEXT_VERSION = 1
+
+# Files describing the distribution, see `platform.freedesktop_os_release`.
+OS_RELEASE_PATHS = ("/etc/os-release", "/usr/lib/os-release")
+
+# Tools whose absence commonly leads to unusable suggestions, mostly modern
+# alternatives and ones that aren't installed by default.
+OPTIONAL_TOOLS = (
+    "ag", "aria2c", "bat", "brew", "curl", "docker", "dnf", "apt", "eza", "fd",
+    "fdfind", "ffmpeg", "fzf", "gawk", "git", "gsed", "htop", "http", "jq",
+    "kubectl", "lsof", "ncdu", "nmap", "pacman", "parallel", "podman", "pv",
+    "python3", "rg", "rsync", "sqlite3", "systemctl", "tldr", "tmux", "tree",
+    "unzip", "wget", "xclip", "xsel", "yq", "zip", "zypper",
+)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def get_platform_string():
+    """
+    Describe the system the suggested commands will be executed on.
+    """
+    if platform.system() == "Linux":
+        try:
+            info = platform.freedesktop_os_release()
+        except OSError:
+            info = {}
+        return f"The system the shell command will be executed on is {platform.system()} {platform.release()}, running {info.get('ID')} version {info.get('VERSION_ID', info.get('BUILD_ID'))}. \n"
+    return f"The system the shell command will be executed on is {platform.system()} {platform.release()}. \n"
+
+
+def _describe_shell(shell):
+    if not shell:
+        return ""
+    return f"The shell is {os.path.basename(shell)}. \n"
+
+
+def _describe_tools(path):
+    # Sorted, so the text doesn't depend on the order of the PATH
+    installed = sorted(tool for tool in OPTIONAL_TOOLS if shutil.which(tool, path=path))
+    missing = sorted(tool for tool in OPTIONAL_TOOLS if tool not in installed)
+    return f"Installed optional tools: {', '.join(installed) or 'none'}. Not installed: {', '.join(missing) or 'none'}. \n"
+
+
+class SystemContext:
+    """
+    Describe the system suggested commands run on: OS and distribution, shell
+    and, with `tools`, which optional tools are on the PATH.
+
+    The description is cached in `system_context.json` in the config
+    directory together with the modification times of the files it was
+    derived from: the os-release files, the shell and every PATH directory.
+    It is only computed again once one of those changed, so the system prompt
+    stays byte-identical between runs and providers can reuse their cache of
+    its prefix.
+    """
+
+    def __init__(self, path=None, tools=True):
+        self.path = path or os.path.join(get_config_dir(), "system_context.json")
+        self.tools = tools
+
+    def _sources(self):
+        """
+        Return the key the description depends on and the files to check for changes.
+        """
+        shell = os.environ.get("SHELL", "")
+        search_path = os.environ.get("PATH", "")
+        key = {
+            "version": CONTEXT_VERSION,
+            "system": platform.system(),
+            "release": platform.release(),
+            "shell": shell,
+            "path": search_path if self.tools else None,
+        }
+        files = list(OS_RELEASE_PATHS)
+        if shell:
+            files.append(shell)
+        if self.tools:
+            # Installing or removing a tool changes the mtime of its directory
+            files.extend(directory for directory in search_path.split(os.pathsep) if directory)
+        return key, files
+
+    def _compute(self):
+        shell = os.environ.get("SHELL", "")
+        description = get_platform_string() + _describe_shell(shell)
+        if self.tools:
+            description += _describe_tools(os.environ.get("PATH", ""))
+        return description
+
+    def get(self):
+        """
+        Return the description, from the cache while none of its sources changed.
+        """
+        key, files = self._sources()
+        try:
+            with open(self.path, encoding="utf-8") as cached:
+                entry = json.load(cached)
+            if entry["key"] == key and all(_mtime(path) == mtime for path, mtime in entry["mtimes"].items()):
+                return entry["description"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+        debug_print("Computing the system context")
+        # Taken before computing, so a change made meanwhile is seen next time
+        mtimes = {path: _mtime(path) for path in files}
+        description = self._compute()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as cached:
+                json.dump({"key": key, "mtimes": mtimes, "description": description}, cached)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            debug_print(f"Caching the system context failed: {e}")
+        return description
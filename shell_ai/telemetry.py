@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from shell_ai.config import debug_print, get_config_dir
+
+DEFAULT_SPAN_LOG_MAX_BYTES = 1024 * 1024
+DEFAULT_SPAN_LOG_BACKUPS = 3
+
+
+class SpanLog:
+    """
+    Append timing spans as JSON lines to a local log that is rotated by size.
+
+    Once the log grows beyond `max_bytes` it is renamed to `spans.jsonl.1`,
+    older files shift up and only `backups` of them are kept.
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_SPAN_LOG_MAX_BYTES, backups=DEFAULT_SPAN_LOG_BACKUPS):
+        self.path = path or os.path.join(get_config_dir(), "spans.jsonl")
+        self.max_bytes = max_bytes
+        self.backups = backups
+        # Groups the spans of one invocation
+        self.run_id = uuid.uuid4().hex[:12]
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, name, duration, **attributes):
+        entry = {"ts": round(time.time(), 3), "run": self.run_id, "span": name, "ms": round(duration * 1000, 3)}
+        entry.update((key, value) for key, value in attributes.items() if value is not None)
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            try:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line)
+                self._file.flush()
+                if self._file.tell() > self.max_bytes:
+                    self._rotate()
+            except OSError as e:
+                debug_print(f"Writing the span log failed: {e}")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def read(self):
+        """
+        Yield every logged span, oldest first.
+        """
+        paths = [f"{self.path}.{index}" for index in range(self.backups, 0, -1)] + [self.path]
+        for path in paths:
+            try:
+                with open(path, encoding="utf-8") as log:
+                    for line in log:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            # A line cut short by a crash or a concurrent rotation
+                            continue
+            except OSError:
+                continue
+
+
+_span_log = None
+
+
+def configure(span_log):
+    """
+    Send spans to `span_log`, or drop them when it is None.
+    """
+    global _span_log
+    _span_log = span_log
+
+
+def record_span(name, duration, **attributes):
+    """
+    Record a span of `duration` seconds that was measured elsewhere.
+    """
+    if _span_log is not None:
+        _span_log.record(name, duration, **attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time the body of the `with` block as a span.
+
+    Yields the attribute dict, so details only known at the end, such as
+    token counts, can still be added. Failures are recorded with the type of
+    the exception.
+    """
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, **attributes)
+
+
+def token_usage(response):
+    """
+    Return the (prompt, completion) token counts of a LangChain `LLMResult`, None when unknown.
+    """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    prompt_tokens = completion_tokens = None
+    for generation in response.generations[0]:
+        metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+        if metadata:
+            prompt_tokens = (prompt_tokens or 0) + metadata.get("input_tokens", 0)
+            completion_tokens = (completion_tokens or 0) + metadata.get("output_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(spans, since=None):
+    """
+    Group spans by name, provider and model and compute latency percentiles and mean token counts.
+
+    Returns a list of dicts sorted by span name, only spans newer than the
+    `since` timestamp are counted.
+    """
+    groups = {}
+    for entry in spans:
+        if since is not None and entry.get("ts", 0) < since:
+            continue
+        key = (entry.get("span"), entry.get("provider") or entry.get("module") or "", entry.get("model") or "")
+        groups.setdefault(key, []).append(entry)
+
+    rows = []
+    for (name, provider, model), entries in sorted(groups.items()):
+        durations = sorted(entry["ms"] for entry in entries)
+        completion_tokens = [entry["completion_tokens"] for entry in entries if entry.get("completion_tokens") is not None]
+        rows.append({
+            "span": name,
+            "provider": provider,
+            "model": model,
+            "count": len(entries),
+            "errors": sum(1 for entry in entries if "error" in entry),
+            "p50": _percentile(durations, 0.5),
+            "p95": _percentile(durations, 0.95),
+            "max": durations[-1],
+            "completion_tokens": sum(completion_tokens) / len(completion_tokens) if completion_tokens else None,
+        })
+    return rows
+
+
+def print_stats(span_log, days=None):
+    """
+    Print where the time of recent runs went, per span, provider and model.
+    """
+    since = time.time() - days * 24 * 60 * 60 if days else None
+    spans = list(span_log.read())
+    rows = summarize(spans, since=since)
+    if not rows:
+        print(f"No timings recorded yet in {span_log.path}")
+        return
+    period = f"the last {days:g} days" if days else "all recorded runs"
+    print(f"Timings over {period}, from {span_log.path}:")
+    print(f"  {'span':<22} {'provider / module':<24} {'model':<26} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'tokens':>7}")
+    for row in rows:
+        tokens = f"{row['completion_tokens']:.0f}" if row["completion_tokens"] is not None else "-"
+        print(
+            f"  {row['span']:<22} {row['provider'][:24]:<24} {row['model'][:26]:<26} {row['count']:>6} {row['errors']:>6} "
+            f"{row['p50']:>9.1f} {row['p95']:>9.1f} {row['max']:>9.1f} {tokens:>7}"
+        )
+
+    # Model latency per day shows whether a provider got slower over time
+    days_seen = {}
+    for entry in spans:
+        if entry.get("span") != "generate" or "error" in entry or (since is not None and entry.get("ts", 0) < since):
+            continue
+        day = time.strftime("%Y-%m-%d", time.localtime(entry["ts"]))
+        days_seen.setdefault((day, entry.get("provider", ""), entry.get("model", "")), []).append(entry["ms"])
+    if days_seen:
+        print()
+        print("Model requests per day:")
+        print(f"  {'day':<11} {'provider':<10} {'model':<26} {'count':>6} {'p50 ms':>9} {'p95 ms':>9}")
+        for (day, provider, model), durations in sorted(days_seen.items()):
+            durations.sort()
+            print(
+                f"  {day:<11} {provider[:10]:<10} {model[:26]:<26} {len(durations):>6} "
+                f"{_percentile(durations, 0.5):>9.1f} {_percentile(durations, 0.95):>9.1f}"
+            )
@@ -0,0 +1,73 @@
+import io
+import json
+import threading
+
+import pytest
+
+from shell_ai.batch import read_prompts, run_batch
+from shell_ai.suggestion_source import INDEX, Suggestion
+
+
+class FakeService:
+    """
+    Stands in for `SuggestionService` without a provider.
+    """
+
+    def __init__(self):
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def iter_suggestions(self, prompt, use_cache=True, cancel_event=None):
+        with self._lock:
+            self.prompts.append(prompt)
+        if prompt == "fail":
+            raise RuntimeError("provider unavailable")
+        if prompt == "nothing":
+            return
+        yield Suggestion(f"echo accepted {prompt}", INDEX)
+        yield f"echo {prompt}"
+
+
+class BrokenOutput:
+    """
+    An output whose reader went away after `accepted` lines.
+    """
+
+    def __init__(self, accepted=0):
+        self.lines = []
+        self.accepted = accepted
+
+    def write(self, text):
+        if len(self.lines) >= self.accepted:
+            raise BrokenPipeError(32, "Broken pipe")
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+
+def test_read_prompts():
+    lines = ["list files\n", "\n", '{"id": "a", "prompt": "pwd"}', '{"prompt": ""}', "{not json", '{"prompt": 1}']
+    assert list(read_prompts(lines)) == [(1, "list files"), ("a", "pwd"), (4, None), (5, None), (6, None)]
+
+
+def test_run_batch_writes_a_line_per_prompt():
+    output = io.StringIO()
+    failures = run_batch(FakeService(), ["one", "fail", "nothing", "{bad"], output, workers=2)
+    results = {result["id"]: result for result in map(json.loads, output.getvalue().splitlines())}
+    assert failures == 3
+    assert results[1]["command"] == "echo one"
+    assert results[1]["candidates"] == ["echo one", "echo accepted one"]
+    assert results[2]["error"] == "RuntimeError: provider unavailable"
+    assert results[3]["error"] == "No command could be generated"
+    assert "error" in results[4]
+
+
+def test_run_batch_stops_once_writing_fails():
+    service = FakeService()
+    output = BrokenOutput(accepted=1)
+    with pytest.raises(BrokenPipeError):
+        run_batch(service, [f"prompt {number}" for number in range(100)], output, workers=1)
+    assert len(output.lines) == 1
+    # Reading ahead of the worker is bounded, the rest of the input is never started
+    assert len(service.prompts) < 10
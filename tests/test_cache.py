@@ -0,0 +1,25 @@
+from shell_ai import cache
+from shell_ai.cache import TokenBudget
+
+
+def test_token_budget_is_shared_and_refills(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    path = str(tmp_path / "cache.sqlite3")
+    budget = TokenBudget("speculation", 1000, 3600, path=path)
+    assert budget.take(600)
+    # Another process sees what this one spent
+    assert not TokenBudget("speculation", 1000, 3600, path=path).take(600)
+    assert budget.take(400)
+    assert not budget.take(1)
+    now[0] += 1800
+    assert budget.take(500)
+    assert not budget.take(1)
+
+
+def test_token_budget_limits(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    assert not TokenBudget("disabled", 0, 3600, path=path).take(1)
+    # More than the whole budget is spent once it is full
+    assert TokenBudget("small", 10, 3600, path=path).take(50)
+    assert not TokenBudget("small", 10, 3600, path=path).take(1)
@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+from shell_ai.code_parser import CommandStreamParser, _repair_json, code_parser, iter_json_values, parse_commands
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"command": "ls"}', [{"command": "ls"}]),
+        ('Sure:\n```json\n{"command": "ls"}\n```\nDone.', [{"command": "ls"}]),
+        ('Use `{"command": "ls"}` or `["pwd"]`', [{"command": "ls"}, ["pwd"]]),
+        ('{"command": "echo }{ ]["}', [{"command": "echo }{ ]["}]),
+        ('{"command": "echo \\"{\\""}', [{"command": 'echo "{"'}]),
+        ('{"commands": ["a", "b"]} and {"command": "c"}', [{"commands": ["a", "b"]}, {"command": "c"}]),
+        ("no json here", []),
+        ('{"command": "ls"', []),
+    ],
+)
+def test_iter_json_values(text, expected):
+    assert list(iter_json_values(text)) == expected
+
+
+def test_iter_json_values_skips_to_nested_values():
+    # The outer braces never form valid JSON, the inner object does
+    assert list(iter_json_values('{ this is not json {"command": "ls"} }')) == [{"command": "ls"}]
+
+
+@pytest.mark.parametrize(
+    "candidate, expected",
+    [
+        ("{'command': 'ls -la'}", {"command": "ls -la"}),
+        ('{"commands": ["a", "b",]}', {"commands": ["a", "b"]}),
+        ('{"command": "ls",\n}', {"command": "ls"}),
+        ("{'command': 'it\\'s'}", {"command": "it's"}),
+        ("{'command': 'say \"hi\"'}", {"command": 'say "hi"'}),
+        ('{"command": "printf \'a\nb\'"}', {"command": "printf 'a\nb'"}),
+        ('{"command": "a\tb"}', {"command": "a\tb"}),
+        ('{"command": "grep -P \'\\d+\' f"}', {"command": "grep -P '\\d+' f"}),
+        ('{"command": "echo \\"x\\" \\\\ y"}', {"command": 'echo "x" \\ y'}),
+        ('{"command": "echo don\'t"}', {"command": "echo don't"}),
+    ],
+)
+def test_repair_json(candidate, expected):
+    assert json.loads(_repair_json(candidate)) == expected
+
+
+def test_repair_json_leaves_commas_inside_strings():
+    assert json.loads(_repair_json('{"command": "echo a,]",}')) == {"command": "echo a,]"}
+
+
+@pytest.mark.parametrize(
+    "response, expected",
+    [
+        ('{"command": "ls -la"}', ["ls -la"]),
+        ('{"commands": ["ls", "ls -a"]}', ["ls", "ls -a"]),
+        ('["ls", {"command": "pwd"}]', ["ls", "pwd"]),
+        ("Here you go:\n```json\n{'command': 'du -sh *',}\n```", ["du -sh *"]),
+        ('{"other": 1} then {"command": "ls"}', ["ls"]),
+        ('{"command": ""}', []),
+        ("I can't help with that.", []),
+    ],
+)
+def test_parse_commands(response, expected):
+    assert parse_commands(response) == expected
+
+
+@pytest.mark.parametrize(
+    "markdown, expected",
+    [
+        ("```bash\nls -la\n```", "ls -la\n"),
+        ("Run `ls` or `pwd`", "ls\npwd"),
+        ("ls -la", "ls -la"),
+    ],
+)
+def test_code_parser(markdown, expected):
+    assert code_parser(markdown) == expected
+
+
+def feed_all(parser, chunks):
+    for index, chunk in enumerate(chunks):
+        commands = parser.feed(chunk)
+        if commands:
+            return commands, index
+    return parser.close(), None
+
+
+def test_stream_parser_single_stops_at_the_closing_quote():
+    chunks = ['{"comm', 'and": "ls ', '-la"', "}\n", "Explanation follows"]
+    assert feed_all(CommandStreamParser(single=True), chunks) == (["ls -la"], 2)
+
+
+def test_stream_parser_batch_waits_for_the_list():
+    chunks = ['{"commands": ["ls"', ', "pwd"', "]", "}", " trailing prose"]
+    assert feed_all(CommandStreamParser(), chunks) == (["ls", "pwd"], 3)
+
+
+def test_stream_parser_skips_values_without_commands():
+    chunks = ['{"note": 1} ', '{"command": "ls"}']
+    assert feed_all(CommandStreamParser(), chunks) == (["ls"], 1)
+
+
+def test_stream_parser_invalid_escape_does_not_raise():
+    chunks = ['{"command": "grep -P ', "'\\d+' f\"", "}"]
+    assert feed_all(CommandStreamParser(single=True), chunks)[0] == ["grep -P '\\d+' f"]
+
+
+def test_stream_parser_repairs_single_quotes():
+    chunks = ["```json\n{'command': ", "'ls'", "}\n```"]
+    assert feed_all(CommandStreamParser(single=True), chunks) == (["ls"], 2)
+
+
+def test_stream_parser_without_commands():
+    parser = CommandStreamParser(single=True)
+    assert parser.feed("I can't help with that.") is None
+    assert parser.close() == []
@@ -0,0 +1,39 @@
+import pytest
+
+from shell_ai.command_index import CommandIndex, guarded_words
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = CommandIndex(path=str(tmp_path / "index.sqlite3"))
+    index.add("delete files older than 7 days", "find . -mtime +7 -delete")
+    index.add("find big files", "du -ah | sort -h")
+    return index
+
+
+def test_guarded_words():
+    assert guarded_words("Delete files NOT older than 7 days") == {"delete", "not", "older", "7"}
+    assert guarded_words("list the hidden files") == {"hidden"}
+
+
+@pytest.mark.parametrize(
+    "prompt, expected",
+    [
+        ("delete all the files older than 7 days", ["find . -mtime +7 -delete"]),
+        ("find big file", ["du -ah | sort -h"]),
+        ("delete files newer than 7 days", []),
+        ("delete files older than 70 days", []),
+        ("delete files not older than 7 days", []),
+        ("show the weather", []),
+    ],
+)
+def test_search(index, prompt, expected):
+    assert index.search(prompt) == expected
+
+
+def test_search_sees_commands_added_later(index):
+    index.search("find big files")
+    index.add("find big files", "find . -size +100M")
+    assert sorted(index.search("find big files")) == ["du -ah | sort -h", "find . -size +100M"]
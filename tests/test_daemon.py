@@ -0,0 +1,106 @@
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+
+import pytest
+
+from shell_ai.daemon import DaemonClient, connect_daemon, create_server
+from shell_ai.suggestion_source import INDEX, MODEL, Suggestion, source_of
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="requires Unix domain sockets")
+
+
+class FakeService:
+    """
+    Stands in for `SuggestionService` without a provider.
+    """
+
+    def __init__(self):
+        self.accepted = []
+        self.cancelled = threading.Event()
+
+    def prewarm_connections(self):
+        pass
+
+    def record_accepted(self, prompt, command, ctx=""):
+        self.accepted.append((prompt, command, ctx))
+
+    def iter_suggestions(self, prompt, use_cache=True, cancel_event=None, ctx="", exclude=(), speculative=False):
+        if prompt == "fail":
+            raise RuntimeError("provider unavailable")
+        if prompt == "slow":
+            yield "echo first"
+            # Held open until the client goes away
+            if cancel_event.wait(5):
+                self.cancelled.set()
+            return
+        if prompt == "accepted":
+            yield Suggestion("ls -la", INDEX)
+        for command in ["ls -la", "ls -lah", "find . -maxdepth 1"]:
+            if command not in exclude:
+                yield command
+
+
+@pytest.fixture
+def daemon():
+    # Socket paths are limited to about 100 characters, so not under pytest's tmp_path
+    directory = tempfile.mkdtemp(prefix="shai-")
+    socket_path = os.path.join(directory, "daemon.sock")
+    service = FakeService()
+    server = create_server(service, socket_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield service, socket_path
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+
+
+def test_socket_is_private(daemon):
+    _, socket_path = daemon
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+
+def test_connect_daemon(daemon):
+    _, socket_path = daemon
+    assert connect_daemon(socket_path) is not None
+    assert connect_daemon(socket_path + ".missing") is None
+
+
+def test_suggest_until_done(daemon):
+    _, socket_path = daemon
+    client = DaemonClient(socket_path, timeout=5)
+    assert client.get_suggestions("list files") == ["ls -la", "ls -lah", "find . -maxdepth 1"]
+    assert client.get_suggestions("list files", exclude=["ls -la"]) == ["ls -lah", "find . -maxdepth 1"]
+
+
+def test_suggestions_keep_their_source(daemon):
+    _, socket_path = daemon
+    suggestions = DaemonClient(socket_path, timeout=5).get_suggestions("accepted")
+    assert [source_of(command) for command in suggestions] == [INDEX, MODEL, MODEL, MODEL]
+
+
+def test_accept(daemon):
+    service, socket_path = daemon
+    DaemonClient(socket_path, timeout=5).record_accepted("list files", "ls -la", ctx="$ pwd")
+    assert service.accepted == [("list files", "ls -la", "$ pwd")]
+
+
+def test_error_is_raised(daemon):
+    _, socket_path = daemon
+    with pytest.raises(RuntimeError, match="provider unavailable"):
+        DaemonClient(socket_path, timeout=5).get_suggestions("fail")
+
+
+def test_cancel_closes_the_round(daemon):
+    service, socket_path = daemon
+    cancel_event = threading.Event()
+    suggestions = DaemonClient(socket_path, timeout=5).iter_suggestions("slow", cancel_event=cancel_event)
+    assert next(suggestions) == "echo first"
+    cancel_event.set()
+    assert list(suggestions) == []
+    assert service.cancelled.wait(5)
@@ -0,0 +1,156 @@
+import threading
+
+import pytest
+
+from shell_ai import history
+from shell_ai.history import (
+    BashHistory,
+    CshHistory,
+    FishHistory,
+    KshHistory,
+    ZshHistory,
+    _metafy,
+    _unmetafy,
+    get_history_writer,
+)
+
+WRITERS = [ZshHistory, BashHistory, KshHistory, CshHistory, FishHistory]
+
+COMMANDS = [
+    "ls -la",
+    "echo 'héllo wörld' 日本",
+    "for f in *; do\n  echo $f\ndone",
+    "grep 'a\\nb' file",
+    "printf '%s\\\\n' x",
+    "echo trailing\\",
+    "- cmd: not yaml",
+]
+
+
+@pytest.fixture(autouse=True)
+def no_histfile(monkeypatch):
+    monkeypatch.delenv("HISTFILE", raising=False)
+    monkeypatch.delenv("XDG_DATA_HOME", raising=False)
+
+
+@pytest.mark.parametrize("writer", WRITERS)
+@pytest.mark.parametrize("command", COMMANDS)
+def test_encode_decode_round_trip(writer, command):
+    # "trailing\" can't be told apart from a continued line in the backslash escaped formats
+    if command.endswith("\\") and writer in (ZshHistory, KshHistory, CshHistory):
+        pytest.skip("ambiguous in this format")
+    instance = writer(path="unused")
+    data = instance.encode("ls", 1700000000) + instance.encode(command, 1700000001) + instance.encode("pwd", 1700000002)
+    assert instance.decode(data) == ["ls", command, "pwd"]
+
+
+@pytest.mark.parametrize(
+    "writer, expected",
+    [
+        (ZshHistory, b": 1700000000:0;for x\\\n  done\n"),
+        (BashHistory, b"#1700000000\nfor x\n  done\n"),
+        (KshHistory, b"for x\\\n  done\n"),
+        (CshHistory, b"#+1700000000\nfor x\\\n  done\n"),
+        (FishHistory, b"- cmd: for x\\n  done\n  when: 1700000000\n"),
+    ],
+)
+def test_encode_format(writer, expected):
+    assert writer(path="unused").encode("for x\n  done", 1700000000) == expected
+
+
+def test_fish_escapes_backslashes():
+    assert FishHistory(path="unused").encode("echo a\\nb", 1) == b"- cmd: echo a\\\\nb\n  when: 1\n"
+
+
+def test_zsh_metafy():
+    # "é" is 0xc3 0xa9, both left alone, "日" holds 0x97 which is metafied
+    data = "é日".encode("utf-8")
+    assert _metafy(data) == b"\xc3\xa9\xe6\x83\xb7\xa5"
+    assert _unmetafy(_metafy(data)) == data
+    assert _unmetafy(_metafy(bytes(range(256)))) == bytes(range(256))
+
+
+def test_bash_groups_lines_by_timestamp():
+    data = b"plain old entry\n#1700000000\nfor x\ndo y\ndone\n#1700000001\nls\n"
+    assert BashHistory(path="unused").decode(data) == ["plain old entry", "for x\ndo y\ndone", "ls"]
+
+
+@pytest.mark.parametrize("writer", WRITERS)
+def test_append_and_dedup(tmp_path, writer):
+    path = tmp_path / "history"
+    instance = writer(path=str(path), dedup=2)
+    assert instance.append("ls", 1)
+    assert instance.append("pwd", 2)
+    assert not instance.append("ls", 3)
+    assert not instance.append("pwd", 4)
+    assert instance.append("ls -la", 5)
+    assert instance.decode(path.read_bytes()) == ["ls", "pwd", "ls -la"]
+    assert writer(path=str(path), dedup=0).append("ls -la", 6)
+
+
+def test_dedup_reads_only_the_tail(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "TAIL_BYTES", 64)
+    path = tmp_path / "history"
+    instance = BashHistory(path=str(path), dedup=1)
+    for number in range(50):
+        instance.append(f"echo {number}", number)
+    assert not instance.append("echo 49", 50)
+    assert instance.append("echo 0", 51)
+
+
+def test_append_creates_missing_directories(tmp_path):
+    path = tmp_path / "fish" / "fish_history"
+    assert FishHistory(path=str(path)).append("ls", 1)
+    assert path.read_bytes() == b"- cmd: ls\n  when: 1\n"
+
+
+def test_concurrent_appends_do_not_interleave(tmp_path):
+    path = tmp_path / "history"
+    instance = BashHistory(path=str(path), dedup=0)
+
+    def write(thread):
+        for number in range(50):
+            instance.append(f"echo {thread} {number}\necho done", number)
+
+    threads = [threading.Thread(target=write, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    commands = instance.decode(path.read_bytes())
+    assert len(commands) == 200
+    assert all(command.endswith("\necho done") for command in commands)
+
+
+@pytest.mark.parametrize(
+    "shell, writer",
+    [
+        ("/bin/zsh", ZshHistory),
+        ("/usr/local/bin/bash", BashHistory),
+        ("/bin/rbash", BashHistory),
+        ("/bin/ksh", KshHistory),
+        ("/bin/mksh", KshHistory),
+        ("/bin/csh", CshHistory),
+        ("/usr/bin/tcsh", CshHistory),
+        ("/usr/bin/fish", FishHistory),
+    ],
+)
+def test_get_history_writer(shell, writer):
+    assert type(get_history_writer(shell)) is writer
+
+
+@pytest.mark.parametrize("shell", ["/bin/sh", "", None, "/bin/dash"])
+def test_get_history_writer_unsupported(shell):
+    assert get_history_writer(shell) is None
+
+
+def test_paths(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    assert ZshHistory().path == str(tmp_path / ".zsh_history")
+    monkeypatch.setenv("HISTFILE", "/tmp/custom_history")
+    assert BashHistory().path == "/tmp/custom_history"
+    # csh and fish don't use HISTFILE
+    assert CshHistory().path == str(tmp_path / ".history")
+    assert FishHistory().path == str(tmp_path / ".local" / "share" / "fish" / "fish_history")
+    monkeypatch.setenv("XDG_DATA_HOME", "/data")
+    assert FishHistory().path == "/data/fish/fish_history"
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+
+import pytest
+
+from shell_ai import router
+from shell_ai.router import ProviderRouter, ProviderStats
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(router.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_run_fails_over_on_errors_and_empty_results():
+    calls = []
+
+    def attempt(provider):
+        calls.append(provider)
+        if provider == "openai":
+            raise RuntimeError("unavailable")
+        if provider == "groq":
+            return []
+        return ["ls"]
+
+    assert ProviderRouter(["openai", "groq", "mistral"]).run(attempt) == ["ls"]
+    assert calls == ["openai", "groq", "mistral"]
+
+
+def test_run_raises_the_last_error_when_every_provider_fails():
+    def attempt(provider):
+        raise RuntimeError(f"{provider} unavailable")
+
+    with pytest.raises(RuntimeError, match="groq unavailable"):
+        ProviderRouter(["openai", "groq"]).run(attempt)
+
+
+def test_run_returns_nothing_when_every_provider_answers_empty():
+    assert ProviderRouter(["openai", "groq"]).run(lambda provider: []) == []
+
+
+def test_arun_fails_over_on_errors_and_empty_results():
+    calls = []
+
+    async def attempt(provider):
+        calls.append(provider)
+        if provider == "openai":
+            raise RuntimeError("unavailable")
+        if provider == "groq":
+            return []
+        return ["ls"]
+
+    assert asyncio.run(ProviderRouter(["openai", "groq", "mistral"]).arun(attempt)) == ["ls"]
+    assert calls == ["openai", "groq", "mistral"]
+
+
+def test_circuit_opens_after_the_threshold_and_closes_after_the_cooldown(clock):
+    stats = ProviderStats(failure_threshold=3, cooldown=30)
+    stats.record_failure()
+    stats.record_failure()
+    assert not stats.is_open()
+    stats.record_failure()
+    assert stats.is_open()
+    clock[0] += 29
+    assert stats.is_open()
+    clock[0] += 1
+    assert not stats.is_open()
+    # Still failing after the cooldown opens it again right away
+    stats.record_failure()
+    assert stats.is_open()
+    clock[0] += 30
+    stats.record_success(0.1)
+    stats.record_failure()
+    assert not stats.is_open()
+
+
+def test_open_circuit_is_ranked_last(clock):
+    providers = ProviderRouter(["openai", "groq"], failure_threshold=2, cooldown=30)
+
+    def attempt(provider):
+        if provider == "openai":
+            raise RuntimeError("unavailable")
+        return ["ls"]
+
+    providers.run(attempt)
+    providers.run(attempt)
+    assert providers.summary()["openai"]["open"]
+    assert providers.ranked() == ["groq", "openai"]
+    calls = []
+    providers.run(lambda provider: calls.append(provider) or ["ls"])
+    assert calls == ["groq"]
+    clock[0] += 30
+    assert not providers.summary()["openai"]["open"]
+
+
+def test_ranking_by_p50_and_error_rate():
+    # A threshold the failures below don't reach, so no circuit opens
+    providers = ProviderRouter(["slow", "fast", "flaky"], failure_threshold=10)
+    for latency in (0.9, 1.0, 1.1):
+        providers.stats["slow"].record_success(latency)
+        providers.stats["fast"].record_success(latency / 2)
+        providers.stats["flaky"].record_success(latency / 3)
+    assert providers.ranked() == ["flaky", "fast", "slow"]
+    assert providers.summary()["fast"]["p50"] == 0.5
+    # Half of flaky's requests fail, so it is expected to take twice its p50
+    for _ in range(3):
+        providers.stats["flaky"].record_failure()
+    assert providers.stats["flaky"].error_rate() == 0.5
+    assert providers.ranked() == ["fast", "flaky", "slow"]
+
+
+def test_providers_without_history_are_tried_first():
+    providers = ProviderRouter(["known", "new"])
+    providers.stats["known"].record_success(0.2)
+    assert providers.ranked() == ["new", "known"]
+
+
+def test_arun_race_cancels_the_losers():
+    cancelled = []
+
+    async def attempt(provider):
+        if provider == "slow":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(provider)
+                raise
+            return ["sleep 5"]
+        await asyncio.sleep(0.01)
+        return ["ls"]
+
+    async def race():
+        providers = ProviderRouter(["slow", "fast"], race=2)
+        result = await providers.arun(attempt)
+        # Let the cancellation reach the losing attempt
+        await asyncio.sleep(0)
+        return providers, result
+
+    providers, result = asyncio.run(race())
+    assert result == ["ls"]
+    assert cancelled == ["slow"]
+    # Losing a race says nothing about the provider
+    assert not providers.stats["slow"].outcomes
+
+
+def test_run_race_returns_the_first_result():
+    release = threading.Event()
+
+    def attempt(provider):
+        if provider == "slow":
+            release.wait(5)
+            return ["sleep 5"]
+        return ["ls"]
+
+    try:
+        assert ProviderRouter(["slow", "fast"], race=2).run(attempt) == ["ls"]
+    finally:
+        release.set()
@@ -0,0 +1,281 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from shell_ai import scheduler
+from shell_ai.scheduler import (
+    DECREASE_INTERVAL,
+    RequestScheduler,
+    TokenBucket,
+    is_rate_limited,
+    is_transient,
+    parse_duration,
+)
+
+
+class HTTPError(Exception):
+    """
+    Shaped like the errors the provider clients raise for an HTTP status.
+    """
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    # The shortest pause is always taken
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: low)
+
+
+@pytest.fixture
+def clock(monkeypatch, no_jitter):
+    """
+    Replace the scheduler's clock, sleeping advances it instantly and is recorded.
+
+    Not for tests running an event loop, which reads the same clock.
+    """
+    fake = SimpleNamespace(now=1000.0, sleeps=[])
+
+    def sleep(seconds):
+        fake.sleeps.append(seconds)
+        fake.now += seconds
+
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: fake.now)
+    monkeypatch.setattr(scheduler.time, "sleep", sleep)
+    return fake
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("1.5", 1.5),
+        ("20ms", 0.02),
+        ("6m0s", 360.0),
+        ("2m59.56s", 179.56),
+        ("1h", 3600.0),
+        ("soon", None),
+        (None, None),
+    ],
+)
+def test_parse_duration(value, expected):
+    assert parse_duration(value) == (pytest.approx(expected) if expected is not None else None)
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (HTTPError(429), True),
+        (HTTPError(408), True),
+        (HTTPError(409), True),
+        (HTTPError(500), True),
+        (HTTPError(503), True),
+        (HTTPError(400), False),
+        (HTTPError(401), False),
+        (HTTPError(404), False),
+        (APIConnectionError(), True),
+        (TimeoutError(), True),
+        (ValueError(), False),
+    ],
+)
+def test_is_transient(error, transient):
+    assert is_transient(error) == transient
+
+
+def test_is_rate_limited():
+    assert is_rate_limited(HTTPError(429))
+    assert not is_rate_limited(HTTPError(503))
+    assert not is_rate_limited(ValueError())
+
+
+def test_token_bucket_delay_and_refill(clock):
+    bucket = TokenBucket(60)
+    assert bucket.delay(60, clock.now) == 0
+    bucket.take(60, clock.now)
+    assert bucket.delay(1, clock.now) == pytest.approx(1.0)
+    assert bucket.delay(1, clock.now + 0.5) == pytest.approx(0.5)
+    assert bucket.delay(30, clock.now + 0.5) == pytest.approx(29.5)
+    assert bucket.delay(1, clock.now + 1) == 0
+    # Never more than the capacity, however long it was idle
+    assert bucket.delay(61, clock.now + 600) == 0
+    bucket.take(60, clock.now + 600)
+    assert bucket.delay(1, clock.now + 600) == pytest.approx(1.0)
+
+
+def test_token_bucket_observe_adopts_the_provider_budget(clock):
+    bucket = TokenBucket(60)
+    bucket.observe(120, 10, clock.now)
+    assert bucket.capacity == 120
+    assert bucket.delay(20, clock.now) == pytest.approx(5.0)
+
+
+def test_aimd_halves_on_rate_limits_at_most_once_per_interval(clock):
+    requests = RequestScheduler(max_concurrency=8, retries=0)
+
+    def rate_limited():
+        raise HTTPError(429, {"retry-after": "0"})
+
+    with pytest.raises(HTTPError):
+        requests.run("groq", rate_limited)
+    assert requests.summary()["groq"]["concurrency"] == 4
+    # An answer to a request sent before the decrease doesn't lower it again
+    with pytest.raises(HTTPError):
+        requests.run("groq", rate_limited)
+    assert requests.summary()["groq"]["concurrency"] == 4
+    clock.now += DECREASE_INTERVAL + 0.1
+    with pytest.raises(HTTPError):
+        requests.run("groq", rate_limited)
+    assert requests.summary()["groq"]["concurrency"] == 2
+    assert requests.summary()["groq"]["rate_limited"] == 3
+    for _ in range(3):
+        requests.run("groq", lambda: "ok")
+    assert requests.summary()["groq"]["concurrency"] == pytest.approx(2 + 1 / 2 + 1 / 2.5 + 1 / 2.9)
+
+
+def test_additive_increase_stops_at_the_maximum(clock):
+    requests = RequestScheduler(max_concurrency=2)
+    for _ in range(10):
+        requests.run("groq", lambda: "ok")
+    assert requests.summary()["groq"] == {"concurrency": 2, "in_flight": 0, "rate_limited": 0, "tokens": None}
+
+
+@pytest.mark.parametrize(
+    "headers, pause",
+    [
+        ({"retry-after": "2"}, 2.0),
+        ({"retry-after-ms": "1500", "retry-after": "2"}, 1.5),
+        ({}, scheduler.BACKOFF_BASE),
+    ],
+)
+def test_rate_limited_request_waits_for_retry_after(clock, headers, pause):
+    requests = RequestScheduler(retries=1)
+    calls = []
+
+    def call():
+        calls.append(clock.now)
+        if len(calls) == 1:
+            raise HTTPError(429, headers)
+        return "ok"
+
+    assert requests.run("openai", call) == "ok"
+    assert calls[1] - calls[0] == pytest.approx(pause)
+
+
+def test_rate_limits_without_retry_after_back_off_exponentially(clock):
+    requests = RequestScheduler(retries=3)
+    calls = []
+
+    def call():
+        calls.append(clock.now)
+        if len(calls) <= 3:
+            raise HTTPError(429)
+        return "ok"
+
+    assert requests.run("openai", call) == "ok"
+    pauses = [later - earlier for earlier, later in zip(calls, calls[1:])]
+    assert pauses == pytest.approx([0.5, 1.0, 2.0])
+
+
+def test_observe_token_headers(clock):
+    requests = RequestScheduler()
+    requests.observe_headers(
+        "openai",
+        {"x-ratelimit-limit-tokens": "1000", "x-ratelimit-remaining-tokens": "100", "x-ratelimit-remaining-requests": "10"},
+    )
+    assert requests.summary()["openai"]["tokens"] == 1000
+    requests.run("openai", lambda: "ok", tokens=200)
+    # 100 tokens were left, the other 100 refill at 1000 a minute
+    assert clock.sleeps == [pytest.approx(6.0)]
+
+
+def test_observe_exhausted_requests_blocks_until_the_reset(clock):
+    requests = RequestScheduler()
+    requests.observe_headers("groq", {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2m59.56s"})
+    requests.run("groq", lambda: "ok")
+    assert sum(clock.sleeps) == pytest.approx(179.56)
+
+
+def test_observe_ignores_malformed_headers(clock):
+    requests = RequestScheduler()
+    requests.observe_headers("groq", {"x-ratelimit-remaining-tokens": "lots", "x-ratelimit-limit-tokens": "many"})
+    requests.observe_headers("groq", {"content-type": "application/json"})
+    requests.run("groq", lambda: "ok")
+    assert clock.sleeps == []
+
+
+def test_transient_errors_are_retried(clock):
+    requests = RequestScheduler(retries=3)
+    calls = []
+
+    def call():
+        calls.append(clock.now)
+        if len(calls) <= 2:
+            raise HTTPError(503)
+        return "ok"
+
+    assert requests.run("openai", call) == "ok"
+    assert len(calls) == 3
+    # Doubling backoff, at the low end of its jitter
+    assert clock.sleeps == pytest.approx([0.25, 0.5])
+
+
+@pytest.mark.parametrize("error", [HTTPError(400), HTTPError(401), ValueError("bad request")])
+def test_other_errors_are_not_retried(clock, error):
+    requests = RequestScheduler(retries=3)
+    calls = []
+
+    def call():
+        calls.append(clock.now)
+        raise error
+
+    with pytest.raises(type(error)):
+        requests.run("openai", call)
+    assert len(calls) == 1
+    assert requests.summary()["openai"]["in_flight"] == 0
+
+
+def test_retries_are_limited(clock):
+    requests = RequestScheduler(retries=3)
+    calls = []
+
+    def call():
+        calls.append(clock.now)
+        raise APIConnectionError()
+
+    with pytest.raises(APIConnectionError):
+        requests.run("openai", call, retries=1)
+    assert len(calls) == 2
+
+
+def test_arun_retries_and_cancelling_frees_the_slot(no_jitter, monkeypatch):
+    monkeypatch.setattr(scheduler, "BACKOFF_BASE", 0.01)
+    requests = RequestScheduler(retries=1)
+    calls = []
+
+    async def flaky():
+        calls.append(None)
+        if len(calls) == 1:
+            raise HTTPError(500)
+        return "ok"
+
+    async def hang():
+        await asyncio.sleep(5)
+
+    async def cancel():
+        task = asyncio.ensure_future(requests.arun("openai", hang))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    assert asyncio.run(requests.arun("openai", flaky)) == "ok"
+    assert len(calls) == 2
+    asyncio.run(cancel())
+    assert requests.summary()["openai"]["in_flight"] == 0